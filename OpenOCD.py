@@ -10,50 +10,1042 @@ See http://www.wtfpl.net/ for more details
 #-------------------------------------------------------------------------------------------------
 
 
-import telnetlib
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import io
+import mmap
+import os
+import random
+import socket
 import re
+import selectors
 import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    long
+except NameError:
+    long = int
 
 #-------------------------------------------------------------------------------------------------
 
 def write_raw_sequence(tn, seq):
-    sock = tn.get_socket()
+    sock = tn.Socket
     if sock is not None:
         sock.send(seq)
 
 #-------------------------------------------------------------------------------------------------
 
+#
+# Telnet protocol bytes
+#
+IAC  = 255
+DONT = 254
+DO   = 253
+WONT = 252
+WILL = 251
+SB   = 250
+SE   = 240
+
+#
+# Incremental parser of OpenOCD telnet port output.
+#
+# Received bytes are appended to a growable buffer, telnet negotiation is stripped on the fly.
+# Lines are scanned once from a cursor; a response is complete when the '> ' prompt appears
+# at the start of a line, no matter how it was split across packets.
+#
+class ResponseParser:
+    def __init__(self):
+        self.Buf = bytearray()
+        self.Pos = 0        # start of the current incomplete line
+        self.Scan = 0       # buffer is scanned for line end up to here
+        self.Lines = []     # lines of the current response
+        self.IAC = b''      # incomplete telnet command from previous chunk
+
+    #
+    # Append received bytes, dropping telnet commands.
+    #
+    def Feed(self, Data):
+        if self.IAC:
+            Data = self.IAC + Data
+            self.IAC = b''
+
+        if IAC not in Data:
+            self.Buf += Data
+            return
+
+        Buf = self.Buf
+        n = 0
+        Size = len(Data)
+        while n < Size:
+            i = Data.find(b'\xff', n)
+            if i < 0:
+                Buf += Data[n:]
+                break
+            Buf += Data[n:i]
+            if i + 1 >= Size:
+                self.IAC = Data[i:]
+                break
+            Cmd = Data[i + 1]
+            if IAC == Cmd:
+                Buf.append(IAC)
+                n = i + 2
+            elif Cmd in (DO, DONT, WILL, WONT):
+                if i + 2 >= Size:
+                    self.IAC = Data[i:]
+                    break
+                n = i + 3
+            elif SB == Cmd:
+                j = Data.find(b'\xff\xf0', i + 2)
+                if j < 0:
+                    self.IAC = Data[i:]
+                    break
+                n = j + 2
+            else:
+                n = i + 2
+
+    #
+    # Returns lines of the next complete response, or None if more data needed.
+    #
+    def Next(self):
+        Buf = self.Buf
+        while True:
+            if Buf.startswith(b'> ', self.Pos):
+                Lines = self.Lines
+                self.Lines = []
+                del Buf[:self.Pos + 2]
+                self.Pos = 0
+                self.Scan = 0
+                return Lines
+
+            i = Buf.find(b'\n', self.Scan)
+            if i < 0:
+                self.Scan = len(Buf)
+                return None
+
+            #
+            # Carriage return moves to the line start: keep only text after the last one,
+            # so prompt erasing before asynchronous messages leaves no garbage.
+            #
+            Line = bytes(Buf[self.Pos:i]).rstrip(b'\r')
+            j = Line.rfind(b'\r')
+            if j >= 0:
+                Line = Line[j + 1:]
+            Line = Line.replace(b'\0', b'')
+            if Line:
+                self.Lines.append(Line.decode('utf-8', 'replace'))
+            self.Pos = self.Scan = i + 1
+
+#
+# OpenOCD telnet port connection.
+#
+class TelnetTransport:
+    Port = 4444
+    Tcl = False
+
+    def __init__(self, Host="localhost", Port=4444, Timeout=None):
+        self.Socket = socket.create_connection((Host, Port), Timeout)
+        self.Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.Parser = ResponseParser()
+        self.Unsolicited = collections.deque()
+        self.Banner = self.Readout()
+
+    def Close(self):
+        self.Socket.close()
+
+    def Write(self, Text):
+        self.Socket.sendall(Text.encode('utf-8'))
+
+    def Recv_(self):
+        Data = self.Socket.recv(0x10000)
+        if not Data:
+            raise EOFError('Connection closed by OpenOCD')
+        self.Parser.Feed(Data)
+
+    def Next_(self):
+        while True:
+            Lines = self.Parser.Next()
+            if Lines is not None:
+                return Lines
+            self.Recv_()
+
+    def Readout(self):
+        if self.Unsolicited:
+            return self.Unsolicited.popleft()
+        return self.Next_()
+
+    #
+    # Asynchronous message already received, None if there is none yet (doesn't read socket).
+    #
+    def Ready_(self):
+        if self.Unsolicited:
+            return self.Unsolicited.popleft()
+        return self.Parser.Next()
+
+    #
+    # Response to the command Text. Asynchronous messages (target halted etc.) received before
+    # its echo are queued, Readout() returns them later.
+    #
+    def Response(self, Text):
+        Echo = Text.strip()
+        while True:
+            Lines = self.Next_()
+            if Lines and Lines[0].strip() == Echo:
+                return Lines
+            self.Unsolicited.append(Lines)
+
+#
+# OpenOCD Tcl RPC port connection.
+#
+# Messages in both directions are terminated by 0x1a, there is no echo and no prompt.
+# Commands written by Write() are wrapped into 'capture' to get the same text the telnet port prints,
+# and Readout() returns it with the command line prepended, as the telnet echo would be.
+# Eval() returns raw Tcl result of the script, for machine-readable commands.
+#
+# Write(Raw=True) sends the script as is, Readout() returns its raw result then.
+#
+# Target event notifications are enabled; Readout() with no command pending waits for the 'halted' event.
+#
+class TclTransport:
+    Port = 6666
+    Tcl = True
+
+    def __init__(self, Host="localhost", Port=6666, Timeout=None):
+        self.Socket = socket.create_connection((Host, Port), Timeout)
+        self.Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.Buf = bytearray()
+        self.Scan = 0
+        self.Pending = []   # commands written, their results not read yet
+        self.Events = []    # notifications received
+        self.Banner = self.Eval('tcl_notifications on').splitlines()
+
+    def Close(self):
+        self.Socket.close()
+
+    #
+    # Read next message of any kind.
+    #
+    def Message(self):
+        while True:
+            Msg = self.Split_()
+            if Msg is not None:
+                return Msg
+            self.Recv_()
+
+    def Recv_(self):
+        Data = self.Socket.recv(0x10000)
+        if not Data:
+            raise EOFError('Connection closed by OpenOCD')
+        self.Buf += Data
+
+    #
+    # Next complete message of the buffer, None if there is none.
+    #
+    def Split_(self):
+        Buf = self.Buf
+        i = Buf.find(b'\x1a', self.Scan)
+        if i < 0:
+            self.Scan = len(Buf)
+            return None
+        Msg = bytes(Buf[:i]).decode('utf-8', 'replace')
+        del Buf[:i + 1]
+        self.Scan = 0
+        return Msg
+
+    @staticmethod
+    def IsEvent(Msg):
+        return Msg.startswith('type target_')
+
+    #
+    # Read next command result, notifications are queued to Events.
+    #
+    def Receive(self):
+        while True:
+            Msg = self.Message()
+            if not TclTransport.IsEvent(Msg):
+                return Msg
+            self.Events.append(Msg.strip())
+
+    def Send(self, Script):
+        self.Socket.sendall(Script.encode('utf-8') + b'\x1a')
+
+    def Eval(self, Script):
+        self.Write(Script, Raw=True)
+        return self.Readout()
+
+    def Response(self, Text):
+        return self.Readout()
+
+    #
+    # Write one or more '\n' separated commands at once.
+    #
+    def Write(self, Text, Raw=False):
+        Data = b''
+        for Line in Text.rstrip('\n').split('\n'):
+            self.Pending.append((Line, Raw))
+            Data += (Line if Raw else 'capture {%s}' % Line).encode('utf-8') + b'\x1a'
+        self.Socket.sendall(Data)
+
+    def Readout(self):
+        if self.Pending:
+            Text, Raw = self.Pending.pop(0)
+            Msg = self.Receive()
+            if Raw:
+                return Msg
+            return [Text] + [s.rstrip('\r') for s in Msg.splitlines() if s.strip('\r')]
+
+        while not any(Event.endswith(' halted') for Event in self.Events):
+            Msg = self.Message()
+            if TclTransport.IsEvent(Msg):
+                self.Events.append(Msg.strip())
+        Lines = self.Events
+        self.Events = []
+        return Lines
+
+    #
+    # Notifications up to 'halted' one if already received, None otherwise (doesn't read socket).
+    #
+    def Ready_(self):
+        if self.Pending:
+            return None
+        while True:
+            Msg = self.Split_()
+            if Msg is None:
+                break
+            if TclTransport.IsEvent(Msg):
+                self.Events.append(Msg.strip())
+        if not any(Event.endswith(' halted') for Event in self.Events):
+            return None
+        Lines = self.Events
+        self.Events = []
+        return Lines
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Minimal ELF reader (32 and 64 bit, both byte orders): sections and symbols.
+#
+class ElfFile:
+    PT_LOAD = 1
+    SHT_SYMTAB = 2
+    STT_OBJECT = 1
+    STT_FUNC = 2
+    EM_ARM = 40
+
+    def __init__(self, Data):
+        if Data[:4] != b'\x7fELF':
+            raise ValueError('Not an ELF file')
+        self.Data = Data
+        self.Bits = 64 if 2 == Data[4] else 32
+        self.Order = '>' if 2 == Data[5] else '<'
+        if 32 == self.Bits:
+            Header = struct.unpack_from(self.Order + 'HHIIIIIHHHHHH', Data, 16)
+        else:
+            Header = struct.unpack_from(self.Order + 'HHIQQQIHHHHHH', Data, 16)
+        self.Machine = Header[1]
+        self.Entry = Header[3]
+        self.PhOff, self.ShOff = Header[4], Header[5]
+        self.PhEntSize, self.PhNum = Header[8], Header[9]
+        self.ShEntSize, self.ShNum = Header[10], Header[11]
+
+        #
+        # (Type, Addr, Offset, Size, Link, EntSize)
+        #
+        Fmt = self.Order + ('IIIIIIIIII' if 32 == self.Bits else 'IIQQQQIIQQ')
+        self.Sections = []
+        for n in range(0, self.ShNum):
+            Sh = struct.unpack_from(Fmt, Data, self.ShOff + n * self.ShEntSize)
+            self.Sections.append((Sh[1], Sh[3], Sh[4], Sh[5], Sh[6], Sh[9]))
+
+    @staticmethod
+    def Open(FileName):
+        with open(FileName, 'rb') as f:
+            return ElfFile(f.read())
+
+    def String_(self, Section, Offset):
+        Start = self.Sections[Section][2] + Offset
+        return bytes(self.Data[Start:self.Data.find(b'\0', Start)]).decode('utf-8', 'replace')
+
+    #
+    # Yields (Addr, Data) of loadable segments, by physical (load) address. Data is memoryview of file data.
+    #
+    def Segments(self):
+        Fmt = self.Order + ('IIIIIIII' if 32 == self.Bits else 'IIQQQQQQ')
+        View = memoryview(self.Data)
+        for n in range(0, self.PhNum):
+            Ph = struct.unpack_from(Fmt, self.Data, self.PhOff + n * self.PhEntSize)
+            if 32 == self.Bits:
+                Type, Offset, _, PAddr, FileSize = Ph[:5]
+            else:
+                Type, _, Offset, _, PAddr, FileSize = Ph[:6]
+            if ElfFile.PT_LOAD == Type and FileSize:
+                yield PAddr, View[Offset:Offset + FileSize]
+
+    #
+    # Yields (Name, Value, Size, Type) of defined symbols.
+    #
+    def Symbols(self):
+        Fmt = self.Order + ('IIIBBH' if 32 == self.Bits else 'IBBHQQ')
+        for Type, _, Offset, Size, Link, EntSize in self.Sections:
+            if ElfFile.SHT_SYMTAB != Type or not EntSize:
+                continue
+            for Pos in range(Offset, Offset + Size, EntSize):
+                if 32 == self.Bits:
+                    Name, Value, SymSize, Info, _, Index = struct.unpack_from(Fmt, self.Data, Pos)
+                else:
+                    Name, Info, _, Index, Value, SymSize = struct.unpack_from(Fmt, self.Data, Pos)
+                if Name and Index:
+                    yield self.String_(Link, Name), Value, SymSize, Info & 0xf
+
+#
+# Image file parsed on host: sorted list of (Addr, Data) segments.
+# Binary and ELF data are memoryviews of mapped file, HEX and S-record data is decoded once.
+#
+class LocalImage:
+    #
+    # Parsed images by (path, format, address): (mtime, size, hash, image).
+    #
+    Cache = {}
+
+    def __init__(self, Segments=()):
+        self.Segments = []
+        for Addr, Data in Segments:
+            self.Add(Addr, Data)
+
+    def Add(self, Addr, Data):
+        i = bisect.bisect_right([Start for Start, _ in self.Segments], Addr)
+        self.Segments.insert(i, (Addr, memoryview(Data)))
+
+    def __iter__(self):
+        return iter(self.Segments)
+
+    def __len__(self):
+        return len(self.Segments)
+
+    def Size(self):
+        return sum([len(Data) for _, Data in self.Segments])
+
+    #
+    # Parse image file. Format is detected by content unless specified.
+    # Binary image is placed at Addr, other formats are offset by Addr from their load addresses (as 'load_image' does).
+    #
+    @staticmethod
+    def Open(FileName, Addr=0, Bin=False, IHex=False, Elf=False, S19=False):
+        Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+        Key = (os.path.abspath(FileName), Format, Addr)
+        Stat = os.stat(FileName)
+        Cached = LocalImage.Cache.get(Key)
+        if Cached and Cached[0] == Stat.st_mtime and Cached[1] == Stat.st_size:
+            return Cached[3]
+
+        with open(FileName, 'rb') as f:
+            Data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if Stat.st_size else b''
+        Hash = hashlib.sha1(Data).hexdigest()
+        if Cached and Cached[2] == Hash:
+            LocalImage.Cache[Key] = (Stat.st_mtime, Stat.st_size, Hash, Cached[3])
+            return Cached[3]
+
+        Image = LocalImage.Parse(Data, Addr, Format)
+        LocalImage.Cache[Key] = (Stat.st_mtime, Stat.st_size, Hash, Image)
+        return Image
+
+    #
+    # Parse image in memory, Format is 'bin', 'ihex', 'elf', 's19' or None to detect.
+    #
+    @staticmethod
+    def Parse(Data, Addr=0, Format=None):
+        if Format is None:
+            Format = 'elf' if Data[:4] == b'\x7fELF' else 'ihex' if Data[:1] == b':' else \
+                's19' if re.match(b'S[0-9][0-9A-Fa-f]{2}', bytes(Data[:4])) else 'bin'
+        if 'bin' == Format:
+            return LocalImage([(Addr, Data)])
+        if 'elf' == Format:
+            return LocalImage([(Addr + SegAddr, SegData) for SegAddr, SegData in ElfFile(Data).Segments()])
+        Records = LocalImage.HexRecords_ if 'ihex' == Format else LocalImage.SRecords_
+        Image = LocalImage()
+        for Start, Run in LocalImage.Runs_(Records(bytes(Data).decode('ascii').splitlines())):
+            Image.Add(Addr + Start, Run)
+        return Image
+
+    #
+    # Merge (Addr, Bytes) records into contiguous runs.
+    #
+    @staticmethod
+    def Runs_(Records):
+        Runs = []
+        for Addr, Data in sorted(Records, key=lambda Record: Record[0]):
+            if Runs and Runs[-1][0] + len(Runs[-1][1]) == Addr:
+                Runs[-1][1].extend(Data)
+            elif Runs and Runs[-1][0] + len(Runs[-1][1]) > Addr:
+                Start, Run = Runs[-1]
+                Run[Addr - Start:Addr - Start + len(Data)] = Data
+            else:
+                Runs.append((Addr, bytearray(Data)))
+        return Runs
+
+    @staticmethod
+    def Record_(Line, Sum):
+        Record = bytearray.fromhex(Line)
+        if Sum(Record) & 0xff:
+            raise ValueError('Bad checksum: %s' % Line)
+        return Record
+
+    #
+    # Intel HEX data records as (Addr, Bytes).
+    #
+    @staticmethod
+    def HexRecords_(Lines):
+        Base = 0
+        for Line in Lines:
+            Line = Line.strip()
+            if not Line.startswith(':'):
+                continue
+            Record = LocalImage.Record_(Line[1:], sum)
+            Count, Offset, Type = Record[0], (Record[1] << 8) | Record[2], Record[3]
+            if 0 == Type:
+                yield Base + Offset, Record[4:4 + Count]
+            elif 1 == Type:
+                break
+            elif 2 == Type:
+                Base = ((Record[4] << 8) | Record[5]) << 4
+            elif 4 == Type:
+                Base = ((Record[4] << 8) | Record[5]) << 16
+
+    #
+    # Motorola S-record (S1/S2/S3) data records as (Addr, Bytes).
+    #
+    @staticmethod
+    def SRecords_(Lines):
+        for Line in Lines:
+            Line = Line.strip()
+            if len(Line) < 4 or Line[0] != 'S' or Line[1] not in '123':
+                continue
+            Record = LocalImage.Record_(Line[2:], lambda Record: sum(Record) + 1)
+            AddrSize = int(Line[1]) + 1
+            Addr = 0
+            for Byte in Record[1:1 + AddrSize]:
+                Addr = (Addr << 8) | Byte
+            yield Addr, Record[1 + AddrSize:-1]
+
+#
+# Symbols (functions and objects) as sorted address intervals.
+# Starts/Sizes are kept in arrays, lookup is binary search; name index is built on first use.
+#
+class SymbolTable:
+    #
+    # Parsed tables are cached there by ELF file hash, None disables the cache.
+    #
+    CacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'OpenOCD.py')
+    Magic = b'OCDSYM01'
+
+    def __init__(self, Symbols=()):
+        Sorted = sorted([(Addr, Size, Name) for Name, Addr, Size in Symbols])
+        self.Starts = array.array('L', [Addr for Addr, _, _ in Sorted])
+        self.Sizes = array.array('L', [Size for _, Size, _ in Sorted])
+        self.Names = [Name for _, _, Name in Sorted]
+        self.Index = None
+
+    #
+    # Function and object symbols of ELF file, ARM Thumb bit is cleared.
+    #
+    @staticmethod
+    def FromElf(FileName, Types=(ElfFile.STT_FUNC, ElfFile.STT_OBJECT)):
+        Elf = ElfFile.Open(FileName)
+        Mask = ~1 if ElfFile.EM_ARM == Elf.Machine else ~0
+        return SymbolTable([(Name, Value & Mask, Size) for Name, Value, Size, Type in Elf.Symbols() if Type in Types])
+
+    #
+    # Same as FromElf, using on-disk cache keyed by SHA-1 of the file.
+    #
+    @staticmethod
+    def Load(FileName):
+        if not SymbolTable.CacheDir:
+            return SymbolTable.FromElf(FileName)
+
+        Hash = hashlib.sha1()
+        with open(FileName, 'rb') as f:
+            for Chunk in iter(lambda: f.read(0x100000), b''):
+                Hash.update(Chunk)
+        CacheName = os.path.join(SymbolTable.CacheDir, Hash.hexdigest() + '.sym')
+
+        try:
+            with open(CacheName, 'rb') as f:
+                return SymbolTable.Unpack_(f.read())
+        except (IOError, OSError, ValueError):
+            pass
+
+        Table = SymbolTable.FromElf(FileName)
+        try:
+            if not os.path.isdir(SymbolTable.CacheDir):
+                os.makedirs(SymbolTable.CacheDir)
+            with open(CacheName + '.tmp', 'wb') as f:
+                f.write(Table.Pack_())
+            os.replace(CacheName + '.tmp', CacheName)
+        except (IOError, OSError):
+            pass
+        return Table
+
+    #
+    # Cache file: magic, item size, byte order, count, starts, sizes, '\0' separated names.
+    #
+    def Pack_(self):
+        Header = struct.pack('<8sBBL', SymbolTable.Magic, self.Starts.itemsize, 'little' == sys.byteorder, len(self.Starts))
+        return Header + self.Starts.tobytes() + self.Sizes.tobytes() + '\0'.join(self.Names).encode('utf-8')
+
+    @staticmethod
+    def Unpack_(Data):
+        Magic, ItemSize, Little, Count = struct.unpack_from('<8sBBL', Data)
+        Table = SymbolTable()
+        if Magic != SymbolTable.Magic or ItemSize != Table.Starts.itemsize or Little != ('little' == sys.byteorder):
+            raise ValueError('Incompatible symbols cache')
+        Pos = struct.calcsize('<8sBBL')
+        Table.Starts.frombytes(Data[Pos:Pos + Count * ItemSize])
+        Table.Sizes.frombytes(Data[Pos + Count * ItemSize:Pos + 2 * Count * ItemSize])
+        Table.Names = Data[Pos + 2 * Count * ItemSize:].decode('utf-8').split('\0') if Count else []
+        if len(Table.Names) != Count:
+            raise ValueError('Broken symbols cache')
+        return Table
+
+    def __len__(self):
+        return len(self.Starts)
+
+    #
+    # Address of 'name' or 'name+offset'.
+    #
+    def Address(self, Name):
+        Offset = 0
+        if '+' in Name:
+            Name, OffsetText = Name.split('+', 1)
+            Offset = int(OffsetText, 0)
+        i = self.IndexOf(Name.strip())
+        return self.Starts[i] + Offset
+
+    def Size(self, Name):
+        return self.Sizes[self.IndexOf(Name)]
+
+    def IndexOf(self, Name):
+        if self.Index is None:
+            self.Index = dict([(SymName, i) for i, SymName in enumerate(self.Names)])
+        if Name not in self.Index:
+            raise ValueError('Unknown symbol %s' % Name)
+        return self.Index[Name]
+
+    #
+    # 'name+0x1c' for address within a symbol, hex address otherwise.
+    #
+    def Symbolize(self, Addr):
+        i = self.Find(Addr)
+        if i < 0:
+            return '0x%08x' % Addr
+        Offset = Addr - self.Starts[i]
+        return '%s+0x%x' % (self.Names[i], Offset) if Offset else self.Names[i]
+
+    #
+    # Returns index of the function containing Addr, or -1.
+    # Symbol without size spans up to the next one.
+    #
+    def Find(self, Addr):
+        i = bisect.bisect_right(self.Starts, Addr) - 1
+        if i < 0:
+            return -1
+        Size = self.Sizes[i]
+        if Size and Addr >= self.Starts[i] + Size:
+            return -1
+        return i
+
+    #
+    # Returns (Name, Start) of the function containing Addr, or None.
+    #
+    def Lookup(self, Addr):
+        i = self.Find(Addr)
+        return None if i < 0 else (self.Names[i], self.Starts[i])
+
+#
+# Snapshots file: each snapshot is stored as blocks changed since the previous one, zlib compressed.
+# Every KeyInterval-th snapshot (and one with different regions) is stored whole.
+#
+# Record: length and key flag ('<LB'), compressed payload: time, block size, region count ('<dLL'),
+# per region its address, size, number of blocks stored ('<QQL') followed by block index ('<L') and data of each.
+#
+class SnapshotStore:
+    Magic = b'OCDSNAP1'
+    KeyInterval = 32
+
+    def __init__(self, FileName):
+        New = not os.path.exists(FileName) or 0 == os.path.getsize(FileName)
+        self.File = open(FileName, 'w+b' if New else 'r+b')
+        self.Records = []   # (Offset, Key)
+        self.Last = None
+        self.Cached = None  # (Index, Snapshot) last loaded
+        if New:
+            self.File.write(SnapshotStore.Magic)
+            return
+        if self.File.read(len(SnapshotStore.Magic)) != SnapshotStore.Magic:
+            raise ValueError('Not a snapshots file')
+        while True:
+            Offset = self.File.tell()
+            Header = self.File.read(5)
+            if len(Header) < 5:
+                break
+            Size, Key = struct.unpack('<LB', Header)
+            self.File.seek(Size, io.SEEK_CUR)
+            self.Records.append((Offset, Key))
+
+    def __len__(self):
+        return len(self.Records)
+
+    def Close(self):
+        self.File.close()
+
+    def Append(self, Snap):
+        Prev = self.Last if self.Last is not None or not self.Records else self[len(self.Records) - 1]
+        Key = Prev is None or len(self.Records) % SnapshotStore.KeyInterval == 0 or \
+            Prev.Regions != Snap.Regions or Prev.BlockSize != Snap.BlockSize
+        Payload = [struct.pack('<dLL', Snap.Time, Snap.BlockSize, len(Snap.Regions))]
+        for r, (Addr, Size) in enumerate(Snap.Regions):
+            Blocks = [(i, Block) for i, Block in enumerate(Snap.Blocks[r]) if Key or not (Block is Prev.Blocks[r][i] or Block == Prev.Blocks[r][i])]
+            Payload.append(struct.pack('<QQL', Addr, Size, len(Blocks)))
+            for i, Block in Blocks:
+                Payload.append(struct.pack('<L', i))
+                Payload.append(Block)
+        Data = zlib.compress(b''.join(Payload))
+        self.File.seek(0, io.SEEK_END)
+        self.Records.append((self.File.tell(), int(Key)))
+        self.File.write(struct.pack('<LB', len(Data), int(Key)) + Data)
+        self.File.flush()
+        self.Last = Snap
+        return len(Data)
+
+    def Read_(self, n, Prev):
+        self.File.seek(self.Records[n][0])
+        Size, Key = struct.unpack('<LB', self.File.read(5))
+        Data = zlib.decompress(self.File.read(Size))
+        Time, BlockSize, Count = struct.unpack_from('<dLL', Data)
+        Pos = struct.calcsize('<dLL')
+        Regions = []
+        Blocks = []
+        for r in range(Count):
+            Addr, RegionSize, Stored = struct.unpack_from('<QQL', Data, Pos)
+            Pos += struct.calcsize('<QQL')
+            Regions.append((Addr, RegionSize))
+            List = list(Prev.Blocks[r]) if not Key else [None] * ((RegionSize + BlockSize - 1) // BlockSize)
+            for _ in range(Stored):
+                i, = struct.unpack_from('<L', Data, Pos)
+                Length = min(BlockSize, RegionSize - i * BlockSize)
+                List[i] = Data[Pos + 4:Pos + 4 + Length]
+                Pos += 4 + Length
+            Blocks.append(List)
+        Snap = OpenOCD.SnapshotOCD(Regions, BlockSize, Time)
+        Snap.Blocks = Blocks
+        Snap.Sums = [[None] * len(List) for List in Blocks]
+        return Snap
+
+    #
+    # Snapshot n, rebuilt from the preceding key snapshot (or from the one loaded last, if it's on the way).
+    #
+    def __getitem__(self, n):
+        if n < 0:
+            n += len(self.Records)
+        if self.Cached is not None and self.Cached[0] == n:
+            return self.Cached[1]
+        First = n
+        while not self.Records[First][1]:
+            First -= 1
+        Snap = None
+        if self.Cached is not None and First <= self.Cached[0] < n:
+            First, Snap = self.Cached[0] + 1, self.Cached[1]
+        for i in range(First, n + 1):
+            Snap = self.Read_(i, Snap)
+        self.Cached = (n, Snap)
+        return Snap
+
+#-------------------------------------------------------------------------------------------------
+
 class OpenOCD:
-    def __init__(self, Host="localhost", Port=4444):
-        self.tn = telnetlib.Telnet(Host, Port)
-        #write_raw_sequence(self.tn, telnetlib.IAC + telnetlib.WILL + telnetlib.ECHO)
-        self.Readout()
+    #
+    # Transport is TelnetTransport (default) or TclTransport class, Port defaults to the transport's one.
+    # Already connected transport object may be passed as well. Timeout (seconds) applies to connecting
+    # and to each socket operation of a transport created here, None waits forever.
+    #
+    def __init__(self, Host="localhost", Port=None, Transport=TelnetTransport, Timeout=None):
+        self.tn = Transport(Host, Port or Transport.Port, Timeout) if isinstance(Transport, type) else Transport
+        self.Pipeline = None
+        self.Epoch = 0
+        self.RegFile = {}
+        self.RegEpoch = -1
+        self.RegFull = False
+        self.HaltReason = None
+        self.Handlers = {}
+        self.CondBPs = {}
+        self.CondInstalled = False
+        self.Procs = {}
+        self.Symbols = None
+        self.FlashBanks = None
+        self.ImageBlocks = {}
+        self.LastSnapshot = None
+        self.Silent = 0
+        self.Mem = self.MemOCD(self)
+        self.Pending = None
+        self.PendingData = None
+        #write_raw_sequence(self.tn, bytes(bytearray((IAC, WILL, 1))))
+
+    #
+    # Symbols of the firmware: BP, WP, ReadMem* accept names ('name' or 'name+offset') then.
+    #
+    def LoadSymbols(self, FileName):
+        self.Symbols = SymbolTable.Load(FileName)
+        return self.Symbols
+
+    def Addr_(self, Addr):
+        if not isinstance(Addr, str):
+            return Addr
+        if self.Symbols is None:
+            raise ValueError('No symbols loaded to resolve %s' % Addr)
+        return self.Symbols.Address(Addr)
+
+    #
+    # Address and size of memory range, size defaults to the rest of symbol ('name+offset' up to its end).
+    #
+    def Range_(self, Addr, Size):
+        Start = self.Addr_(Addr)
+        if Size is None:
+            if not isinstance(Addr, str):
+                raise ValueError('Size is required for 0x%08x' % Addr)
+            Name = Addr.split('+')[0].strip()
+            Offset = Start - self.Symbols.Address(Name)
+            Size = self.Symbols.Size(Name) - Offset
+            if Size <= 0:
+                raise ValueError('%s is beyond the end of %s (size 0x%x)' % (Addr, Name, self.Symbols.Size(Name)))
+        return Start, Size
+
+    #
+    # Target state is going to change: flush combined writes, drop everything cached.
+    #
+    def Invalidate_(self):
+        self.Flush()
+        self.Epoch += 1
+        self.HaltReason = None
 
     #
     # Communication functions
     #
+    # Raw Readout and Exec invalidate cached target state, library methods use Query instead.
+    #
     def Readout(self):
-        s = ''
-        Lines = []
         while True:
-            s += self.tn.read_some()
-            l = s.splitlines()
-            if len(l) > 1:
-                for s in l[:-1]:
-                    if len(s) > 0:
-                        Lines.append(s)
-                s = l[-1]
-            if s == '> ':
+            self.Invalidate_()
+            Lines = self.Halted_(self.Epoch, self.tn.Readout())
+            if not self.CondBPs or not self.Silent_(Lines):
                 return Lines
 
-    def Exec(self, Cmd, *args):
+    #
+    # Wait for target halt up to Timeout seconds (forever if None). Returns halt message lines, None on timeout.
+    #
+    def WaitHalt(self, Timeout=None):
+        if self.Deferred_():
+            raise ValueError('WaitHalt requires synchronous session')
+        Deadline = None if Timeout is None else time.time() + Timeout
+        with selectors.DefaultSelector() as Selector:
+            Selector.register(self.tn.Socket, selectors.EVENT_READ)
+            while True:
+                Lines = self.PollHalt_()
+                if Lines is not None:
+                    return Lines
+                Left = None if Deadline is None else Deadline - time.time()
+                if Left is not None and Left <= 0:
+                    return None
+                if Selector.select(Left):
+                    self.tn.Recv_()
+
+    #
+    # Halt message already received (without reading socket), None if there is none.
+    #
+    def PollHalt_(self):
+        while True:
+            Msg = self.tn.Ready_()
+            if Msg is None:
+                return None
+            Lines = self.Stopped_(Msg)
+            if Lines is not None:
+                return Lines
+
+    #
+    # Asynchronous message received: update state on halt. None if it's not a halt (message is dropped)
+    # or halt was silent (conditional breakpoint).
+    #
+    def Stopped_(self, Msg):
+        if not any(['halted' in Line for Line in Msg]):
+            return None
+        self.Invalidate_()
+        Lines = self.Halted_(self.Epoch, Msg)
+        if self.CondBPs and self.Silent_(Lines):
+            return None
+        return Lines
+
+    @staticmethod
+    def CmdLine(Cmd, args):
         Text = Cmd
         for arg in args:
             if arg:
                 Text += ' ' + arg
-        Text += '\n'
-        self.tn.write(Text)
-        return self.Readout()
+        return Text + '\n'
+
+    def Exec(self, Cmd, *args):
+        self.Invalidate_()
+        return self.Query(None, Cmd, *args)
+
+    #
+    # Execute command, return response lines parsed by Parse (if specified).
+    # Within a batch the command is queued, and ResultOCD slot is returned instead.
+    #
+    def Query(self, Parse, Cmd, *args):
+        Text = OpenOCD.CmdLine(Cmd, args)
+        if self.Pipeline is not None:
+            return self.Pipeline.Queue_(False, Text, Parse)
+
+        self.tn.Write(Text)
+        r = self.tn.Response(Text)
+        return Parse(r) if Parse else r
+
+    #
+    # Same as Query, for raw Tcl script (Tcl transport only). Parse gets the result string.
+    #
+    def QueryTcl(self, Parse, Script):
+        if self.Pipeline is not None:
+            return self.Pipeline.Queue_(True, Script + '\n', Parse)
+
+        r = self.tn.Eval(Script)
+        return Parse(r) if Parse else r
+
+    #
+    # True if command results are deferred (in a batch).
+    #
+    def Deferred_(self):
+        return self.Pipeline is not None
+
+    #
+    # Value computed by Func from results of previous commands: at once, or after them within a batch.
+    #
+    def Derive_(self, Func):
+        if self.Pipeline is not None:
+            return self.Pipeline.Queue_(False, None, lambda r: Func())
+        return Func()
+
+    #
+    # Result slot of batched command.
+    #
+    class ResultOCD:
+        def __init__(self, Batch, Parse):
+            self.Batch = Batch
+            self.Parse = Parse
+            self.Done = False
+            self.Value_ = None
+            self.Error = None
+
+        #
+        # Parse error of any kind is kept in the slot and raised by Value, so the rest of the batch is still read.
+        #
+        def Set_(self, Response):
+            try:
+                self.Value_ = self.Parse(Response) if self.Parse else Response
+            except Exception as e:
+                self.Error = e
+            self.Done = True
+
+        #
+        # Parsed response. If the command is still queued, the batch is flushed.
+        # Slot of the batch dropped by exception was never executed, it has no value.
+        #
+        @property
+        def Value(self):
+            if not self.Done:
+                self.Batch.Flush()
+            if not self.Done:
+                raise ValueError('Command of aborted batch was not executed')
+            if self.Error:
+                raise self.Error
+            return self.Value_
+
+    #
+    # Pipelined commands batch.
+    #
+    class BatchOCD:
+        #
+        # Commands are written by portions of this size, their responses are read before the next portion.
+        #
+        WindowSize = 0x8000
+
+        def __init__(self, OCD):
+            self.OCD = OCD
+            self.Queue = []
+            self.Outer = None
+
+        def __enter__(self):
+            self.Outer = self.OCD.Pipeline
+            self.OCD.Pipeline = self
+            return self
+
+        def __exit__(self, Type, Value, Traceback):
+            self.OCD.Pipeline = self.Outer
+            if Type is None:
+                self.Flush()
+            else:
+                self.Queue = []
+            return False
+
+        def Queue_(self, Tcl, Text, Parse):
+            Result = OpenOCD.ResultOCD(self, Parse)
+            self.Queue.append((Tcl, Text, Result))
+            return Result
+
+        def Exec(self, Cmd, *args):
+            return self.Queue_(False, OpenOCD.CmdLine(Cmd, args), None)
+
+        #
+        # Write queued commands and demultiplex their responses.
+        #
+        def Flush(self):
+            Queue = self.Queue
+            self.Queue = []
+            tn = self.OCD.tn
+            Start = 0
+            while Start < len(Queue):
+                End = Start
+                Size = 0
+                Tcl = Queue[Start][0]
+                while End < len(Queue) and Size < self.WindowSize and Queue[End][0] == Tcl:
+                    if Queue[End][1] is not None:
+                        Size += len(Queue[End][1])
+                    End += 1
+
+                Text = ''.join([Cmd for _, Cmd, _ in Queue[Start:End] if Cmd is not None])
+                if Text:
+                    if Tcl:
+                        tn.Write(Text, Raw=True)
+                    else:
+                        tn.Write(Text)
+
+                for _, Cmd, Result in Queue[Start:End]:
+                    Result.Set_(tn.Response(Cmd) if Cmd is not None else None)
+                Start = End
+
+    #
+    # Commands batch: 'with ocd.Batch() as b:'
+    #
+    # Within it commands aren't executed immediately but queued, and Exec, Reg.Read/Write, BpOCD.Enable/Disable,
+    # WpOCD.Enable/Disable, ReadMem*/WriteMem* return ResultOCD slots. On exit (or when any slot value is requested)
+    # all queued commands are written at once, and responses are demultiplexed by prompts.
+    #
+    def Batch(self):
+        return self.BatchOCD(self)
 
 
     #
@@ -92,7 +1084,11 @@ class OpenOCD:
         return 'r' if 0 == Value else 'w' if 1 == Value else 'a'
 
     @staticmethod
-    def HexView(Data, Addr, Prefix=''):
+    def HexView(Data, Addr, Prefix='', Symbols=None):
+        if isinstance(Addr, str):
+            if Symbols is None:
+                raise ValueError('No symbols loaded to resolve %s' % Addr)
+            Addr = Symbols.Address(Addr)
         Size = len(Data)
         n = -(Addr & 0x0F)
         Addr = Addr & (~0x0F)
@@ -124,36 +1120,102 @@ class OpenOCD:
     # Resume the target at its current code position, or the optional address if it is provided. OpenOCD will wait 5 seconds for the target to resume.
     #
     def Resume(self):
-        return self.Exec('resume')
+        self.Invalidate_()
+        return self.Query(None, self.Armed_('resume', True))
 
     #
     # Single-step the target at its current code position, or the optional address if it is provided.
     #
     def Step(self, Addr=None):
         AddrHex = None if Addr is None else OpenOCD.ValueHex(Addr)
-        return self.Exec('step', AddrHex)
+        self.Invalidate_()
+        Epoch = self.Epoch
+        return self.Query(lambda r: self.Halted_(Epoch, r), 'step', AddrHex)
 
     #
     # The halt command first sends a halt request to the target, wait up to MS milliseconds, for the target to halt (and enter debug mode).
     # Using 0 as the MS parameter prevents OpenOCD from waiting.
     #
     def Halt(self, MS=100):
-        return self.Exec('halt', ValueDec(MS))
+        self.Invalidate_()
+        Epoch = self.Epoch
+        return self.Query(lambda r: self.Halted_(Epoch, r), self.Armed_('halt', False), OpenOCD.ValueDec(MS))
 
     #
-    # Perform as hard a reset as possible, using SRST if possible. All defined targets will be reset, and target events will fire during the reset sequence.
-    #
-    # The optional parameter specifies what should happen after the reset. If there is no parameter, a reset run is executed. The other options will not work on all systems.
-    #   'Run'  - Let the target run
-    #   'Halt' - Immediately halt the target
-    #   'Init' - Immediately halt the target, and execute the reset-init script
+    # Halt message parsing:
+    #   target halted due to breakpoint, current mode: Thread
+    #   xPSR: 0x61000000 pc: 0x08000200 msp: 0x20001fe0
+    # Registers shown in the message are put to the registers cache, so reading pc after a stop costs nothing.
+    # Returns Lines unchanged.
     #
-    def Reset(self, Run = False, Halt = False, Init = False):
+    reHaltReason = re.compile('halted due to ([\\w-]+)')
+    reHaltReg = re.compile('(\\w+): 0x([0-9a-fA-F]+)')
+
+    def Halted_(self, Epoch, Lines):
+        for s in Lines:
+            r = OpenOCD.reHaltReason.search(s)
+            if r:
+                self.HaltReason = r.group(1)
+            elif 'pc: 0x' in s and Epoch == self.Epoch:
+                self.Hint_(dict([(Name, long(Value, 16)) for Name, Value in OpenOCD.reHaltReg.findall(s)]))
+        return Lines
+
+    #
+    # Registers known without asking the target (from halt message, stop reply)
+    #
+    def Hint_(self, RegFile):
+        if self.RegEpoch != self.Epoch:
+            self.RegFile = {}
+            self.RegFull = False
+            self.RegEpoch = self.Epoch
+        self.RegFile.update(RegFile)
+
+    #
+    # Breakpoint dispatcher
+    #
+    # Handler(Addr) is called when target stops at Addr (or at any address without own handler, if Addr is None).
+    # Handler returns True to resume target at once, otherwise Dispatch() returns stop address.
+    # Handler=None removes the handler.
+    #
+    def OnHalt(self, Addr, Handler):
+        if Handler is None:
+            self.Handlers.pop(Addr, None)
+        else:
+            self.Handlers[Addr] = Handler
+
+    #
+    # Resume target and dispatch stops to handlers, until some handler (or lack of it) asks to stay halted.
+    # Stop address is taken from halt message, so every handled stop costs single round trip.
+    #
+    def Dispatch(self):
+        if self.Deferred_():
+            raise ValueError('Dispatch requires synchronous session')
+        pc = self.Reg('pc')
+        while True:
+            self.Resume()
+            self.Readout()
+            Addr = pc.Read()
+            Handler = self.Handlers.get(Addr, self.Handlers.get(None))
+            if Handler is None or not Handler(Addr):
+                return Addr
+
+    #
+    # Perform as hard a reset as possible, using SRST if possible. All defined targets will be reset, and target events will fire during the reset sequence.
+    #
+    # The optional parameter specifies what should happen after the reset. If there is no parameter, a reset run is executed. The other options will not work on all systems.
+    #   'Run'  - Let the target run
+    #   'Halt' - Immediately halt the target
+    #   'Init' - Immediately halt the target, and execute the reset-init script
+    #
+    def Reset(self, Run = False, Halt = False, Init = False):
         if int(Run) + int(Halt) + int(Init) > 1:
             raise ValueError('Wrong reset option (multiple specified)')
 
         Opt = 'run' if Run else 'halt' if Halt else 'init' if Init else None
-        return self.Exec('reset', Opt)
+        self.Invalidate_()
+        self.FlashBanks = None
+        self.ImageBlocks = {}
+        return self.Query(None, self.Armed_('reset', False), Opt)
 
     #
     # Requesting target halt and executing a soft reset. This is often used when a target cannot be reset and halted.
@@ -162,7 +1224,10 @@ class OpenOCD:
     # Unfortunately the code that was executed may have left the hardware in an unknown state.
     #
     def SoftResetHalt(self):
-        return self.Exec('soft_reset_halt')
+        self.Invalidate_()
+        self.FlashBanks = None
+        self.ImageBlocks = {}
+        return self.Query(None, self.Armed_('soft_reset_halt', False))
 
     #
     # Registers handling
@@ -171,13 +1236,12 @@ class OpenOCD:
         def __init__(self, OCD, Name, Force=False):
             self.OCD = OCD
             self.Name = str(Name)
-            self.Force = Force # not supported yet
+            self.Force = Force # bypass registers cache
 
         #
         # Read register value
         #
-        def Read(self):
-            r = self.OCD.Exec('reg', self.Name)
+        def Parse_(self, r):
             if len(r) < 2:
                 return None
 
@@ -186,23 +1250,81 @@ class OpenOCD:
                 return None
             return long(w[2], 16)
 
+        def ParseTcl_(self, Result):
+            w = Result.split()
+            if len(w) != 2 or w[0] != self.Name:
+                return None
+            return long(w[1], 16)
+
+        def Read(self):
+            Cached = not self.Force and not self.OCD.Deferred_()
+            if Cached:
+                RegFile = self.OCD.Regs_(self.Name)
+                if self.Name in RegFile:
+                    return RegFile[self.Name]
+
+            if self.OCD.tn.Tcl:
+                Value = self.OCD.QueryTcl(self.ParseTcl_, '[target current] get_reg %s' % self.Name)
+            else:
+                Value = self.OCD.Query(self.Parse_, 'reg', self.Name)
+            if Cached and Value is not None:
+                RegFile[self.Name] = Value
+            return Value
+
         #
         # Write value to the register
         #
         def Write(self, Value):
-            if not Name:
+            if not self.Name:
                 raise ValueError('Cannot write to all registers')
 
-            r = self.OCD.Exec('reg', self.Name, OpenOCD.ValueHex(Value))
-            pass
+            self.OCD.RegFile.pop(self.Name, None)
+            if self.OCD.tn.Tcl:
+                r = self.OCD.QueryTcl(None, '[target current] set_reg {%s %s}' % (self.Name, OpenOCD.ValueHex(Value)))
+            else:
+                r = self.OCD.Query(None, 'reg', self.Name, OpenOCD.ValueHex(Value))
+            if not self.OCD.Deferred_() and self.OCD.RegEpoch == self.OCD.Epoch:
+                self.OCD.RegFile[self.Name] = Value
+            return r
     
     #
     # Access a single register by number or by its name.
     # The target must generally be halted before access to CPU core registers is allowed.
     # Depending on the hardware, some other registers may be accessible while the target is running.
     #
-    def Reg(self, Name):
-        return self.RegOCD(self, Name)
+    def Reg(self, Name, Force=False):
+        return self.RegOCD(self, Name, Force)
+
+    #
+    # Fetch values of all registers by single command, returns by-name dictionary.
+    # Registers not cached by OpenOCD (shown without value) are omitted.
+    #
+    def FetchRegs_(self):
+        reReg = re.compile('\\(\\d+\\)\\s+(?P<name>\\w+)\\s+\\(/\\d+\\):\\s+0x(?P<value>[0-9a-fA-F]+)')
+        def Parse(Lines):
+            RegFile = {}
+            for s in Lines:
+                r = reReg.match(s)
+                if r:
+                    RegFile[r.group('name')] = long(r.group('value'), 16)
+            return RegFile
+        return self.Query(Parse, 'reg')
+
+    #
+    # Registers cache. It's filled by single command on the first register access after target state change
+    # (resume, step, halt, reset, raw Exec or Readout), and serves reads until the next change.
+    # Registers seen in halt message are served without fetching.
+    # Writes go through to the target.
+    #
+    def Regs_(self, Name=None):
+        if self.RegEpoch != self.Epoch:
+            self.RegFile = {}
+            self.RegFull = False
+            self.RegEpoch = self.Epoch
+        if not self.RegFull and Name not in self.RegFile:
+            self.RegFile.update(self.FetchRegs_())
+            self.RegFull = True
+        return self.RegFile
 
     #
     # Enum available registers (empty 'reg' command wrapper)
@@ -216,34 +1338,53 @@ class OpenOCD:
                 self.Name = Name
                 self.Width = Width
 
-        All = {} if Dict else []
         reReg = re.compile('\\((?P<index>\\d+)\\)\\s+(?P<name>\\w+)\\s+\\(/(?P<width>\\d+)\\)')
-        for s in self.Exec('reg'):
-            r = reReg.match(s)
-            if r:
-                Index = r.group('index')
-                Name  = r.group('name')
-                Width = long(r.group('width'))
-                Info = RegInfo(Index, Name, Width)
-                if Dict:
-                    All[Info.Name] = Info
-                else:
-                    All.append(Info)
-        return All
+        def Parse(Lines):
+            All = {} if Dict else []
+            for s in Lines:
+                r = reReg.match(s)
+                if r:
+                    Index = r.group('index')
+                    Name  = r.group('name')
+                    Width = long(r.group('width'))
+                    Info = RegInfo(Index, Name, Width)
+                    if Dict:
+                        All[Info.Name] = Info
+                    else:
+                        All.append(Info)
+            return All
+        return self.Query(Parse, 'reg')
 
     #
     # Memory reading
     #
     def ReadMem_(self, Verb, Addr):
+        Addr = self.Addr_(Addr)
+        Fmt = '<L' if 'mdw' == Verb else '<H' if 'mdh' == Verb else '<B'
+        Patch = self.Pending_(Addr, struct.calcsize(Fmt))
+        def Patched(Value):
+            if Value is None or not Patch:
+                return Value
+            Data = bytearray(struct.pack(Fmt, Value))
+            OpenOCD.Overlay_(Data, Patch)
+            return struct.unpack(Fmt, Data)[0]
+
+        if self.tn.Tcl:
+            def ParseTcl(Result):
+                w = Result.split()
+                return Patched(long(w[0], 16)) if 1 == len(w) else None
+            return self.QueryTcl(ParseTcl, OpenOCD.ReadMemTcl_(Verb, Addr, 1))
+
         AddrHex = OpenOCD.ValueHex32(Addr)
-        r = self.Exec(Verb, AddrHex)
-        if len(r) < 2:
-            return None
+        def Parse(r):
+            if len(r) < 2:
+                return None
     
-        w = r[1].split()
-        if w[0] != AddrHex + ':':
-            return None
-        return long(w[1], 16)
+            w = r[1].split()
+            if w[0] != AddrHex + ':':
+                return None
+            return Patched(long(w[1], 16))
+        return self.Query(Parse, Verb, AddrHex)
 
     def ReadMem32(self, Addr):
         return self.ReadMem_('mdw', Addr)
@@ -254,27 +1395,94 @@ class OpenOCD:
     def ReadMem8(self, Addr):
         return self.ReadMem_('mdb', Addr)
 
-    def ReadMem(self, Addr, Size):
-        Data = ''
-        while 0 != Size:
-            BlockSize = min(4, Size)
-            if 0 != (Addr & 1):
-                BlockSize = 1
-            elif 0 != (Addr & 2):
-                BlockSize = min(2, Size)
+    #
+    # Tcl 'read_memory' command for Count items, which returns plain list of values.
+    #
+    @staticmethod
+    def ReadMemTcl_(Verb, Addr, Count):
+        Width = 32 if 'mdw' == Verb else 16 if 'mdh' == Verb else 8
+        return 'read_memory %s %d %d' % (OpenOCD.ValueHex32(Addr), Width, Count)
 
-            if 4 == BlockSize:
-                Value = self.ReadMem32(Addr)
-                Data += struct.pack('<L', Value)
-            elif 2 == BlockSize:
-                Value = self.ReadMem16(Addr)
-                Data += struct.pack('<H', Value)
-            else:
-                Value = self.ReadMem8(Addr)
-                Data += struct.pack('<B', Value)
-            Addr += BlockSize
-            Size -= BlockSize
-        return Data
+    #
+    # Read Count items of Width bytes with single multi-item command (mdw/mdh/mdb <addr> <count>).
+    # Output lines ('0x20000000: 12345678 9abcdef0 ...') are parsed directly into Buf at Offset.
+    #
+    def ReadBlock_(self, Verb, Width, Addr, Count, Buf, Offset=0):
+        Fmt = '<L' if 4 == Width else '<H' if 2 == Width else '<B'
+        if self.tn.Tcl:
+            def ParseTcl(Result):
+                w = Result.split()
+                if len(w) != Count:
+                    raise ValueError(Result)
+                struct.pack_into('<%d%s' % (Count, Fmt[1]), Buf, Offset, *[int(Value, 16) for Value in w])
+            return self.QueryTcl(ParseTcl, OpenOCD.ReadMemTcl_(Verb, Addr, Count))
+
+        def Parse(r):
+            Done = 0
+            for s in r[1:]:
+                w = s.split()
+                if len(w) < 2 or not w[0].endswith(':'):
+                    continue
+                try:
+                    LineAddr = int(w[0][:-1], 16)
+                except ValueError:
+                    continue
+                Pos = Offset + (LineAddr - Addr)
+                for Value in w[1:]:
+                    struct.pack_into(Fmt, Buf, Pos, int(Value, 16))
+                    Pos += Width
+                    Done += 1
+
+            if Done != Count:
+                raise ValueError(r[1] if len(r) > 1 else 'No data read at %s' % OpenOCD.ValueHex32(Addr))
+        return self.Query(Parse, Verb, OpenOCD.ValueHex32(Addr), OpenOCD.ValueDec(Count))
+
+    #
+    # Raises error of the first failed deferred command.
+    #
+    @staticmethod
+    def Check_(Results):
+        for r in Results:
+            if isinstance(r, OpenOCD.ResultOCD):
+                r.Value
+            elif isinstance(r, asyncio.Future):
+                r.result()
+
+    #
+    # Maximum number of items fetched by a single block read command
+    #
+    ReadBlockMax = 0x1000
+
+    def ReadMem(self, Addr, Size=None):
+        Addr, Size = self.Range_(Addr, Size)
+        Data = bytearray(Size)
+        Blocks = []
+        Patch = self.Pending_(Addr, Size)
+
+        #
+        # Unaligned head and tail are read bytewise, aligned body by words.
+        #
+        Head = min((-Addr) & 3, Size)
+        Body = (Size - Head) & (~3)
+        Tail = Size - Head - Body
+
+        if Head:
+            Blocks.append(self.ReadBlock_('mdb', 1, Addr, Head, Data, 0))
+
+        Offset = Head
+        while Offset < Head + Body:
+            Count = min(OpenOCD.ReadBlockMax, (Head + Body - Offset) // 4)
+            Blocks.append(self.ReadBlock_('mdw', 4, Addr + Offset, Count, Data, Offset))
+            Offset += Count * 4
+
+        if Tail:
+            Blocks.append(self.ReadBlock_('mdb', 1, Addr + Offset, Tail, Data, Offset))
+
+        def Done():
+            OpenOCD.Check_(Blocks)
+            OpenOCD.Overlay_(Data, Patch)
+            return bytes(Data)
+        return self.Derive_(Done)
 
     #
     # Memory writing
@@ -282,23 +1490,31 @@ class OpenOCD:
     def WriteMem_(self, Verb, Addr, Value):
         AddrHex = OpenOCD.ValueHex(Addr)
         ValueHex = OpenOCD.ValueHex(Value)
-        r = self.Exec(Verb, AddrHex, ValueHex)
+        Data = struct.pack({'mww': '<L', 'mwh': '<H', 'mwb': '<B'}[Verb], Value)
+        self.Written_(Addr, len(Data), Data)
+        if self.Combine_(Addr, Data):
+            return None
+        return self.Query(None, Verb, AddrHex, ValueHex)
 
     def WriteMem32(self, Addr, Value):
-        self.WriteMem_('mww', Addr, Value)
+        return self.WriteMem_('mww', Addr, Value)
 
     def WriteMem16(self, Addr, Value):
-        self.WriteMem_('mwh', Addr, Value)
+        return self.WriteMem_('mwh', Addr, Value)
 
     def WriteMem8(self, Addr, Value):
-        self.WriteMem_('mwb', Addr, Value)
+        return self.WriteMem_('mwb', Addr, Value)
 
-    def WriteMem(self, Addr, Data):
-        Offset = 0
-        Size = len(Data)
-        while Offset < Size:
-            Remainder = (Size - Offset)
-            BlockSize = min(4, Remainder)
+    #
+    # Write data by single items (mww/mwh/mwb), choosing the widest access allowed by alignment.
+    # Used for unaligned edges, and as fallback when server has no block write command.
+    #
+    def WriteMemSplit_(self, Addr, Data, Offset, Size):
+        Results = []
+        End = Offset + Size
+        while Offset < End:
+            Remainder = (End - Offset)
+            BlockSize = min(4, Remainder) if Remainder != 3 else 2
             if 0 != (Addr & 1):
                 BlockSize = 1
             elif 0 != (Addr & 2):
@@ -306,303 +1522,2969 @@ class OpenOCD:
 
             if 4 == BlockSize:
                 Value, = struct.unpack_from('<L', Data, Offset)
-                self.WriteMem32(Addr, Value)
+                Results.append(self.WriteMem32(Addr, Value))
             elif 2 == BlockSize:
                 Value, = struct.unpack_from('<H', Data, Offset)
-                self.WriteMem16(Addr, Value)
+                Results.append(self.WriteMem16(Addr, Value))
             else:
                 Value, = struct.unpack_from('<B', Data, Offset)
-                self.WriteMem8(Addr, Value)
+                Results.append(self.WriteMem8(Addr, Value))
             Addr += BlockSize
             Offset += BlockSize
+        return Results
+
+    #
+    # Write Count words with single 'write_memory <addr> 32 {...}' command.
+    # Returns False if server doesn't know the command.
+    #
+    def WriteBlock_(self, Addr, Data, Offset, Count):
+        Values = struct.unpack_from('<%dL' % Count, Data, Offset)
+        List = '{' + ' '.join(['0x%x' % Value for Value in Values]) + '}'
+        Batched = self.Deferred_()
+        def Parse(r):
+            for s in r[1:]:
+                if 'invalid command name' in s and not Batched:
+                    return False
+                raise ValueError(s)
+            return True
+        return self.Query(Parse, 'write_memory', OpenOCD.ValueHex32(Addr), '32', List)
+
+    #
+    # Maximum command line length accepted by the server (TELNET_LINE_MAX_SIZE),
+    # block writes are split to fit it.
+    #
+    WriteLineMax = 2560
+
+    #
+    # Cleared on first block write failure, all further writes use mww/mwh/mwb.
+    #
+    BlockWrite = True
+
+    def WriteMem(self, Addr, Data):
+        Size = len(Data)
+        Blocks = []
+        self.Written_(Addr, Size, Data)
+        if self.Combine_(Addr, Data):
+            return None
+
+        #
+        # Unaligned head and tail are written by single items, aligned body by blocks of words.
+        #
+        Head = min((-Addr) & 3, Size)
+        Body = (Size - Head) & (~3)
+        Blocks += self.WriteMemSplit_(Addr, Data, 0, Head)
+
+        Offset = Head
+        Words = (OpenOCD.WriteLineMax - 64) // len('0x12345678 ')
+        while Offset < Head + Body and self.BlockWrite:
+            Count = min(Words, (Head + Body - Offset) // 4)
+            r = self.WriteBlock_(Addr + Offset, Data, Offset, Count)
+            if not r:
+                self.BlockWrite = False
+                break
+            Blocks.append(r)
+            Offset += Count * 4
+
+        Blocks += self.WriteMemSplit_(Addr + Offset, Data, Offset, Size - Offset)
+        return self.Derive_(lambda: OpenOCD.Check_(Blocks))
+
+    #
+    # Target memory was written: update memory view, forget image blocks loaded there.
+    #
+    def Written_(self, Addr, Size, Data=None):
+        self.Mem.Written_(Addr, Size, Data)
+        if self.ImageBlocks:
+            Mask = OpenOCD.ImageOCD.BlockSize - 1
+            for Block in range(Addr & ~Mask, Addr + Size, Mask + 1):
+                self.ImageBlocks.pop(Block, None)
+
+    #
+    # Write combining mode: memory writes are collected and merged, then flushed as a few block writes
+    # before target state change (Resume, Step, Halt, Reset, raw Exec or Readout) or by explicit Flush().
+    # Reads see pending writes.
+    #
+    def WriteCombine(self, Enable=True):
+        if Enable:
+            if self.Pending is None:
+                self.Pending = []
+                self.PendingData = []
+            return None
+        r = self.Flush()
+        self.Pending = None
+        self.PendingData = None
+        return r
+
+    #
+    # Pending writes are kept as sorted disjoint, non-adjacent runs: start addresses in Pending, data in PendingData.
+    # Returns False if write combining is off.
+    #
+    def Combine_(self, Addr, Data):
+        if self.Pending is None:
+            return False
+
+        End = Addr + len(Data)
+        First = bisect.bisect_right(self.Pending, Addr) - 1
+        if First < 0 or self.Pending[First] + len(self.PendingData[First]) < Addr:
+            First += 1
+        Last = bisect.bisect_right(self.Pending, End)
+
+        Start = Addr
+        Buf = bytearray(Data)
+        if First < Last:
+            Start = min(Addr, self.Pending[First])
+            Stop = max(End, self.Pending[Last - 1] + len(self.PendingData[Last - 1]))
+            Buf = bytearray(Stop - Start)
+            for Pos, Run in zip(self.Pending[First:Last], self.PendingData[First:Last]):
+                Buf[Pos - Start:Pos - Start + len(Run)] = Run
+            Buf[Addr - Start:End - Start] = Data
+
+        self.Pending[First:Last] = [Start]
+        self.PendingData[First:Last] = [Buf]
+        return True
+
+    #
+    # Pending data overlapping [Addr, Addr + Size) as list of (Offset, Data)
+    #
+    def Pending_(self, Addr, Size):
+        if not self.Pending:
+            return []
+        End = Addr + Size
+        Patch = []
+        First = max(0, bisect.bisect_right(self.Pending, Addr) - 1)
+        for Pos, Run in zip(self.Pending[First:], self.PendingData[First:]):
+            if Pos >= End:
+                break
+            Lo = max(Addr, Pos)
+            Hi = min(End, Pos + len(Run))
+            if Lo < Hi:
+                Patch.append((Lo - Addr, bytes(Run[Lo - Pos:Hi - Pos])))
+        return Patch
+
+    @staticmethod
+    def Overlay_(Data, Patch):
+        for Offset, Run in Patch:
+            Data[Offset:Offset + len(Run)] = Run
+
+    #
+    # Write out pending combined writes, pipelined as single batch where possible.
+    #
+    def Flush(self):
+        if not self.Pending:
+            return None
+        Runs = list(zip(self.Pending, self.PendingData))
+        self.Pending = None
+        try:
+            return self.WriteRuns_(Runs)
+        finally:
+            self.Pending = []
+            self.PendingData = []
+
+    #
+    # Read list of (Addr, Size), pipelined in a batch where possible. Returns list of data.
+    #
+    def ReadRuns_(self, Runs):
+        if self.Pipeline is None and isinstance(self.tn, (TelnetTransport, TclTransport)):
+            with self.Batch():
+                Results = [self.ReadMem(Addr, Size) for Addr, Size in Runs]
+            return [Result.Value for Result in Results]
+        return [self.ReadMem(Addr, Size) for Addr, Size in Runs]
+
+    #
+    # Write list of (Addr, Data), pipelined in a batch where possible.
+    #
+    def WriteRuns_(self, Runs):
+        if self.Pipeline is None and isinstance(self.tn, (TelnetTransport, TclTransport)):
+            with self.Batch():
+                Results = [self.WriteMem(Addr, Data) for Addr, Data in Runs]
+        else:
+            Results = [self.WriteMem(Addr, Data) for Addr, Data in Runs]
+        return self.Derive_(lambda: OpenOCD.Check_(Results))
+
+    #
+    # Target memory view with page cache: ocd.Mem[Addr], ocd.Mem[Start:End], ocd.Mem[Start:End] = Data
+    #
+    # Missing pages are read by single bulk ReadMem per contiguous run, least recently used pages are
+    # evicted when cache grows over Budget bytes. Cache is dropped on any target state change
+    # (resume, step, halt, reset, raw Exec or Readout). Volatile regions (peripherals) are never cached.
+    # Writes go through to the target.
+    #
+    class MemOCD:
+        PageSize = 0x400
+        Budget = 0x40000
+
+        #
+        # Cortex-M peripherals, external devices and system area
+        #
+        VolatileDefault = [(0x40000000, 0x60000000), (0xA0000000, 0x100000000)]
+
+        def __init__(self, OCD):
+            self.OCD = OCD
+            self.Pages = collections.OrderedDict()
+            self.Epoch = OCD.Epoch
+            self.Volatiles = list(self.VolatileDefault)
+
+        #
+        # Mark region as volatile (or clear the mark), drops cached pages overlapping it.
+        #
+        def Volatile(self, Addr, Size, Volatile=True):
+            if Volatile:
+                self.Volatiles.append((Addr, Addr + Size))
+                self.Written_(Addr, Size)
+            else:
+                self.Volatiles = [(Start, End) for Start, End in self.Volatiles if (Start, End) != (Addr, Addr + Size)]
+
+        def Invalidate(self):
+            self.Pages.clear()
+            self.Epoch = self.OCD.Epoch
+
+        #
+        # Split [Addr, End) to runs of (Start, End, Volatile)
+        #
+        def Runs_(self, Addr, End):
+            Runs = []
+            while Addr < End:
+                Next = End
+                Volatile = False
+                for Start, Stop in self.Volatiles:
+                    if Start <= Addr < Stop:
+                        Volatile = True
+                        Next = min(Next, Stop)
+                    elif Addr < Start < Next:
+                        Next = Start
+                Runs.append((Addr, Next, Volatile))
+                Addr = Next
+            return Runs
+
+        #
+        # Fault in missing pages of [Addr, End) by coalesced reads, copy data to Buf.
+        #
+        def Fill_(self, Addr, End, Buf, Offset):
+            PageSize = self.PageSize
+            First = Addr - Addr % PageSize
+            Last = End + (-End) % PageSize
+            Page = First
+            while Page < Last:
+                if Page in self.Pages:
+                    self.Pages.move_to_end(Page)
+                    Page += PageSize
+                    continue
+
+                Run = Page
+                while Page < Last and Page not in self.Pages:
+                    Page += PageSize
+                Data = self.OCD.ReadMem(Run, Page - Run)
+                for Pos in range(Run, Page, PageSize):
+                    self.Pages[Pos] = bytearray(Data[Pos - Run:Pos - Run + PageSize])
+
+            for Page in range(First, Last, PageSize):
+                Lo = max(Addr, Page)
+                Hi = min(End, Page + PageSize)
+                Buf[Offset + Lo - Addr:Offset + Hi - Addr] = self.Pages[Page][Lo - Page:Hi - Page]
+
+            while len(self.Pages) * PageSize > self.Budget:
+                self.Pages.popitem(last=False)
+
+        def Read(self, Addr, Size):
+            if self.OCD.Deferred_():
+                raise ValueError('Memory view is not available for deferred commands')
+            if self.Epoch != self.OCD.Epoch:
+                self.Invalidate()
+
+            Buf = bytearray(Size)
+            for Start, End, Volatile in self.Runs_(Addr, Addr + Size):
+                if Volatile:
+                    Buf[Start - Addr:End - Addr] = self.OCD.ReadMem(Start, End - Start)
+                else:
+                    self.Fill_(Start, End, Buf, Start - Addr)
+            return bytes(Buf)
+
+        def Write(self, Addr, Data):
+            return self.OCD.WriteMem(Addr, Data)
+
+        #
+        # Memory was written: patch cached pages (or drop them if Data is None).
+        #
+        def Written_(self, Addr, Size, Data=None):
+            End = Addr + Size
+            for Page in list(self.Pages.keys()):
+                Lo = max(Addr, Page)
+                Hi = min(End, Page + self.PageSize)
+                if Lo >= Hi:
+                    continue
+                if Data is None:
+                    del self.Pages[Page]
+                else:
+                    self.Pages[Page][Lo - Page:Hi - Page] = Data[Lo - Addr:Hi - Addr]
+
+        #
+        # Addresses are absolute: negative ones don't count from the end, they are rejected.
+        #
+        @staticmethod
+        def Range_(Key):
+            if not isinstance(Key, slice):
+                Key = slice(Key, Key + 1)
+            elif Key.start is None or Key.stop is None or Key.step not in (None, 1):
+                raise ValueError('Memory slice must have start and stop addresses and no step')
+            if Key.start < 0 or Key.stop < 0:
+                raise ValueError('Negative memory address %d' % min(Key.start, Key.stop))
+            return Key.start, max(Key.start, Key.stop)
+
+        def __getitem__(self, Key):
+            Start, End = self.Range_(Key)
+            Data = self.Read(Start, End - Start)
+            return Data if isinstance(Key, slice) else Data[0]
+
+        def __setitem__(self, Key, Data):
+            Start, End = self.Range_(Key)
+            if not isinstance(Key, slice):
+                Data = struct.pack('<B', Data)
+            elif len(Data) != End - Start:
+                raise ValueError('Memory slice size mismatch: %d bytes for 0x%x' % (len(Data), End - Start))
+            self.Write(Start, Data)
 
     #
     # Breakpoints
     #
     class BpOCD:
-        def __init__(self, OCD, Addr, Len, HW=False):
+        def __init__(self, OCD, Addr, Len, HW=False, Condition=None, Log=None):
             self.OCD = OCD
             self.Addr = Addr
             self.Len = Len
             self.HW = HW
+            self.Condition = Condition
+            self.Log = Log
             self.Enabled = False
         
         def Enable(self):
+            if self.Condition or self.Log:
+                self.OCD.Hook_(self)
             AddrHex = OpenOCD.ValueHex(self.Addr)
             LenDec = OpenOCD.ValueDec(self.Len)
-            r = self.OCD.Exec('bp', AddrHex, LenDec, 'hw' if self.HW else None)
+            r = self.OCD.Query(None, 'bp', AddrHex, LenDec, 'hw' if self.HW else None)
             self.Enabled = True # TODO: check Exec result
             return r
 
         def Disable(self):
             AddrHex = OpenOCD.ValueHex(self.Addr)
-            r = self.OCD.Exec('rbp', AddrHex)
+            r = self.OCD.Query(None, 'rbp', AddrHex)
+            self.OCD.Unhook_(self.Addr)
             self.Enabled = False # TODO: check Exec result
             return r
 
-    def BP(self, Addr, Len=2, HW=True, Enable=False):
-        bp = self.BpOCD(self, Addr, Len, HW)
+    #
+    # Condition is Tcl expression evaluated by OpenOCD when breakpoint hits, target is resumed at once if it's false.
+    # Log is Tcl string, substituted and recorded on every hit (when Condition is true), target is resumed too.
+    # Registers are available as variables, memory by mem32/mem16/mem8 procedures:
+    #   ocd.BP(Addr, Condition='$r0 == 5 && ([mem32 $r1] & 1)', Log='r0=$r0 lr=$lr')
+    # Recorded lines are fetched by Logs().
+    #
+    def BP(self, Addr, Len=2, HW=True, Enable=False, Condition=None, Log=None):
+        bp = self.BpOCD(self, self.Addr_(Addr), Len, HW, Condition, Log)
         if Enable:
             bp.Enable()
         return bp
     
     def BPs(self):
-        All = []
         reBP = re.compile('Breakpoint.*: 0x(?P<addr>[0-9a-fA-F]+), 0x(?P<size>[0-9a-fA-F]+).*')
-        for s in self.Exec('bp'):
-            r = reBP.match(s)
-            if r:
-                Addr = long(r.group('addr'), 16)
-                Size = long(r.group('size'), 16)
-                bp = self.BpOCD(self, Addr, Size)
-                All.append(bp)
-        return All
+        def Parse(Lines):
+            All = []
+            for s in Lines:
+                r = reBP.match(s)
+                if r:
+                    Addr = long(r.group('addr'), 16)
+                    Size = long(r.group('size'), 16)
+                    bp = self.BpOCD(self, Addr, Size)
+                    All.append(bp)
+            return All
+        return self.Query(Parse, 'bp')
 
     def RemoveBPs(self):
         for bp in self.BPs():
             bp.Disable()
 
     #
-    # Watchpoints
+    # Conditional breakpoints and logpoints
     #
-    class WpOCD:
-        def __init__(self, OCD, Addr, Len, RWA=None, Value=None, Mask=None):
-            self.OCD = OCD
-            self.Addr = Addr
-            self.Len = Len
-            self.RWA = RWA
-            self.Value = Value
-            self.Mask = Mask if Mask is not None else 0xffffffff if Value is not None else None
+    # Server side 'halted' event handler looks up Tcl procedure of the breakpoint at pc. If it returns 0,
+    # target is resumed without waking us, and silent hits counter is incremented. Handler is active
+    # only after Resume and until the first stop, so steps and halt requests are never resumed.
+    #
+    CondProcs = [
+        ('ocdpy_halted', '', '''
+            if {![info exists ::ocdpy_armed] || !$::ocdpy_armed} return
+            set pc [format 0x%08x [ocdpy_reg pc]]
+            if {[info exists ::ocdpy_bps($pc)] && ![$::ocdpy_bps($pc)]} { incr ::ocdpy_silent; resume; return }
+            set ::ocdpy_armed 0
+        '''),
+        ('ocdpy_logs', '', '''
+            set Log $::ocdpy_log
+            set ::ocdpy_log {}
+            return [join $Log "\\n"]
+        '''),
+    ]
 
-        def Enable(self):
-            AddrHex = OpenOCD.ValueHex(self.Addr)
-            LenDec  = OpenOCD.ValueDec(self.Len)
-            ValueHex = None if self.Value is None else OpenOCD.ValueHex(self.Value)
-            MaskHex  = None if self.Mask is None else OpenOCD.ValueHex(self.Mask)
-            r = self.OCD.Exec('wp', AddrHex, LenDec, OpenOCD.FromRWA(self.RWA), ValueHex, MaskHex)
-            if len(r) > 2:
-                raise ValueError(r[1])
+    CondScript = [
+        'set ::ocdpy_armed 0; set ::ocdpy_silent 0; set ::ocdpy_log {}',
+        '[target current] configure -event halted ocdpy_halted',
+    ]
 
-        def Disable(self):
-            AddrHex = OpenOCD.ValueHex(self.Addr)
-            return self.OCD.Exec('rwp', AddrHex)
+    #
+    # Evaluate Tcl script, return its result string parsed by Parse (if specified).
+    #
+    def Eval_(self, Parse, Script):
+        if self.tn.Tcl:
+            return self.QueryTcl(Parse, Script)
+        def ParseLines(r):
+            Result = '\n'.join(r[1:])
+            return Parse(Result) if Parse else Result
+        return self.Query(ParseLines, Script)
 
-    def WP(self, Addr, Len=4, Read=None, Write=None, Access=None, Value=None, Mask=None, Enable=False):
-        RWA = OpenOCD.ToRWA(Read, Write, Access)
-        wp = self.WpOCD(self, Addr, Len, RWA, Value, Mask)
-        if Enable:
-            wp.Enable()
-        return wp
+    #
+    # Command prefixed by handler arming/disarming, if there are conditional breakpoints.
+    #
+    def Armed_(self, Cmd, Armed):
+        if not self.CondBPs:
+            return Cmd
+        return 'set ::ocdpy_armed %d; %s' % (int(Armed), Cmd)
 
-    def WPs(self):
-        All = []
-        reWP = re.compile('address: 0x(?P<addr>[0-9a-fA-F]+), len: 0x(?P<len>[0-9a-fA-F]+), r/w/a: (?P<rwa>\\d), value: 0x(?P<value>[0-9a-fA-F]+), mask: 0x(?P<mask>[0-9a-fA-F]+)')
-        for s in self.Exec('wp'):
-            r = reWP.match(s)
-            if r:
-                Addr  = long(r.group('addr'), 16)
-                Len   = long(r.group('len'))
-                RWA   = long(r.group('rwa'))
-                Value = long(r.group('value'), 16)
-                Mask  = long(r.group('mask'), 16)
+    def Hook_(self, bp):
+        if not self.CondInstalled:
+            self.Core_()
+            for Proc in OpenOCD.CondProcs:
+                self.Proc(*Proc)
+            for Script in OpenOCD.CondScript:
+                self.Eval_(None, Script)
+            self.CondInstalled = True
 
-                wp = self.WpOCD(self, Addr, Len, RWA, Value, Mask)
-                All.append(wp)
-        return All
+        Regs = sorted(set(re.findall('\\$(\\w+)', (bp.Condition or '') + (bp.Log or ''))))
+        Name = 'ocdpy_bp_0x%08x' % bp.Addr
+        Body = ''.join(['set %s [ocdpy_reg %s]; ' % (Reg, Reg) for Reg in Regs])
+        if bp.Condition:
+            Body += 'if {!(%s)} { return 0 }; ' % bp.Condition
+        if bp.Log:
+            Body += 'lappend ::ocdpy_log [subst {%s}]; return 0' % bp.Log
+        else:
+            Body += 'return 1'
+        self.Proc(Name, '', Body)
+        self.Eval_(None, 'set ::ocdpy_bps(0x%08x) %s' % (bp.Addr, Name))
+        self.CondBPs[bp.Addr] = bp
 
-        return All
+    def Unhook_(self, Addr):
+        if self.CondBPs.pop(Addr, None) is not None:
+            self.Eval_(None, 'array unset ::ocdpy_bps 0x%08x' % Addr)
 
-    def RemoveWPs(self):
-        for wp in self.WPs():
-            wp.Disable()
+    #
+    # Halt notification(s) received: skip ones resumed by server side handler.
+    #
+    def Silent_(self, Lines):
+        if self.tn.Tcl:
+            Halts = len([s for s in Lines if s.endswith(' halted')])
+        else:
+            Halts = len([s for s in Lines if OpenOCD.reHaltReason.search(s)])
+            if self.RegEpoch == self.Epoch and self.RegFile.get('pc') not in self.CondBPs:
+                return False
+        if not Halts:
+            return False
 
+        Silent = self.Eval_(long, 'set ::ocdpy_silent')
+        if Silent - self.Silent >= Halts:
+            self.Silent += Halts
+            return True
+        self.Silent = Silent
+        return False
 
     #
-    # Image handling
+    # Fetch and clear lines recorded by logpoints.
     #
-    class ImageOCD:
-        def __init__(self, OCD):
-            self.OCD = OCD
-        #
-        # Dump size bytes of target memory starting at address to the binary file named filename.
-        #
-        def Dump(self, Filename, Addr, Size):
-            FileNameQ = '"%s"' % Filename
-            AddrHex = OpenOCD.ValueHex(Addr)
-            SizeHex = OpenOCD.ValueHex(Size)
-            return self.OCD.Exec('dump_image', FileNameQ, AddrHex, SizeHex)
+    def Logs(self):
+        return self.Eval_(lambda Result: [s for s in Result.split('\n') if s], 'ocdpy_logs')
 
-        #
-        # If no parametes specified - Loads an image stored in memory by preceeded FastLoad to the current target.
-        # Otherwise storing the image in memory and uploading the image to the target can be a way to upload e.g. multiple debug sessions when the binary does not change. 
-        #
-        def FastLoad(self, Filename=None, Addr=None, Bin=False, IHex=False, Elf=False, S19=False):
-            if not Filename and not Addr:
-                return self.OCD.Exec('fast_load')
+    #
+    # Tcl procedures offload
+    #
+    # Loops running on OpenOCD side cost single round trip instead of one per iteration.
+    # Procedure is defined once per session; its content hash is kept in server side ::ocdpy_procs array,
+    # so the same procedure already defined (by previous session) isn't sent again.
+    #
+    # Body is Tcl, one command per line (no comments), lines are joined into a single telnet command line.
+    # Output of commands called in loops is swallowed by 'capture', to keep response small.
+    #
+    class ProcOCD:
+        def __init__(self, OCD, Name, Args, Body):
+            self.OCD = OCD
+            self.Name = Name
+            self.Args = Args
+            self.Body = '; '.join([Line.strip() for Line in Body.strip().splitlines() if Line.strip()])
+            self.Hash = hashlib.sha1(('%s {%s} {%s}' % (Name, Args, self.Body)).encode('utf-8')).hexdigest()[:16]
 
-            FileNameQ = '"%s"' % Filename
-            AddrHex = OpenOCD.ValueHex(Addr)
-            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
-            return self.OCD.Exec('fast_load_image', FileNameQ, AddrHex, Format)
+        def Define(self):
+            Known = 'expr {[info exists ::ocdpy_procs(%s)] && $::ocdpy_procs(%s) eq "%s"}' % (self.Name, self.Name, self.Hash)
+            if not self.OCD.Deferred_() and '1' == self.OCD.Eval_(None, Known).strip():
+                return None
+            return self.OCD.Eval_(None, 'proc %s {%s} { %s }; set ::ocdpy_procs(%s) %s' % (self.Name, self.Args, self.Body, self.Name, self.Hash))
 
         #
-        # Load image from file filename to target memory offset by address from its load address.
-        # The file format may optionally be specified (bin, ihex, elf, or s19).
-        #
-        # In addition the following arguments may be specifed:
-        #   MinAddr - ignore data below min_addr (this is w.r.t. to the target's load address + address)
-        #   MaxLength - maximum number of bytes to load.
+        # Call with arguments: numbers are passed as hex, lists/tuples as Tcl lists, the rest as is.
+        # Returns result string parsed by Parse (if specified).
         #
-        def Load(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None, MaxLength=None):
-            FileNameQ = '"%s"' % Filename
-            AddrHex = OpenOCD.ValueHex(Addr)
-            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
-            MinAddrHex = None if MinAddr is None else OpenOCD.ValueHex(MinAddr)
-            MaxLengthHex = None if MaxLength is None else OpenOCD.ValueHex(MaxLength)
-            return self.OCD.Exec('load_image', FileNameQ, AddrHex, Format, MinAddrHex, MaxLengthHex)
+        def Call(self, Parse, *Args):
+            Words = [self.Name]
+            for Arg in Args:
+                if isinstance(Arg, (list, tuple)):
+                    Words.append('{' + ' '.join([OpenOCD.ValueHex(Item) for Item in Arg]) + '}')
+                else:
+                    Words.append(OpenOCD.ValueHex(Arg))
+            return self.OCD.Eval_(Parse, ' '.join(Words))
 
-        #
-        # Displays image section sizes and addresses as if filename were loaded into target memory starting at address (defaults to zero).
-        # #The file format may optionally be specified (bin, ihex, or elf)
-        #
-        def Test(self, Filename, Addr=None, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
-            FileNameQ = '"%s"' % Filename
-            AddrHex = None if Addr is None else OpenOCD.ValueHex(Addr)
-            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
-            return self.OCD.Exec('test_image', FileNameQ, AddrHex, Format)
+        def __call__(self, *Args):
+            return self.Call(None, *Args)
+
+    #
+    # Define (or redefine, if body differs) procedure, returns ProcOCD to call it.
+    #
+    def Proc(self, Name, Args, Body):
+        Proc = self.ProcOCD(self, Name, Args, Body)
+        if Name not in self.Procs or self.Procs[Name].Hash != Proc.Hash:
+            Proc.Define()
+            self.Procs[Name] = Proc
+        return self.Procs[Name]
+
+    #
+    # Helpers used by built-in procedures and breakpoint conditions.
+    #
+    CoreProcs = [
+        ('ocdpy_reg', 'Name', 'return [lindex [[target current] get_reg $Name] 1]'),
+        ('mem32', 'Addr', 'return [lindex [read_memory $Addr 32 1] 0]'),
+        ('mem16', 'Addr', 'return [lindex [read_memory $Addr 16 1] 0]'),
+        ('mem8', 'Addr', 'return [lindex [read_memory $Addr 8 1] 0]'),
+    ]
+
+    BuiltinProcs = {
+        'ocdpy_stepn': ('Count', '''
+            for {set i 0} {$i < $Count} {incr i} { capture step }
+            return [ocdpy_reg pc]
+        '''),
+        'ocdpy_stepuntil': ('Lo Hi Max', '''
+            for {set i 0} {$i < $Max} {incr i} {
+                capture step
+                set pc [ocdpy_reg pc]
+                if {$pc >= $Lo && $pc < $Hi} { return $pc }
+            }
+            return {}
+        '''),
+        'ocdpy_pollmem': ('Addr Mask Value Timeout', '''
+            set End [expr {[clock milliseconds] + $Timeout}]
+            while 1 {
+                set Word [mem32 $Addr]
+                if {($Word & $Mask) == $Value} { return $Word }
+                if {[clock milliseconds] > $End} { return {} }
+                sleep 1
+            }
+        '''),
+        'ocdpy_modify': ('List', '''
+            foreach {Addr Mask Bits} $List { write_memory $Addr 32 [list [expr {([mem32 $Addr] & ~$Mask) | $Bits}]] }
+        '''),
+        'ocdpy_blocksums': ('Addr Size Block', '''
+            set Sums {}
+            for {set Pos 0} {$Pos < $Size} {incr Pos $Block} {
+                set h1 2166136261
+                set h2 0
+                foreach w [read_memory [expr {$Addr + $Pos}] 32 [expr {($Size - $Pos < $Block ? $Size - $Pos : $Block) / 4}]] {
+                    set h1 [expr {(($h1 ^ $w) * 16777619) & 0xffffffff}]
+                    set h2 [expr {($h2 * 31 + $w) & 0xffffffff}]
+                }
+                lappend Sums [format %08x%08x $h1 $h2]
+            }
+            return $Sums
+        '''),
+    }
+
+    def Core_(self):
+        for Proc in OpenOCD.CoreProcs:
+            self.Proc(*Proc)
+
+    def Builtin_(self, Name):
+        if Name not in self.Procs:
+            self.Core_()
+            self.Proc(Name, *OpenOCD.BuiltinProcs[Name])
+        return self.Procs[Name]
+
+    @staticmethod
+    def ValueOrNone_(Result):
+        Result = Result.strip()
+        return long(Result, 0) if Result else None
+
+    #
+    # Returned pc goes to the registers cache.
+    #
+    def Stepped_(self, Proc, *Args):
+        self.Invalidate_()
+        Epoch = self.Epoch
+        def Parse(Result):
+            pc = OpenOCD.ValueOrNone_(Result)
+            if pc is not None and Epoch == self.Epoch:
+                self.Hint_({'pc': pc})
+            return pc
+        return Proc.Call(Parse, *Args)
+
+    #
+    # Step Count instructions, returns pc.
+    #
+    def StepN(self, Count):
+        return self.Stepped_(self.Builtin_('ocdpy_stepn'), Count)
+
+    #
+    # Step until pc is within [Lo, Hi), at most Max instructions. Returns pc, or None if range isn't reached.
+    #
+    def StepUntil(self, Lo, Hi, Max=0x10000):
+        return self.Stepped_(self.Builtin_('ocdpy_stepuntil'), Lo, Hi, Max)
+
+    #
+    # Wait until (word at Addr) & Mask == Value, up to Timeout milliseconds. Returns the word, or None on timeout.
+    #
+    def PollMem(self, Addr, Mask, Value, Timeout=1000):
+        Proc = self.Builtin_('ocdpy_pollmem')
+        self.Flush()
+        self.Written_(Addr, 4)
+        return Proc.Call(OpenOCD.ValueOrNone_, Addr, Mask, Value, OpenOCD.ValueDec(Timeout))
+
+    #
+    # Bulk read-modify-write of words: List of (Addr, Mask, Bits), each word becomes (Word & ~Mask) | Bits.
+    #
+    def ModifyMem(self, List):
+        Proc = self.Builtin_('ocdpy_modify')
+        self.Flush()
+        Args = []
+        for Addr, Mask, Bits in List:
+            self.Written_(Addr, 4)
+            Args += [Addr, Mask, Bits]
+        return Proc.Call(None, Args)
+
+    #
+    # Function calls tracer
+    #
+    # Breakpoints are set on entries of Functions (list of addresses, of (Addr, Name) pairs, or by-address dictionary
+    # of names). On entry hit arguments r0-r3 and lr are recorded, and temporary breakpoint is set on return
+    # address; on return hit r0, r1 are recorded. Frames are kept in a stack with stack pointers, so recursive and
+    # nested calls are matched properly. Return breakpoints are reference counted.
+    #
+    # Hardware comparators are limited (MaxHW): when return breakpoint needs one, the least recently hit entry
+    # breakpoint is parked, and restored when comparators are free again. Return is recorded as lost if no
+    # comparator can be taken.
+    #
+    # All registers are fetched by single command per hit (registers cache), pc is taken from halt message.
+    # Log is binary stream of fixed size records (Record), read back by ReadTrace().
+    #
+    class TracerOCD:
+        Magic = b'OCDTRACE'
+        Record = struct.Struct('<BBHQLL4L')   # Kind, Depth, 0, Time (us), Func, Addr (return address / call site), Args
+
+        ENTRY = 1
+        RETURN = 2
+        LOST = 3
+
+        class Event:
+            __slots__ = ('Kind', 'Depth', 'Time', 'Func', 'Addr', 'Args')
+
+            def __init__(self, Kind, Depth, Time, Func, Addr, Args):
+                self.Kind = Kind
+                self.Depth = Depth
+                self.Time = Time
+                self.Func = Func
+                self.Addr = Addr
+                self.Args = Args
+
+        def __init__(self, OCD, Functions, Log=None, HW=True, MaxHW=6):
+            self.OCD = OCD
+            if isinstance(Functions, dict):
+                Functions = Functions.items()
+            self.Names = {}
+            for Func in Functions:
+                Addr, Name = Func if isinstance(Func, tuple) else (Func, Func if isinstance(Func, str) else None)
+                Addr = OCD.Addr_(Addr) & ~1
+                self.Names[Addr] = Name or 'sub_%08x' % Addr
+
+            self.HW = HW
+            self.MaxHW = MaxHW
+            if HW and len(self.Names) > MaxHW:
+                raise ValueError('Cannot trace %d functions with %d hardware breakpoints' % (len(self.Names), MaxHW))
+
+            self.Slots = collections.OrderedDict()     # Addr -> BpOCD, enabled breakpoints, least recently hit first
+            self.Parked = []                           # entry breakpoints disabled to free comparators
+            self.Returns = {}                          # return Addr -> number of frames waiting for it
+            self.Frames = []                           # (Func, Ret, SP)
+            self.Hits = 0
+            self.Lost = 0
+
+            self.OwnLog = isinstance(Log, str)
+            self.Log = open(Log, 'wb') if self.OwnLog else Log if Log is not None else io.BytesIO()
+            self.Log.write(self.Magic)
+
+            for Addr in self.Names:
+                self.Acquire_(Addr)
+
+        def Acquire_(self, Addr):
+            if Addr in self.Slots:
+                self.Slots.move_to_end(Addr)
+                return True
+            if self.HW and len(self.Slots) >= self.MaxHW:
+                Victims = [a for a in self.Slots if a in self.Names and a not in self.Returns]
+                if not Victims:
+                    return False
+                self.Slots.pop(Victims[0]).Disable()
+                self.Parked.append(Victims[0])
+            self.Slots[Addr] = self.OCD.BP(Addr, HW=self.HW, Enable=True)
+            return True
+
+        def Release_(self, Ret):
+            self.Returns[Ret] -= 1
+            if self.Returns[Ret]:
+                return
+            del self.Returns[Ret]
+            if Ret not in self.Names and Ret in self.Slots:
+                self.Slots.pop(Ret).Disable()
+            while self.Parked and (not self.HW or len(self.Slots) < self.MaxHW):
+                self.Acquire_(self.Parked.pop())
+
+        def Write_(self, Kind, Func, Addr, Args):
+            Args = (tuple(Args) + (0, 0, 0, 0))[:4]
+            self.Log.write(self.Record.pack(Kind, min(len(self.Frames), 255), 0, int(time.time() * 1000000), Func, Addr, *Args))
 
         #
-        # Verify filename against target memory starting at address.
-        # The file format may optionally be specified (bin, ihex, or elf)
-        # This will first attempt a comparison using a CRC checksum, if this fails it will try a binary compare.
-        #
-        def Verify(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
-            FileNameQ = '"%s"' % Filename
-            AddrHex = OpenOCD.ValueHex(Addr)
-            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
-            return self.OCD.Exec('verify_image', FileNameQ, AddrHex, Format)
+        # Process stop at Addr with registers RegFile. Returns False if it's not a traced entry or return.
+        #
+        def Hit(self, Addr, RegFile):
+            Traced = False
+            SP = RegFile.get('sp', 0)
+            if Addr in self.Returns:
+                for i in range(len(self.Frames) - 1, -1, -1):
+                    Func, Ret, FrameSP = self.Frames[i]
+                    if Ret != Addr or FrameSP > SP:
+                        continue
+                    while len(self.Frames) > i + 1:
+                        Skipped, SkippedRet, _ = self.Frames.pop()
+                        self.Write_(self.LOST, Skipped, SkippedRet, ())
+                        self.Lost += 1
+                        self.Release_(SkippedRet)
+                    del self.Frames[i:]
+                    self.Write_(self.RETURN, Func, Ret, (RegFile.get('r0', 0), RegFile.get('r1', 0)))
+                    self.Release_(Ret)
+                    Traced = True
+                    break
+
+            if Addr in self.Names:
+                Ret = RegFile.get('lr', 0) & ~1
+                self.Write_(self.ENTRY, Addr, Ret, [RegFile.get('r%d' % n, 0) for n in range(0, 4)])
+                if Addr in self.Slots:
+                    self.Slots.move_to_end(Addr)
+                self.Returns[Ret] = self.Returns.get(Ret, 0) + 1
+                if self.Acquire_(Ret):
+                    self.Frames.append((Addr, Ret, SP))
+                else:
+                    self.Write_(self.LOST, Addr, Ret, ())
+                    self.Lost += 1
+                    self.Release_(Ret)
+                Traced = True
+
+            self.Hits += int(Traced)
+            return Traced
 
         #
-        # Verify filename against target memory starting at address.
-        # The file format may optionally be specified (bin, ihex, or elf)
-        # This perform a comparison using a CRC checksum only
+        # Run target tracing calls, until it stops elsewhere (returns stop address) or Count hits are traced.
         #
-        def VerifyChecksum(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
-            FileNameQ = '"%s"' % Filename
-            AddrHex = OpenOCD.ValueHex(Addr)
-            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
-            return self.OCD.Exec('verify_image_checksum', FileNameQ, AddrHex, Format)
+        def Run(self, Count=None):
+            pc = self.OCD.Reg('pc')
+            Done = 0
+            while Count is None or Done < Count:
+                self.OCD.Resume()
+                self.OCD.Readout()
+                Addr = pc.Read()
+                if Addr not in self.Names and Addr not in self.Returns:
+                    return Addr
+                self.Hit(Addr, self.OCD.Regs_('r0'))
+                Done += 1
+            return None
 
-    def Image(self):
-        return self.ImageOCD(self)
+        def Close(self):
+            for bp in self.Slots.values():
+                bp.Disable()
+            self.Slots.clear()
+            if self.OwnLog:
+                self.Log.close()
+            else:
+                self.Log.flush()
+
+        #
+        # Trace log reader: yields Event objects from file object or path, reading one record at a time.
+        #
+        @staticmethod
+        def ReadTrace(Log):
+            Tracer = OpenOCD.TracerOCD
+            File = open(Log, 'rb') if isinstance(Log, str) else Log
+            try:
+                if File.read(len(Tracer.Magic)) != Tracer.Magic:
+                    raise ValueError('Not a trace log')
+                while True:
+                    Data = File.read(Tracer.Record.size)
+                    if len(Data) < Tracer.Record.size:
+                        break
+                    Kind, Depth, _, Time, Func, Addr, *Args = Tracer.Record.unpack(Data)
+                    yield Tracer.Event(Kind, Depth, Time, Func, Addr, Args)
+            finally:
+                if File is not Log:
+                    File.close()
+
+    def Tracer(self, Functions, Log=None, HW=True, MaxHW=6):
+        return self.TracerOCD(self, Functions, Log, HW, MaxHW)
 
     #
-    # NOR flash command group (command valid any time)
+    # PC sampling profiler
     #
-    class FlashOCD:
-        def __init__(self, OCD):
+    # Profile() runs OpenOCD 'profile' command and reads gmon.out it writes. OpenOCD server must run on this host:
+    # the file is passed by absolute path and read back from the local file system. Use Sample() with remote server.
+    # Sample() halts, reads pc and resumes target by Tcl procedure, Chunk samples per round trip;
+    # time target spent halted is measured there and reported as Overhead.
+    #
+    # Samples are counted in sparse histogram (bucket index -> samples) of Step bytes buckets starting at Lo,
+    # reported against symbols (SymbolTable or ELF file name) if specified.
+    #
+    class ProfilerOCD:
+        def __init__(self, OCD, Symbols=None, Granularity=2):
             self.OCD = OCD
+            self.Symbols = SymbolTable.Load(Symbols) if isinstance(Symbols, str) else Symbols or OCD.Symbols
+            self.Granularity = Granularity
+            self.Reset()
+
+        def Reset(self):
+            self.Lo = 0
+            self.Step = self.Granularity
+            self.Bins = {}          # bucket index -> samples, sparse: code in flash, RAM and ROM is far apart
+            self.Total = 0
+            self.Rate = None
+            self.Halted = 0         # us, target stopped for sampling
+            self.Elapsed = 0        # us, sampling time
+            self.RoundTrips = 0
 
         #
-        # Display table with information about flash banks. (command valid any time)
+        # Count sample into its bucket.
         #
-        def Banks():
-            pass
+        def Add(self, Addr, Count=1):
+            Index = int((Addr - self.Lo) // self.Step)
+            self.Bins[Index] = self.Bins.get(Index, 0) + Count
+            self.Total += Count
 
         #
-        # Erase flash sectors starting at address and continuing for length bytes.
-        # If 'pad' is specified, data outside that range may also be erased:
-        # the start address may be decreased, and length increased, so that all of the first and last sectors are erased.
-        # If 'unlock' is specified, then the flash is unprotected before erasing. 
+        # gmon.out as written by OpenOCD: returns (LowPC, HighPC, Rate, Bins).
         #
-        def EraseAddress(Addr, Length, Pad=None, Unlock=False):
-            pass
+        @staticmethod
+        def ReadGmon(FileName):
+            with open(FileName, 'rb') as f:
+                Data = f.read()
+            if Data[:4] != b'gmon' or Data[20] != 0:
+                raise ValueError('Not a gmon histogram file')
+            LowPC, HighPC, Count, Rate = struct.unpack_from('<LLLL', Data, 21)
+            Bins = array.array('H', Data[21 + 16 + 16:21 + 16 + 16 + 2 * Count])
+            if struct.pack('<H', 1) != array.array('H', [1]).tobytes():
+                Bins.byteswap()
+            return LowPC, HighPC, Rate, Bins
 
         #
-        # Check erase state of all blocks in a flash bank.
+        # OpenOCD 'profile' command: samples for Seconds, optionally within [Lo, Hi) only.
+        # Relative FileName is resolved against our working directory, not the server's one.
         #
-        def EraseCheck(BankId):
-            pass
+        def Profile(self, Seconds, FileName='gmon.out', Lo=None, Hi=None):
+            self.Reset()
+            FileName = os.path.abspath(FileName)
+            Range = () if Lo is None else (OpenOCD.ValueHex(Lo), OpenOCD.ValueHex(Hi))
+            Start = time.time()
+            self.OCD.Exec('profile', OpenOCD.ValueDec(Seconds), '{%s}' % FileName, *Range)
+            self.Elapsed = int((time.time() - Start) * 1000000)
+            self.RoundTrips = 1
+
+            LowPC, HighPC, self.Rate, Bins = OpenOCD.ProfilerOCD.ReadGmon(FileName)
+            self.Lo = LowPC
+            self.Step = float(HighPC - LowPC) / len(Bins) if Bins else 1
+            self.Bins = dict([(i, Count) for i, Count in enumerate(Bins) if Count])
+            self.Total = sum(Bins)
+            self.Halted = None
+            return self.Total
+
+        SampleProc = ('Count Interval', '''
+            set Armed [expr {[info exists ::ocdpy_armed] && $::ocdpy_armed}]
+            set ::ocdpy_armed 0
+            set Pcs {}
+            set Halted 0
+            set Start [clock microseconds]
+            for {set i 0} {$i < $Count} {incr i} {
+                set t [clock microseconds]
+                capture halt
+                lappend Pcs [ocdpy_reg pc]
+                capture resume
+                incr Halted [expr {[clock microseconds] - $t}]
+                sleep $Interval
+            }
+            set ::ocdpy_armed $Armed
+            return [concat $Halted [expr {[clock microseconds] - $Start}] $Pcs]
+        ''')
 
         #
-        # Erase a range of sectors in a flash bank.
+        # Take Count samples of running target, every Interval milliseconds.
         #
-        def EraseSector(BankId, FirstSectorNum, LastSectorNum):
-            pass
+        def Sample(self, Count, Interval=10, Chunk=256):
+            self.OCD.Core_()
+            Proc = self.OCD.Proc('ocdpy_sample', *OpenOCD.ProfilerOCD.SampleProc)
+            while Count > 0:
+                n = min(Count, Chunk)
+                self.OCD.Invalidate_()
+                Values = Proc.Call(lambda r: [long(w, 0) for w in r.split()], n, OpenOCD.ValueDec(Interval))
+                self.RoundTrips += 1
+                self.Halted += Values[0]
+                self.Elapsed += Values[1]
+                for Addr in Values[2:]:
+                    self.Add(Addr)
+                Count -= n
+            return self.Total
 
         #
-        # Fill N bytes with 8-bit value, starting at word address. (Noautoerase.)
+        # Share of time target was stopped by sampling (None for 'profile' command).
         #
-        def Fill8(Addr, Value8, N):
-            pass
+        @property
+        def Overhead(self):
+            if self.Halted is None or not self.Elapsed:
+                return None
+            return float(self.Halted) / self.Elapsed
+
+        def Percent_(self, Count):
+            return 100.0 * Count / self.Total if self.Total else 0.0
 
         #
-        # Fill N halfwords with 16-bit value, starting at word address. (Noautoerase.)
+        # Hot buckets: [(Addr, Samples, Percent)], most sampled first.
         #
-        def Fill16(Addr, Value16, N):
-            pass
+        def Flat(self, Top=None):
+            Hot = sorted([(Count, i) for i, Count in self.Bins.items()], reverse=True)[:Top]
+            return [(int(self.Lo + i * self.Step), Count, self.Percent_(Count)) for Count, i in Hot]
 
         #
-        # Fill N words with 16-bit value, starting at word address. (Noautoerase.)
+        # Samples by function: [(Name, Samples, Percent)], most sampled first.
+        # Addresses without symbol are grouped as '?'.
         #
-        def Fill32(Addr, Value32, N):
-            pass
+        def Functions(self, Top=None):
+            Counts = {}
+            for i, Count in self.Bins.items():
+                Addr = int(self.Lo + i * self.Step)
+                Sym = self.Symbols.Lookup(Addr) if self.Symbols else None
+                Name = Sym[0] if Sym else '?'
+                Counts[Name] = Counts.get(Name, 0) + Count
+            Hot = sorted([(Count, Name) for Name, Count in Counts.items()], reverse=True)[:Top]
+            return [(Name, Count, self.Percent_(Count)) for Count, Name in Hot]
+
+        def Report(self, Top=20):
+            Lines = ['%d samples, %d round trips' % (self.Total, self.RoundTrips)]
+            if self.Overhead is not None:
+                Lines.append('overhead: %.2f%% of %.3f s' % (100.0 * self.Overhead, self.Elapsed / 1000000.0))
+            Lines.append('')
+            for Name, Count, Percent in self.Functions(Top):
+                Lines.append('%6.2f%% %8d  %s' % (Percent, Count, Name))
+            Lines.append('')
+            for Addr, Count, Percent in self.Flat(Top):
+                Sym = self.Symbols.Lookup(Addr) if self.Symbols else None
+                Where = '%s+0x%x' % (Sym[0], Addr - Sym[1]) if Sym else ''
+                Lines.append('%6.2f%% %8d  0x%08x %s' % (Percent, Count, Addr, Where))
+            return '\n'.join(Lines)
+
+    def Profiler(self, Symbols=None, Granularity=2):
+        return self.ProfilerOCD(self, Symbols, Granularity)
+
+    #
+    # Snapshot of memory regions, kept as blocks: unchanged blocks are shared with the base (previous) snapshot.
+    #
+    # With base snapshot of the same regions, target computes block checksums first ('ocdpy_blocksums' Tcl procedure)
+    # and only blocks whose checksum differs are read. Over GDB port single qCRC tells if a region changed at all.
+    # Delta() returns changed ranges between snapshots, SnapshotStore keeps them on disk delta-compressed.
+    #
+    class SnapshotOCD:
+        def __init__(self, Regions, BlockSize=0x100, Time=None):
+            self.Regions = list(Regions)
+            self.BlockSize = BlockSize
+            self.Time = time.time() if Time is None else Time
+            self.Blocks = [[] for _ in self.Regions]
+            self.Sums = [[] for _ in self.Regions]
+            self.RegionSums = [None for _ in self.Regions]     # (SumKind, checksum of whole region)
+            self.SumKind = None
+            self.Transferred = 0    # bytes read from target
 
         #
-        # Returns information about a flash bank.
+        # Read regions from target, using Base for unchanged blocks.
         #
-        def Info(BankId):
-            pass
+        def Take_(self, OCD, Base):
+            self.SumKind = OCD.BlockSum_
+            BlockSize = self.BlockSize
+            for r, (Addr, Size) in enumerate(self.Regions):
+                Count = (Size + BlockSize - 1) // BlockSize
+                Old = Base.Region_(Addr, Size, BlockSize) if Base is not None else -1
+                Changed = OCD.BlocksChanged_(self, r, Base, Old) if Old >= 0 else None
+                if Changed is None:
+                    Data = OCD.ReadMem(Addr, Size)
+                    self.Transferred += Size
+                    for i in range(Count):
+                        Block = bytes(Data[i * BlockSize:(i + 1) * BlockSize])
+                        Same = Old >= 0 and Base.Blocks[Old][i] == Block
+                        self.Blocks[r].append(Base.Blocks[Old][i] if Same else Block)
+                        self.Sums[r].append(Base.Sum_(Old, i) if Same and Base.SumKind == self.SumKind else None)
+                    continue
+
+                Blocks = list(Base.Blocks[Old])
+                Runs = []
+                for i in Changed:
+                    if Runs and Runs[-1][1] == i:
+                        Runs[-1][1] = i + 1
+                    else:
+                        Runs.append([i, i + 1])
+                for (First, Last), Data in zip(Runs, OCD.ReadRuns_([(Addr + First * BlockSize, min(Last * BlockSize, Size) - First * BlockSize) for First, Last in Runs])):
+                    self.Transferred += len(Data)
+                    for i in range(First, Last):
+                        Blocks[i] = bytes(Data[(i - First) * BlockSize:(i - First + 1) * BlockSize])
+                self.Blocks[r] = Blocks
 
         #
-        # Returns a list of details about the flash banks. (command valid anytime)
+        # Index of region (Addr, Size) if blocks are of BlockSize, -1 otherwise.
         #
-        def List():
-            pass
+        def Region_(self, Addr, Size, BlockSize):
+            if BlockSize != self.BlockSize or (Addr, Size) not in self.Regions:
+                return -1
+            return self.Regions.index((Addr, Size))
 
         #
-        # Set default flash padded value
+        # Checksum of block, cached if computed by the function of this snapshot.
         #
-        def SetPadValue(BankId, Value):
-            pass
+        def Sum_(self, r, i, SumKind=None):
+            SumKind = SumKind or self.SumKind
+            if SumKind != self.SumKind:
+                return SumKind(self.Blocks[r][i])
+            if self.Sums[r][i] is None:
+                self.Sums[r][i] = SumKind(self.Blocks[r][i])
+            return self.Sums[r][i]
 
         #
-        # Identify a flash bank.
+        # Checksum of whole region r, cached.
         #
-        def Probe(BankId):
-            pass
+        def RegionSum_(self, r, SumKind):
+            if self.RegionSums[r] is None or self.RegionSums[r][0] != SumKind:
+                self.RegionSums[r] = (SumKind, SumKind(b''.join(self.Blocks[r])))
+            return self.RegionSums[r][1]
 
         #
-        # Turn protection on or off for a range of protection blocks or sectors in a given flash bank.
-        # See 'Info' output for a list of blocks.
+        # Snapshot contents of range within a region.
         #
-        def Protect(BankId, FirstBlock, LastBlock=None, On=False):
-            pass
+        def Data(self, Addr, Size=None):
+            for r, (Start, RegionSize) in enumerate(self.Regions):
+                if Start <= Addr and (Size or 0) + Addr <= Start + RegionSize:
+                    Size = Start + RegionSize - Addr if Size is None else Size
+                    First = (Addr - Start) // self.BlockSize
+                    Last = (Addr - Start + Size + self.BlockSize - 1) // self.BlockSize
+                    Data = b''.join(self.Blocks[r][First:Last])
+                    Offset = Addr - Start - First * self.BlockSize
+                    return Data[Offset:Offset + Size]
+            raise ValueError('Range 0x%08x is not in snapshot' % Addr)
 
         #
-        # Read binary data from flash bank to file, starting at specified byte offset from the beginning of the bank.
+        # Byte ranges (Addr, Size) which differ in Other snapshot of the same regions.
         #
-        def ReadBank(BankId, Filename, Offset, Length):
-            pass
-        
+        def Delta(self, Other):
+            if self.Regions != Other.Regions or self.BlockSize != Other.BlockSize:
+                raise ValueError('Snapshots of different regions')
+            Ranges = []
+            for r, (Addr, Size) in enumerate(self.Regions):
+                for i, (Old, New) in enumerate(zip(self.Blocks[r], Other.Blocks[r])):
+                    if Old is New or Old == New:
+                        continue
+                    Base = Addr + i * self.BlockSize
+                    for n in range(len(Old)):
+                        if Old[n] == New[n]:
+                            continue
+                        if Ranges and Ranges[-1][0] + Ranges[-1][1] == Base + n:
+                            Ranges[-1][1] += 1
+                        else:
+                            Ranges.append([Base + n, 1])
+            return [(Addr, Size) for Addr, Size in Ranges]
+
+    #
+    # Snapshot of regions: (Addr, Size), symbol name (of its size) or list of them.
+    # Base defaults to the previous snapshot of the session.
+    #
+    def Snapshot(self, Regions, Base=None, BlockSize=0x100):
+        if self.Deferred_():
+            raise ValueError('Snapshot requires synchronous session')
+        if isinstance(Regions, (tuple, str)):
+            Regions = [Regions]
+        Regions = [self.Range_(Region, None) if isinstance(Region, str) else self.Range_(*Region) for Region in Regions]
+        Snap = self.SnapshotOCD(Regions, BlockSize)
+        Snap.Take_(self, Base if Base is not None else self.LastSnapshot)
+        self.LastSnapshot = Snap
+        return Snap
+
+    #
+    # Blocks of region r of snapshot Snap which differ from region Old of Base, by block checksums
+    # computed on target. Returns list of block numbers, None if checksums aren't available (full read).
+    #
+    def BlocksChanged_(self, Snap, r, Base, Old):
+        Addr, Size = Snap.Regions[r]
+        Sums = self.BlockSums_(Addr, Size, Snap.BlockSize)
+        if Sums is None or len(Sums) != len(Base.Blocks[Old]):
+            return None
+        Snap.Sums[r] = Sums
+        return [i for i in range(len(Sums)) if Sums[i] != Base.Sum_(Old, i, Snap.SumKind)]
+
+    #
+    # Checksums of blocks computed by target (list of BlockSum_ values), None if it's not possible.
+    #
+    def BlockSums_(self, Addr, Size, BlockSize):
+        if (Addr | Size | BlockSize) & 3:
+            return None
+        Sums = self.Builtin_('ocdpy_blocksums').Call(None, Addr, Size, BlockSize).split()
+        if not all([re.match('^[0-9a-f]{16}$', Sum) for Sum in Sums]):
+            return None
+        return Sums
+
+    #
+    # Checksums of Blocks (list of (Addr, Size)) computed by target, comparable to BlockSum_ of expected data.
+    # Adjacent blocks of the same size take single call. None if it's not possible.
+    #
+    def TargetSums_(self, Blocks):
+        Sums = []
+        i = 0
+        while i < len(Blocks):
+            Addr, Size = Blocks[i]
+            j = i + 1
+            while j < len(Blocks) and Blocks[j] == (Addr + (j - i) * Size, Size):
+                j += 1
+            Run = self.BlockSums_(Addr, (j - i) * Size, Size)
+            if Run is None or len(Run) != j - i:
+                return None
+            Sums += Run
+            i = j
+        return Sums
+
+    @staticmethod
+    def BlockSum_(Data):
+        h1 = 2166136261
+        h2 = 0
+        for w in struct.unpack('<%dL' % (len(Data) // 4), Data):
+            h1 = ((h1 ^ w) * 16777619) & 0xffffffff
+            h2 = (h2 * 31 + w) & 0xffffffff
+        return '%08x%08x' % (h1, h2)
+
+    #
+    # Watchpoints
+    #
+    class WpOCD:
+        def __init__(self, OCD, Addr, Len, RWA=None, Value=None, Mask=None):
+            self.OCD = OCD
+            self.Addr = Addr
+            self.Len = Len
+            self.RWA = RWA
+            self.Value = Value
+            self.Mask = Mask if Mask is not None else 0xffffffff if Value is not None else None
+
+        def Enable(self):
+            AddrHex = OpenOCD.ValueHex(self.Addr)
+            LenDec  = OpenOCD.ValueDec(self.Len)
+            ValueHex = None if self.Value is None else OpenOCD.ValueHex(self.Value)
+            MaskHex  = None if self.Mask is None else OpenOCD.ValueHex(self.Mask)
+            def Parse(r):
+                if len(r) > 2:
+                    raise ValueError(r[1])
+                return r
+            return self.OCD.Query(Parse, 'wp', AddrHex, LenDec, OpenOCD.FromRWA(self.RWA), ValueHex, MaskHex)
+
+        def Disable(self):
+            AddrHex = OpenOCD.ValueHex(self.Addr)
+            return self.OCD.Query(None, 'rwp', AddrHex)
+
+    def WP(self, Addr, Len=4, Read=None, Write=None, Access=None, Value=None, Mask=None, Enable=False):
+        RWA = OpenOCD.ToRWA(Read, Write, Access)
+        wp = self.WpOCD(self, self.Addr_(Addr), Len, RWA, Value, Mask)
+        if Enable:
+            wp.Enable()
+        return wp
+
+    def WPs(self):
+        reWP = re.compile('address: 0x(?P<addr>[0-9a-fA-F]+), len: 0x(?P<len>[0-9a-fA-F]+), r/w/a: (?P<rwa>\\d), value: 0x(?P<value>[0-9a-fA-F]+), mask: 0x(?P<mask>[0-9a-fA-F]+)')
+        def Parse(Lines):
+            All = []
+            for s in Lines:
+                r = reWP.match(s)
+                if r:
+                    Addr  = long(r.group('addr'), 16)
+                    Len   = long(r.group('len'))
+                    RWA   = long(r.group('rwa'))
+                    Value = long(r.group('value'), 16)
+                    Mask  = long(r.group('mask'), 16)
+
+                    wp = self.WpOCD(self, Addr, Len, RWA, Value, Mask)
+                    All.append(wp)
+            return All
+        return self.Query(Parse, 'wp')
+
+    def RemoveWPs(self):
+        for wp in self.WPs():
+            wp.Disable()
+
+
+    #
+    # Image handling
+    #
+    class ImageOCD:
+        BlockSize = 0x100
+
+        def __init__(self, OCD):
+            self.OCD = OCD
         #
-        # Read binary data from flash bank and file, starting at specified byte offset from the beginning of the bank.
-        # Compare the contents.
+        # Dump size bytes of target memory starting at address to the binary file named filename.
         #
-        def VerifyBank(BankId, Filename, Offset, Length):
-            pass
+        def Dump(self, Filename, Addr, Size):
+            FileNameQ = '"%s"' % Filename
+            AddrHex = OpenOCD.ValueHex(Addr)
+            SizeHex = OpenOCD.ValueHex(Size)
+            return self.OCD.Query(None, 'dump_image', FileNameQ, AddrHex, SizeHex)
 
         #
-        # Write binary data from file to flash bank, starting at specified byte offset from the beginning of the bank.
+        # Dump Size bytes of target memory starting at Addr to host file: path (preallocated) or binary file object
+        # (written from its current position). Memory is read by chunks, each pipelined in a batch where possible.
+        # Interrupted dump is resumed by Offset (bytes done, as reported to Progress) into the same path.
+        # Progress(Done, Size, Rate) is called after each chunk, Rate in bytes per second. Returns the rate.
         #
-        def WriteBank(BankId, Filename, Offset):
-            pass
+        def DumpTo(self, File, Addr, Size, Chunk=0x10000, Offset=0, Progress=None):
+            OCD = self.OCD
+            if OCD.Deferred_():
+                raise ValueError('DumpTo requires synchronous session')
+            Addr = OCD.Addr_(Addr)
+            Batched = isinstance(OCD.tn, (TelnetTransport, TclTransport))
+            if Offset and isinstance(File, str):
+                Have = os.path.getsize(File) if os.path.exists(File) else None
+                if Have is None or Have < Offset:
+                    raise ValueError('Cannot resume dump at 0x%x: %s %s' % (Offset, File, 'is missing' if Have is None else 'has 0x%x bytes only' % Have))
+            f = open(File, 'r+b' if Offset else 'wb') if isinstance(File, str) else File
+            try:
+                if f is not File:
+                    f.truncate(Size)
+                    f.seek(Offset)
+                Start = time.time()
+                Done = Offset
+                Rate = 0.0
+                while Done < Size:
+                    Count = min(Chunk, Size - Done)
+                    if Batched:
+                        with OCD.Batch():
+                            Result = OCD.ReadMem(Addr + Done, Count)
+                        Data = Result.Value
+                    else:
+                        Data = OCD.ReadMem(Addr + Done, Count)
+                    f.write(Data)
+                    Done += Count
+                    Rate = (Done - Offset) / max(time.time() - Start, 1e-6)
+                    if Progress:
+                        Progress(Done, Size, Rate)
+                f.flush()
+            finally:
+                if f is not File:
+                    f.close()
+            return Rate
 
-        def WriteImage(Filename, Erase=False, Unlock=False, Offset=None, Bin=False, IHex=False, Elf=False, S19=False):
-            pass
+        #
+        # If no parametes specified - Loads an image stored in memory by preceeded FastLoad to the current target.
+        # Otherwise storing the image in memory and uploading the image to the target can be a way to upload e.g. multiple debug sessions when the binary does not change. 
+        #
+        def FastLoad(self, Filename=None, Addr=None, Bin=False, IHex=False, Elf=False, S19=False):
+            if not Filename and not Addr:
+                self.OCD.ImageBlocks = {}
+                return self.OCD.Query(None, 'fast_load')
+
+            FileNameQ = '"%s"' % Filename
+            AddrHex = OpenOCD.ValueHex(Addr)
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            return self.OCD.Query(None, 'fast_load_image', FileNameQ, AddrHex, Format)
+
+        #
+        # Load image from file filename to target memory offset by address from its load address.
+        # The file format may optionally be specified (bin, ihex, elf, or s19).
+        #
+        # In addition the following arguments may be specifed:
+        #   MinAddr - ignore data below min_addr (this is w.r.t. to the target's load address + address)
+        #   MaxLength - maximum number of bytes to load.
+        #
+        def Load(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None, MaxLength=None):
+            FileNameQ = '"%s"' % Filename
+            AddrHex = OpenOCD.ValueHex(Addr)
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            MinAddrHex = None if MinAddr is None else OpenOCD.ValueHex(MinAddr)
+            MaxLengthHex = None if MaxLength is None else OpenOCD.ValueHex(MaxLength)
+            self.OCD.ImageBlocks = {}
+            return self.OCD.Query(None, 'load_image', FileNameQ, AddrHex, Format, MinAddrHex, MaxLengthHex)
+
+        #
+        # Displays image section sizes and addresses as if filename were loaded into target memory starting at address (defaults to zero).
+        # #The file format may optionally be specified (bin, ihex, or elf)
+        #
+        def Test(self, Filename, Addr=None, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
+            FileNameQ = '"%s"' % Filename
+            AddrHex = None if Addr is None else OpenOCD.ValueHex(Addr)
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            return self.OCD.Query(None, 'test_image', FileNameQ, AddrHex, Format)
+
+        #
+        # Verify filename against target memory starting at address.
+        # The file format may optionally be specified (bin, ihex, or elf)
+        # This will first attempt a comparison using a CRC checksum, if this fails it will try a binary compare.
+        #
+        def Verify(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
+            FileNameQ = '"%s"' % Filename
+            AddrHex = OpenOCD.ValueHex(Addr)
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            return self.OCD.Query(None, 'verify_image', FileNameQ, AddrHex, Format)
+
+        #
+        # Verify filename against target memory starting at address.
+        # The file format may optionally be specified (bin, ihex, or elf)
+        # This perform a comparison using a CRC checksum only
+        #
+        def VerifyChecksum(self, Filename, Addr, Bin=False, IHex=False, Elf=False, S19=False, MinAddr=None):
+            FileNameQ = '"%s"' % Filename
+            AddrHex = OpenOCD.ValueHex(Addr)
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            return self.OCD.Query(None, 'verify_image_checksum', FileNameQ, AddrHex, Format)
+
+        #
+        # Load image from host memory: LocalImage, image file name (parsed locally, offset by Addr)
+        # or bytes placed at Addr. Segments are streamed by bulk memory writes.
+        #
+        def LoadBytes(self, Image, Addr=0):
+            Image = self.Image_(Image, Addr)
+            r = self.OCD.WriteRuns_(Image.Segments)
+            self.OCD.ImageBlocks.update(self.Blocks_(Image))
+            return r
+
+        @staticmethod
+        def Image_(Image, Addr):
+            if isinstance(Image, str):
+                return LocalImage.Open(Image, Addr)
+            if not isinstance(Image, LocalImage):
+                return LocalImage([(Addr, Image)])
+            return Image
+
+        #
+        # True if target memory of block matches image.
+        #
+        def Matches_(self, Image, Block):
+            for SegAddr, Data in Image.Segments:
+                Lo = max(Block, SegAddr)
+                Hi = min(Block + self.BlockSize, SegAddr + len(Data))
+                if Lo < Hi and bytes(self.OCD.ReadMem(Lo, Hi - Lo)) != bytes(Data[Lo - SegAddr:Hi - SegAddr]):
+                    return False
+            return True
+
+        #
+        # Hashes of image data by aligned block address: {Block: sha1 of (address, size, data) of pieces in block}.
+        #
+        @staticmethod
+        def Blocks_(Image):
+            Size = OpenOCD.ImageOCD.BlockSize
+            Hashes = {}
+            for Addr, Data in Image.Segments:
+                Offset = 0
+                while Offset < len(Data):
+                    Block = (Addr + Offset) & ~(Size - 1)
+                    Count = min(Block + Size - Addr - Offset, len(Data) - Offset)
+                    if Block not in Hashes:
+                        Hashes[Block] = hashlib.sha1()
+                    Hashes[Block].update(struct.pack('<QL', Addr + Offset, Count))
+                    Hashes[Block].update(Data[Offset:Offset + Count])
+                    Offset += Count
+            return dict([(Block, Hash.digest()) for Block, Hash in Hashes.items()])
+
+        #
+        # Hot reload: write only blocks of image which differ from what was last loaded in this session
+        # (by LoadBytes or Reload). Sample clean blocks are read back first, any mismatch forces full load.
+        # Blocks modified by running target itself are not detected otherwise.
+        # Returns number of bytes written.
+        #
+        def Reload(self, Image, Addr=0, Sample=0):
+            Image = self.Image_(Image, Addr)
+            Hashes = self.Blocks_(Image)
+            Loaded = self.OCD.ImageBlocks
+            Dirty = set([Block for Block, Hash in Hashes.items() if Loaded.get(Block) != Hash])
+
+            Clean = sorted(set(Hashes) - Dirty)
+            if Sample and Clean:
+                if self.OCD.Deferred_():
+                    raise ValueError('Sampled reload is not available for deferred commands')
+                if not all([self.Matches_(Image, Block) for Block in random.sample(Clean, min(Sample, len(Clean)))]):
+                    Dirty = set(Hashes)
+
+            #
+            # Dirty blocks adjacent within a segment are written as a single run.
+            #
+            Runs = []
+            Mask = self.BlockSize - 1
+            for SegAddr, Data in Image.Segments:
+                Start = None
+                Offset = 0
+                while Offset < len(Data):
+                    Next = min(((SegAddr + Offset) | Mask) + 1 - SegAddr, len(Data))
+                    if (SegAddr + Offset) & ~Mask in Dirty:
+                        if Start is None:
+                            Start = Offset
+                    elif Start is not None:
+                        Runs.append((SegAddr + Start, Data[Start:Offset]))
+                        Start = None
+                    Offset = Next
+                if Start is not None:
+                    Runs.append((SegAddr + Start, Data[Start:]))
+
+            if Runs:
+                self.OCD.WriteRuns_(Runs)
+            Loaded.update(Hashes)
+            return sum([len(Data) for _, Data in Runs])
+
+    def Image(self):
+        return self.ImageOCD(self)
+
+    #
+    # NOR flash command group (command valid any time)
+    #
+    class FlashOCD:
+        reBank = re.compile(r'#\s*(?P<id>\d+)\s*:\s*(?:(?P<name>\S+) \()?(?P<driver>[\w.]+)\)? at 0x(?P<base>[0-9a-fA-F]+), size 0x(?P<size>[0-9a-fA-F]+)')
+        reSector = re.compile(r'\s*#\s*(?P<num>\d+): 0x(?P<offset>[0-9a-fA-F]+) \(0x(?P<size>[0-9a-fA-F]+)')
+
+        reTap = re.compile(r'\s*\d+\s+\S+\s+[YN]\s+0x(?P<idcode>[0-9a-fA-F]+)')
+        reList = re.compile(r'\{([^{}]*)\}')
+
+        #
+        # Flash geometry is kept there by target ID code and flash size, None disables persistence.
+        #
+        CacheDir = SymbolTable.CacheDir
+
+        def __init__(self, OCD):
+            self.OCD = OCD
+
+        #
+        # Flash bank geometry, sectors are kept in arrays sorted by offset.
+        # Protected holds sector protection flags read by 'flash info', it's None if they are unknown:
+        # protection is target state rather than geometry, so it isn't persisted with it.
+        #
+        class FlashBank:
+            __slots__ = ('Id', 'Name', 'Driver', 'Base', 'Size', 'Offsets', 'Sizes', 'Protected')
+
+            def __init__(self, Id, Name, Driver, Base, Size):
+                self.Id = Id
+                self.Name = Name
+                self.Driver = Driver
+                self.Base = Base
+                self.Size = Size
+                self.Offsets = array.array('L')
+                self.Sizes = array.array('L')
+                self.Protected = bytearray()
+
+            def Add_(self, Offset, Size, Protected=None):
+                self.Offsets.append(Offset)
+                self.Sizes.append(Size)
+                if self.Protected is not None:
+                    self.Protected.append(int(Protected))
+
+            def __len__(self):
+                return len(self.Offsets)
+
+            #
+            # Number of sector containing address, -1 if there is none.
+            #
+            def Sector(self, Addr):
+                Offset = Addr - self.Base
+                i = bisect.bisect_right(self.Offsets, Offset) - 1
+                if i < 0 or Offset >= self.Offsets[i] + self.Sizes[i]:
+                    return -1
+                return i
+
+            #
+            # Numbers of sectors overlapping address range.
+            #
+            def Sectors(self, Addr, Size):
+                Lo = max(Addr, self.Base) - self.Base
+                Hi = min(Addr + Size, self.Base + self.Size) - self.Base
+                if Lo >= Hi:
+                    return range(0)
+                return range(max(bisect.bisect_right(self.Offsets, Lo) - 1, 0), bisect.bisect_left(self.Offsets, Hi))
+
+            def __repr__(self):
+                return 'FlashBank(#%d %s at 0x%08x, size 0x%x, %d sectors)' % (self.Id, self.Driver, self.Base, self.Size, len(self))
+
+        #
+        # Raise ValueError if flash command reported failure, return response lines otherwise.
+        #
+        @staticmethod
+        def Check_(r):
+            for s in r[1:]:
+                if s.startswith('Error') or 'failed' in s or 'invalid command name' in s:
+                    raise ValueError(s)
+            return r
+
+        @staticmethod
+        def FileName_(Filename):
+            return '"%s"' % Filename.replace('\\', '/')
+
+        @staticmethod
+        def Bank_(m):
+            return OpenOCD.FlashOCD.FlashBank(int(m.group('id')), m.group('name'), m.group('driver'), long(m.group('base'), 16), long(m.group('size'), 16))
+
+        #
+        # Display table with information about flash banks. (command valid any time)
+        # Returns list of FlashBank without sectors.
+        #
+        def Banks(self):
+            def Parse(r):
+                All = []
+                for s in r[1:]:
+                    m = self.reBank.match(s)
+                    if m:
+                        All.append(self.Bank_(m))
+                return All
+            return self.OCD.Query(Parse, 'flash banks')
+
+        #
+        # Erase flash sectors starting at address and continuing for length bytes.
+        # If 'pad' is specified, data outside that range may also be erased:
+        # the start address may be decreased, and length increased, so that all of the first and last sectors are erased.
+        # If 'unlock' is specified, then the flash is unprotected before erasing. 
+        #
+        def EraseAddress(self, Addr, Length, Pad=False, Unlock=False):
+            AddrHex = OpenOCD.ValueHex(Addr)
+            LengthHex = OpenOCD.ValueHex(Length)
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash erase_address', 'pad' if Pad else None, 'unlock' if Unlock else None, AddrHex, LengthHex)
+
+        #
+        # Check erase state of all blocks in a flash bank.
+        #
+        def EraseCheck(self, BankId):
+            return self.OCD.Query(self.Check_, 'flash erase_check', OpenOCD.ValueDec(BankId))
+
+        #
+        # Erase a range of sectors in a flash bank.
+        #
+        def EraseSector(self, BankId, FirstSectorNum, LastSectorNum=None):
+            Last = 'last' if LastSectorNum is None else OpenOCD.ValueDec(LastSectorNum)
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash erase_sector', OpenOCD.ValueDec(BankId), OpenOCD.ValueDec(FirstSectorNum), Last)
+
+        #
+        # Fill N bytes with 8-bit value, starting at word address. (Noautoerase.)
+        #
+        def Fill8(self, Addr, Value8, N):
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash fillb', OpenOCD.ValueHex(Addr), OpenOCD.ValueHex(Value8), OpenOCD.ValueDec(N))
+
+        #
+        # Fill N halfwords with 16-bit value, starting at word address. (Noautoerase.)
+        #
+        def Fill16(self, Addr, Value16, N):
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash fillh', OpenOCD.ValueHex(Addr), OpenOCD.ValueHex(Value16), OpenOCD.ValueDec(N))
+
+        #
+        # Fill N words with 16-bit value, starting at word address. (Noautoerase.)
+        #
+        def Fill32(self, Addr, Value32, N):
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash fillw', OpenOCD.ValueHex(Addr), OpenOCD.ValueHex(Value32), OpenOCD.ValueDec(N))
+
+        #
+        # Returns information about a flash bank: FlashBank with sectors.
+        #
+        def Info(self, BankId):
+            def Parse(r):
+                self.Check_(r)
+                Bank = None
+                for s in r[1:]:
+                    m = self.reSector.match(s)
+                    if m and Bank is not None:
+                        Protected = 'protected' in s and 'not protected' not in s
+                        Bank.Add_(long(m.group('offset'), 16), long(m.group('size'), 16), Protected)
+                        continue
+                    m = self.reBank.match(s)
+                    if m and Bank is None:
+                        Bank = self.Bank_(m)
+                if Bank is None:
+                    raise ValueError('No flash bank %s' % BankId)
+                return Bank
+            return self.OCD.Query(Parse, 'flash info', OpenOCD.ValueDec(BankId))
+
+        #
+        # Returns a list of details about the flash banks. (command valid anytime)
+        # Each bank is dictionary of its properties (name, base, size, ...), numbers are converted.
+        #
+        def List(self):
+            def Parse(r):
+                All = []
+                for Item in self.reList.findall('\n'.join(r[1:])):
+                    Words = Item.split()
+                    Bank = dict(zip(Words[0::2], Words[1::2]))
+                    for Key, Value in Bank.items():
+                        if re.match(r'^(0x[0-9a-fA-F]+|\d+)$', Value):
+                            Bank[Key] = int(Value, 0)
+                    All.append(Bank)
+                return All
+            return self.OCD.Query(Parse, 'flash list')
+
+        #
+        # ID code of the first TAP, None if unknown.
+        #
+        def IdCode_(self):
+            for s in self.OCD.Query(None, 'scan_chain')[1:]:
+                m = self.reTap.match(s)
+                if m:
+                    return long(m.group('idcode'), 16) or None
+            return None
+
+        #
+        # Geometry of all flash banks (list of FlashBank with sectors).
+        # Kept for the session until Probe or reset; persisted by target ID code and flash size if possible.
+        # Refresh reads it from target, replacing persisted one.
+        #
+        def Geometry(self, IdCode=None, Refresh=False):
+            if self.OCD.FlashBanks is not None and not Refresh:
+                return self.OCD.FlashBanks
+            if self.OCD.Deferred_():
+                raise ValueError('Flash geometry is not available for deferred commands')
+
+            Banks = self.Banks()
+            CacheName = None
+            FlashSize = sum([Bank.Size for Bank in Banks])
+            if self.CacheDir and FlashSize:
+                IdCode = IdCode or self.IdCode_()
+                if IdCode:
+                    CacheName = os.path.join(self.CacheDir, 'flash-%08x-%x.txt' % (IdCode, FlashSize))
+
+            Cached = self.LoadGeometry_(CacheName) if CacheName and not Refresh else None
+            if Cached is not None and [(Bank.Id, Bank.Base, Bank.Size) for Bank in Cached] == [(Bank.Id, Bank.Base, Bank.Size) for Bank in Banks]:
+                self.OCD.FlashBanks = Cached
+                return Cached
+
+            Banks = [self.Info(Bank.Id) for Bank in Banks]
+            if CacheName:
+                self.SaveGeometry_(CacheName, Banks)
+            self.OCD.FlashBanks = Banks
+            return Banks
+
+        #
+        # Bank and sector number containing address, (None, -1) if it isn't flash.
+        #
+        def Sector(self, Addr):
+            for Bank in self.Geometry():
+                if Bank.Base <= Addr < Bank.Base + Bank.Size:
+                    return Bank, Bank.Sector(Addr)
+            return None, -1
+
+        #
+        # Geometry file: 'bank' line (id, name, driver, base, size) followed by its sector lines (offset, size).
+        # Banks loaded from it have unknown protection.
+        #
+        @staticmethod
+        def LoadGeometry_(CacheName):
+            Banks = []
+            try:
+                with open(CacheName) as f:
+                    for s in f:
+                        Words = s.split()
+                        if 'bank' == Words[0]:
+                            Name = None if '-' == Words[2] else Words[2]
+                            Banks.append(OpenOCD.FlashOCD.FlashBank(int(Words[1]), Name, Words[3], int(Words[4], 16), int(Words[5], 16)))
+                            Banks[-1].Protected = None
+                        else:
+                            Banks[-1].Add_(int(Words[0], 16), int(Words[1], 16))
+            except (IOError, OSError, ValueError, IndexError):
+                return None
+            return Banks
+
+        @staticmethod
+        def SaveGeometry_(CacheName, Banks):
+            try:
+                if not os.path.isdir(os.path.dirname(CacheName)):
+                    os.makedirs(os.path.dirname(CacheName))
+                with open(CacheName + '.tmp', 'w') as f:
+                    for Bank in Banks:
+                        f.write('bank %d %s %s 0x%08x 0x%x\n' % (Bank.Id, Bank.Name or '-', Bank.Driver, Bank.Base, Bank.Size))
+                        for i in range(len(Bank)):
+                            f.write('0x%x 0x%x\n' % (Bank.Offsets[i], Bank.Sizes[i]))
+                os.replace(CacheName + '.tmp', CacheName)
+            except (IOError, OSError):
+                pass
+
+        #
+        # Set default flash padded value
+        #
+        def SetPadValue(self, BankId, Value):
+            return self.OCD.Query(self.Check_, 'flash padded_value', OpenOCD.ValueDec(BankId), OpenOCD.ValueHex(Value))
+
+        #
+        # Identify a flash bank. Drops cached geometry.
+        #
+        def Probe(self, BankId):
+            self.OCD.FlashBanks = None
+            return self.OCD.Query(self.Check_, 'flash probe', OpenOCD.ValueDec(BankId))
+
+        #
+        # Turn protection on or off for a range of protection blocks or sectors in a given flash bank.
+        # See 'Info' output for a list of blocks.
+        #
+        def Protect(self, BankId, FirstBlock, LastBlock=None, On=False):
+            Last = 'last' if LastBlock is None else OpenOCD.ValueDec(LastBlock)
+            def Parse(r):
+                self.Check_(r)
+                for Bank in self.OCD.FlashBanks or []:
+                    if Bank.Id == BankId and Bank.Protected is not None:
+                        for i in range(FirstBlock, len(Bank) if LastBlock is None else min(LastBlock + 1, len(Bank))):
+                            Bank.Protected[i] = int(On)
+                return r
+            return self.OCD.Query(Parse, 'flash protect', OpenOCD.ValueDec(BankId), OpenOCD.ValueDec(FirstBlock), Last, 'on' if On else 'off')
+
+        #
+        # Read binary data from flash bank to file, starting at specified byte offset from the beginning of the bank.
+        #
+        def ReadBank(self, BankId, Filename, Offset=None, Length=None):
+            OffsetHex = None if Offset is None and Length is None else OpenOCD.ValueHex(Offset or 0)
+            LengthHex = None if Length is None else OpenOCD.ValueHex(Length)
+            return self.OCD.Query(self.Check_, 'flash read_bank', OpenOCD.ValueDec(BankId), self.FileName_(Filename), OffsetHex, LengthHex)
+        
+        #
+        # Read binary data from flash bank and file, starting at specified byte offset from the beginning of the bank.
+        # Compare the contents.
+        #
+        def VerifyBank(self, BankId, Filename, Offset=None, Length=None):
+            OffsetHex = None if Offset is None and Length is None else OpenOCD.ValueHex(Offset or 0)
+            LengthHex = None if Length is None else OpenOCD.ValueHex(Length)
+            def Parse(r):
+                for s in r[1:]:
+                    if 'contents match' in s:
+                        return True
+                    if 'differ' in s or 'mismatch' in s:
+                        return False
+                self.Check_(r)
+                return True
+            return self.OCD.Query(Parse, 'flash verify_bank', OpenOCD.ValueDec(BankId), self.FileName_(Filename), OffsetHex, LengthHex)
+
+        #
+        # Write binary data from file to flash bank, starting at specified byte offset from the beginning of the bank.
+        #
+        def WriteBank(self, BankId, Filename, Offset=None):
+            self.OCD.Invalidate_()
+            OffsetHex = None if Offset is None else OpenOCD.ValueHex(Offset)
+            return self.OCD.Query(self.Check_, 'flash write_bank', OpenOCD.ValueDec(BankId), self.FileName_(Filename), OffsetHex)
+
+        #
+        # Write image to flash, optionally erasing (and unlocking) affected sectors first.
+        #
+        def WriteImage(self, Filename, Erase=False, Unlock=False, Offset=None, Bin=False, IHex=False, Elf=False, S19=False):
+            Format = OpenOCD.ImageFormat(Bin, IHex, Elf, S19)
+            OffsetHex = None if Offset is None and not Format else OpenOCD.ValueHex(Offset or 0)
+            self.OCD.Invalidate_()
+            return self.OCD.Query(self.Check_, 'flash write_image', 'erase' if Erase else None, 'unlock' if Unlock else None, self.FileName_(Filename), OffsetHex, Format)
+
+        #
+        # Outcome of differential programming.
+        #
+        class Diff:
+            def __init__(self):
+                self.Sectors = 0
+                self.Changed = 0
+                self.Written = 0
+                self.Skipped = 0
+                self.Elapsed = 0.0
+                self.Saved = 0.0
+
+            def __str__(self):
+                return '%d of %d sectors changed, %d bytes written, %d bytes skipped in %.2fs (%.2fs saved)' % (
+                    self.Changed, self.Sectors, self.Written, self.Skipped, self.Elapsed, self.Saved)
+
+        #
+        # Target identity recorded in manifest: ID code and flash layout, plus Extra (board specific, if given).
+        #
+        def Identity_(self, Extra=None):
+            IdCode = self.IdCode_()
+            Layout = ' '.join(['0x%08x+0x%x' % (Bank.Base, Bank.Size) for Bank in self.Geometry()])
+            Identity = 'idcode %s flash %s' % ('0x%08x' % IdCode if IdCode else '-', Layout)
+            return Identity if Extra is None else '%s id %s' % (Identity, Extra)
+
+        #
+        # Sector checksums of Manifest file: {(Addr, Size): sha1}. Manifest written for another target is ignored.
+        #
+        @staticmethod
+        def LoadManifest_(Manifest, Identity):
+            Sums = {}
+            try:
+                with open(Manifest) as f:
+                    if f.readline().rstrip('\n') != 'target ' + Identity:
+                        return {}
+                    for s in f:
+                        Addr, Size, Sum = s.split()
+                        Sums[(int(Addr, 16), int(Size, 16))] = Sum
+            except (IOError, OSError):
+                pass
+            return Sums
+
+        @staticmethod
+        def SaveManifest_(Manifest, Identity, Sums):
+            with open(Manifest + '.tmp', 'w') as f:
+                f.write('target %s\n' % Identity)
+                for (Addr, Size), Sum in sorted(Sums.items()):
+                    f.write('0x%08x 0x%x %s\n' % (Addr, Size, Sum))
+            os.replace(Manifest + '.tmp', Manifest)
+
+        #
+        # Program binary image (bytes or file name) at Addr, erasing and writing only sectors which differ.
+        # Sector checksums are compared against Manifest file (if given and it has them), against target otherwise:
+        # computed there if possible, read back if not.
+        # Manifest is bound to target by ID code and flash layout, which don't tell apart boards of the same part;
+        # Identity (e.g. unique device ID) is added to them, if given.
+        # Parts of touched sectors not covered by image are left erased (Erased value), as 'flash write_image erase' does.
+        # Sector data is passed to OpenOCD by temporary files, so OpenOCD must run on the same host.
+        #
+        def WriteDiff(self, Data, Addr, Manifest=None, Erased=0xff, Identity=None):
+            if self.OCD.Deferred_():
+                raise ValueError('Differential programming is not available for deferred commands')
+            if isinstance(Data, str):
+                with open(Data, 'rb') as f:
+                    Data = f.read()
+            End = Addr + len(Data)
+            if Manifest:
+                Identity = self.Identity_(Identity)
+            Sums = self.LoadManifest_(Manifest, Identity) if Manifest else {}
+            Result = self.Diff()
+            Start = time.time()
+
+            # Expected content and checksum of every sector covered by image
+            Sectors = []
+            for Bank in self.Geometry():
+                for Num in Bank.Sectors(Addr, len(Data)):
+                    BankId, Offset, Size = Bank.Id, Bank.Offsets[Num], Bank.Sizes[Num]
+                    SecAddr = Bank.Base + Offset
+                    Lo = max(SecAddr, Addr)
+                    Hi = min(SecAddr + Size, End)
+                    Content = bytes(bytearray([Erased]) * (Lo - SecAddr)) + bytes(Data[Lo - Addr:Hi - Addr]) + bytes(bytearray([Erased]) * (SecAddr + Size - Hi))
+                    Sectors.append([BankId, Num, Offset, SecAddr, Size, Content, hashlib.sha1(Content).hexdigest(), Sums.get((SecAddr, Size))])
+
+            # Sectors unknown to manifest: compared by checksums computed on target
+            Unknown = [Sector for Sector in Sectors if Sector[7] is None]
+            TargetSums = self.OCD.TargetSums_([(Sector[3], Sector[4]) for Sector in Unknown]) if Unknown else None
+            for Sector, Sum in zip(Unknown, TargetSums or []):
+                Sector[7] = Sector[6] if Sum == self.OCD.BlockSum_(Sector[5]) else ''
+
+            # Or read back and hashed here, by runs of adjacent sectors
+            i = 0
+            while i < len(Sectors):
+                j = i
+                while j < len(Sectors) and Sectors[j][7] is None and (j == i or Sectors[j][3] == Sectors[j - 1][3] + Sectors[j - 1][4]):
+                    j += 1
+                if j == i:
+                    i += 1
+                    continue
+                Current = self.OCD.ReadMem(Sectors[i][3], Sectors[j - 1][3] + Sectors[j - 1][4] - Sectors[i][3])
+                Pos = 0
+                for Sector in Sectors[i:j]:
+                    Sector[7] = hashlib.sha1(bytes(Current[Pos:Pos + Sector[4]])).hexdigest()
+                    Pos += Sector[4]
+                i = j
+
+            # Erase and write runs of changed sectors within a bank
+            Changed = [Sector for Sector in Sectors if Sector[6] != Sector[7]]
+            WriteTime = 0.0
+            i = 0
+            while i < len(Changed):
+                j = i + 1
+                while j < len(Changed) and Changed[j][0] == Changed[i][0] and Changed[j][1] == Changed[j - 1][1] + 1:
+                    j += 1
+                Run = Changed[i:j]
+                Fd, TempName = tempfile.mkstemp(suffix='.bin')
+                with os.fdopen(Fd, 'wb') as f:
+                    for Sector in Run:
+                        f.write(Sector[5])
+                try:
+                    WriteStart = time.time()
+                    self.EraseSector(Run[0][0], Run[0][1], Run[-1][1])
+                    self.WriteBank(Run[0][0], TempName, Run[0][2])
+                    WriteTime += time.time() - WriteStart
+                finally:
+                    os.remove(TempName)
+                i = j
+
+            for Sector in Sectors:
+                Sums[(Sector[3], Sector[4])] = Sector[6]
+            if Manifest:
+                self.SaveManifest_(Manifest, Identity, Sums)
+
+            Result.Sectors = len(Sectors)
+            Result.Changed = len(Changed)
+            Result.Written = sum([Sector[4] for Sector in Changed])
+            Result.Skipped = sum([Sector[4] for Sector in Sectors]) - Result.Written
+            Result.Elapsed = time.time() - Start
+            if Result.Written:
+                Result.Saved = WriteTime * Result.Skipped / Result.Written
+            return Result
+
+    def Flash(self):
+        return self.FlashOCD(self)
+
+#-------------------------------------------------------------------------------------------------
+
+
+#
+# OpenOCD GDB remote serial protocol port connection.
+#
+# Packets are '$payload#checksum'. Acknowledges are turned off by QStartNoAckMode if the server supports it,
+# maximal packet size is taken from qSupported reply.
+#
+class GdbTransport:
+    Port = 3333
+    Tcl = False
+
+    def __init__(self, Host="localhost", Port=3333, Timeout=None):
+        self.Socket = socket.create_connection((Host, Port), Timeout)
+        self.Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.Buf = bytearray()
+        self.Ack = True
+        self.Output = []    # console output ('O' packets) received
+
+        self.Features = {}
+        for Feature in self.Request('qSupported:swbreak+;hwbreak+').split(';'):
+            if '=' in Feature:
+                Name, Value = Feature.split('=', 1)
+                self.Features[Name] = Value
+            elif Feature:
+                self.Features[Feature[:-1]] = Feature[-1:]
+
+        self.PacketSize = int(self.Features.get('PacketSize', '190'), 16)
+        if '+' == self.Features.get('QStartNoAckMode') and 'OK' == self.Request('QStartNoAckMode'):
+            self.Ack = False
+
+        self.vCont = self.Request('vCont?').split(';')[1:]
+
+    def Close(self):
+        self.Socket.close()
+
+    def Recv_(self):
+        Data = self.Socket.recv(0x10000)
+        if not Data:
+            raise EOFError('Connection closed by OpenOCD')
+        self.Buf += Data
+
+    @staticmethod
+    def Escape(Data):
+        return bytes(Data).replace(b'}', b'}]').replace(b'#', b'}\x03').replace(b'$', b'}\x04').replace(b'*', b'}\x0a')
+
+    @staticmethod
+    def Unescape(Data):
+        if b'*' in Data:
+            Out = bytearray()
+            i = 0
+            while i < len(Data):
+                if Data[i:i + 1] == b'*':
+                    Out += Out[-1:] * (Data[i + 1] - 29)
+                    i += 2
+                else:
+                    Out.append(Data[i])
+                    i += 1
+            Data = bytes(Out)
+        if b'}' not in Data:
+            return Data
+        Parts = Data.split(b'}')
+        return Parts[0] + b''.join([bytes(bytearray((Part[0] ^ 0x20,))) + Part[1:] for Part in Parts[1:] if Part])
+
+    def Send(self, Payload):
+        if not isinstance(Payload, bytes):
+            Payload = Payload.encode('latin-1')
+        Packet = b'$' + Payload + b'#' + ('%02x' % (sum(bytearray(Payload)) & 0xff)).encode()
+        while True:
+            self.Socket.sendall(Packet)
+            if not self.Ack:
+                return
+            while not self.Buf:
+                self.Recv_()
+            c = self.Buf[0:1]
+            del self.Buf[0]
+            if b'+' == c:
+                return
+
+    #
+    # Receive packet payload (raw, with binary escapes resolved).
+    #
+    def Receive(self):
+        while True:
+            Payload = self.Packet_()
+            if Payload is not None:
+                return Payload
+            self.Recv_()
+
+    #
+    # Next complete packet of the buffer, None if there is none.
+    #
+    def Packet_(self):
+        Buf = self.Buf
+        while True:
+            Start = Buf.find(b'$')
+            End = Buf.find(b'#', Start + 1) if Start >= 0 else -1
+            if End < 0 or len(Buf) < End + 3:
+                return None
+
+            Payload = bytes(Buf[Start + 1:End])
+            Checksum = int(bytes(Buf[End + 1:End + 3]), 16)
+            del Buf[:End + 3]
+            if Checksum != (sum(bytearray(Payload)) & 0xff):
+                if self.Ack:
+                    self.Socket.sendall(b'-')
+                continue
+            if self.Ack:
+                self.Socket.sendall(b'+')
+            return GdbTransport.Unescape(Payload)
+
+    #
+    # Receive reply packet, collecting console output packets on the way.
+    #
+    def Reply(self):
+        while True:
+            Payload = self.Receive()
+            if not self.Console_(Payload):
+                return Payload
+
+    def Console_(self, Payload):
+        if Payload.startswith(b'O') and Payload != b'OK':
+            self.Output.append(bytes(bytearray.fromhex(Payload[1:].decode())).decode('utf-8', 'replace'))
+            return True
+        return False
+
+    #
+    # Reply packet if already received, None otherwise (doesn't read socket).
+    #
+    def Ready_(self):
+        while True:
+            Payload = self.Packet_()
+            if Payload is None or not self.Console_(Payload):
+                return Payload
+
+    def Request(self, Payload):
+        self.Send(Payload)
+        return self.Reply().decode('latin-1')
+
+    def Interrupt(self):
+        self.Socket.sendall(b'\x03')
+
+#
+# Target access through OpenOCD GDB port.
+#
+# Memory is transferred by binary 'm'/'X' packets, registers by 'p'/'P', breakpoints by 'Z'/'z'
+# and execution control by 'vCont'. Other commands go to the server as 'monitor' (qRcmd),
+# so the rest of OpenOCD API works unchanged.
+#
+class GdbOCD(OpenOCD):
+    def __init__(self, Host="localhost", Port=None, Transport=GdbTransport, Timeout=None):
+        OpenOCD.__init__(self, Host, Port, Transport, Timeout)
+        self.Running = False
+        self.StopReply = self.tn.Request('?')
+        self.RegNums = None
+        self.RegSizes = {}
+
+    #
+    # Monitor command, returns output lines preceeded by command line (as telnet echo).
+    #
+    def Exec(self, Cmd, *args):
+        self.Invalidate_()
+        return self.Monitor_(Cmd, *args)
+
+    def Monitor_(self, Cmd, *args):
+        Text = Cmd
+        for arg in args:
+            if arg:
+                Text += ' ' + arg
+        self.tn.Output = []
+        Reply = self.tn.Request('qRcmd,' + bytes(bytearray(Text.encode('utf-8'))).hex())
+        Lines = [s.rstrip('\r') for s in ''.join(self.tn.Output).splitlines() if s.strip('\r')]
+        if Reply.startswith('E'):
+            Lines.append(Reply)
+        return [Text] + Lines
+
+    def Query(self, Parse, Cmd, *args):
+        r = self.Monitor_(Cmd, *args)
+        return Parse(r) if Parse else r
+
+    def Batch(self):
+        raise ValueError('Commands batches are not supported by GDB protocol')
+
+    #
+    # Wait for target stop, returns console output lines and the stop reply packet.
+    #
+    def Readout(self):
+        self.Invalidate_()
+        if not self.Running:
+            return []
+        self.tn.Output = []
+        return self.Stopped_(self.tn.Reply())
+
+    def PollHalt_(self):
+        if not self.Running:
+            return []
+        Reply = self.tn.Ready_()
+        return None if Reply is None else self.Stopped_(Reply)
+
+    def Stopped_(self, Reply):
+        self.Invalidate_()
+        self.StopReply = Reply.decode('latin-1')
+        self.Running = False
+        Lines = [s.rstrip('\r') for s in ''.join(self.tn.Output).splitlines() if s.strip('\r')]
+        self.tn.Output = []
+        self.Halted_(self.Epoch, Lines)
+        self.Expedited_(self.StopReply)
+        return Lines + [self.StopReply]
+
+    #
+    # Stop reply 'T05 0f:00020008;...' may carry register values (little endian hex).
+    #
+    def Expedited_(self, Reply):
+        if not Reply.startswith('T'):
+            return
+        self.RegNum(0)
+        Names = dict([(Num, Name) for Name, Num in self.RegNums.items()])
+        RegFile = {}
+        for Key, Value in re.findall('([0-9a-fA-F]+):([0-9a-fA-F]+);', Reply[3:]):
+            if int(Key, 16) in Names:
+                RegFile[Names[int(Key, 16)]] = long(bytes(bytearray.fromhex(Value))[::-1].hex(), 16)
+        if RegFile:
+            self.Hint_(RegFile)
+
+    def Resume(self):
+        self.Invalidate_()
+        self.tn.Send('vCont;c' if 'c' in self.tn.vCont else 'c')
+        self.Running = True
+        return []
+
+    def Step(self, Addr=None):
+        if Addr is not None:
+            self.Reg('pc').Write(Addr)
+        self.Invalidate_()
+        self.tn.Send('vCont;s' if 's' in self.tn.vCont else 's')
+        self.Running = True
+        return self.Readout()
+
+    def Halt(self, MS=100):
+        if not self.Running:
+            return []
+        self.Invalidate_()
+        self.tn.Interrupt()
+        return self.Readout()
+
+    #
+    # Memory
+    #
+    def ReadMem(self, Addr, Size=None):
+        Addr, Size = self.Range_(Addr, Size)
+        Data = bytearray(Size)
+        Patch = self.Pending_(Addr, Size)
+        Chunk = (self.tn.PacketSize - 8) // 2
+        Offset = 0
+        while Offset < Size:
+            Count = min(Chunk, Size - Offset)
+            Reply = self.tn.Request('m%x,%x' % (Addr + Offset, Count))
+            if Reply.startswith('E') or len(Reply) != 2 * Count:
+                raise ValueError('Cannot read memory at 0x%08x: %s' % (Addr + Offset, Reply))
+            Data[Offset:Offset + Count] = bytearray.fromhex(Reply)
+            Offset += Count
+        OpenOCD.Overlay_(Data, Patch)
+        return bytes(Data)
+
+    def ReadMem32(self, Addr):
+        return struct.unpack('<L', self.ReadMem(Addr, 4))[0]
+
+    def ReadMem16(self, Addr):
+        return struct.unpack('<H', self.ReadMem(Addr, 2))[0]
+
+    def ReadMem8(self, Addr):
+        return struct.unpack('<B', self.ReadMem(Addr, 1))[0]
+
+    def WriteMem(self, Addr, Data):
+        Data = bytes(Data)
+        Size = len(Data)
+        Limit = self.tn.PacketSize - 32
+        self.Written_(Addr, Size, Data)
+        if self.Combine_(Addr, Data):
+            return
+        Offset = 0
+        while Offset < Size:
+            Count = min(Limit, Size - Offset)
+            while True:
+                Escaped = GdbTransport.Escape(Data[Offset:Offset + Count])
+                if len(Escaped) <= Limit:
+                    break
+                Count -= (len(Escaped) - Limit + 1) // 2
+            Reply = self.tn.Request(('X%x,%x:' % (Addr + Offset, Count)).encode() + Escaped)
+            if '' == Reply:
+                Reply = self.tn.Request('M%x,%x:%s' % (Addr + Offset, Count, Data[Offset:Offset + Count].hex()))
+            if 'OK' != Reply:
+                raise ValueError('Cannot write memory at 0x%08x: %s' % (Addr + Offset, Reply))
+            Offset += Count
+
+    def WriteMem32(self, Addr, Value):
+        self.WriteMem(Addr, struct.pack('<L', Value))
+
+    def WriteMem16(self, Addr, Value):
+        self.WriteMem(Addr, struct.pack('<H', Value))
+
+    def WriteMem8(self, Addr, Value):
+        self.WriteMem(Addr, struct.pack('<B', Value))
+
+    #
+    # Single qCRC per region: each request runs CRC routine on target, so checking blocks one by one costs
+    # more round trips than reading the whole region by 'm' packets. Unchanged region is taken from Base,
+    # changed one is read whole (unchanged blocks are still shared).
+    #
+    def BlocksChanged_(self, Snap, r, Base, Old):
+        Addr, Size = Snap.Regions[r]
+        Reply = self.tn.Request('qCRC:%x,%x' % (Addr, Size))
+        if not Reply.startswith('C'):
+            return None
+        Crc = int(Reply[1:], 16)
+        Snap.RegionSums[r] = (GdbOCD.BlockSum_, Crc)
+        if Crc != Base.RegionSum_(Old, GdbOCD.BlockSum_):
+            return None
+        Snap.Sums[r] = list(Base.Sums[Old]) if Base.SumKind == Snap.SumKind else [None] * len(Base.Blocks[Old])
+        return []
+
+    def TargetSums_(self, Blocks):
+        Sums = []
+        for Addr, Size in Blocks:
+            Reply = self.tn.Request('qCRC:%x,%x' % (Addr, Size))
+            if not Reply.startswith('C'):
+                return None
+            Sums.append(int(Reply[1:], 16))
+        return Sums
+
+    CrcTable = None
+
+    #
+    # CRC-32 as computed by GDB for qCRC.
+    #
+    @staticmethod
+    def BlockSum_(Data):
+        if GdbOCD.CrcTable is None:
+            Table = []
+            for i in range(256):
+                Crc = i << 24
+                for _ in range(8):
+                    Crc = ((Crc << 1) ^ 0x04c11db7 if Crc & 0x80000000 else Crc << 1) & 0xffffffff
+                Table.append(Crc)
+            GdbOCD.CrcTable = Table
+        Table = GdbOCD.CrcTable
+        Crc = 0xffffffff
+        for Byte in bytearray(Data):
+            Crc = ((Crc << 8) & 0xffffffff) ^ Table[(Crc >> 24) ^ Byte]
+        return Crc
+
+    #
+    # Registers
+    #
+    def RegNum(self, Name):
+        if self.RegNums is None:
+            self.RegNums = {}
+            Xml = ''
+            while True:
+                Reply = self.tn.Request('qXfer:features:read:target.xml:%x,%x' % (len(Xml), self.tn.PacketSize - 8))
+                if not Reply or Reply[0] not in 'ml':
+                    break
+                Xml += Reply[1:]
+                if 'l' == Reply[0]:
+                    break
+
+            Num = 0
+            for Attrs in re.findall('<reg\\s([^>]*)>', Xml):
+                Attr = dict(re.findall('(\\w+)="([^"]*)"', Attrs))
+                Num = int(Attr.get('regnum', Num))
+                self.RegNums[Attr.get('name')] = Num
+                self.RegSizes[Num] = int(Attr.get('bitsize', 32)) // 8
+                Num += 1
+
+            if not self.RegNums:
+                for Num, Reg in enumerate(['r%d' % n for n in range(0, 13)] + ['sp', 'lr', 'pc']):
+                    self.RegNums[Reg] = Num
+
+        if isinstance(Name, (int, long)):
+            return Name
+        if Name not in self.RegNums:
+            raise ValueError('Unknown register %s' % Name)
+        return self.RegNums[Name]
+
+    #
+    # All general registers by single 'g' packet.
+    #
+    def FetchRegs_(self):
+        Reply = self.tn.Request('g')
+        RegFile = {}
+        if Reply.startswith('E'):
+            return RegFile
+
+        self.RegNum(0)
+        Names = dict([(Num, Name) for Name, Num in self.RegNums.items()])
+        Num = 0
+        Pos = 0
+        while Num in Names and Pos + 2 * self.RegSizes.get(Num, 4) <= len(Reply):
+            Hex = Reply[Pos:Pos + 2 * self.RegSizes.get(Num, 4)]
+            if 'x' not in Hex:
+                RegFile[Names[Num]] = long(bytes(bytearray.fromhex(Hex))[::-1].hex(), 16)
+            Pos += len(Hex)
+            Num += 1
+        return RegFile
+
+    class RegOCD:
+        def __init__(self, OCD, Name, Force=False):
+            self.OCD = OCD
+            self.Name = str(Name)
+            self.Num = OCD.RegNum(Name)
+            self.Force = Force
+
+        def Read(self):
+            if not self.Force:
+                RegFile = self.OCD.Regs_(self.Name)
+                if self.Name in RegFile:
+                    return RegFile[self.Name]
+
+            Reply = self.OCD.tn.Request('p%x' % self.Num)
+            if Reply.startswith('E') or not Reply or 'x' in Reply:
+                return None
+            return long(bytes(bytearray.fromhex(Reply))[::-1].hex(), 16)
+
+        def Write(self, Value):
+            Size = self.OCD.RegSizes.get(self.Num, 4)
+            ValueLE = bytes(bytearray((Value >> (8 * i)) & 0xff for i in range(0, Size))).hex()
+            Reply = self.OCD.tn.Request('P%x=%s' % (self.Num, ValueLE))
+            if 'OK' != Reply:
+                self.OCD.RegFile.pop(self.Name, None)
+                raise ValueError('Cannot write register %s: %s' % (self.Name, Reply))
+            if self.OCD.RegEpoch == self.OCD.Epoch:
+                self.OCD.RegFile[self.Name] = Value
+
+    #
+    # Breakpoints and watchpoints
+    #
+    class BpOCD:
+        def __init__(self, OCD, Addr, Len, HW=False, Condition=None, Log=None):
+            if Condition or Log:
+                raise ValueError('Conditional breakpoints are not supported over GDB port')
+            self.OCD = OCD
+            self.Addr = Addr
+            self.Len = Len
+            self.HW = HW
+            self.Enabled = False
+
+        def Enable(self):
+            r = self.OCD.tn.Request('Z%d,%x,%x' % (1 if self.HW else 0, self.Addr, self.Len))
+            if 'OK' != r:
+                raise ValueError('Cannot set breakpoint at 0x%08x: %s' % (self.Addr, r))
+            self.Enabled = True
+            return r
+
+        def Disable(self):
+            r = self.OCD.tn.Request('z%d,%x,%x' % (1 if self.HW else 0, self.Addr, self.Len))
+            self.Enabled = False
+            return r
+
+    class WpOCD:
+        def __init__(self, OCD, Addr, Len, RWA=None, Value=None, Mask=None):
+            self.OCD = OCD
+            self.Addr = Addr
+            self.Len = Len
+            self.RWA = RWA
+            self.Value = Value
+            self.Mask = Mask
+
+        def Type_(self):
+            return 3 if 0 == self.RWA else 2 if 1 == self.RWA else 4
+
+        def Enable(self):
+            if self.Value is not None:
+                raise ValueError('Value matching watchpoints are not supported by GDB protocol')
+            r = self.OCD.tn.Request('Z%d,%x,%x' % (self.Type_(), self.Addr, self.Len))
+            if 'OK' != r:
+                raise ValueError('Cannot set watchpoint at 0x%08x: %s' % (self.Addr, r))
+
+        def Disable(self):
+            return self.OCD.tn.Request('z%d,%x,%x' % (self.Type_(), self.Addr, self.Len))
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# OpenOCD telnet port asyncio streams.
+#
+class AsyncTransport:
+    Port = 4444
+    Tcl = False
+
+    def __init__(self, Reader, Writer):
+        self.Reader = Reader
+        self.Writer = Writer
+        self.Parser = ResponseParser()
+        Socket = Writer.get_extra_info('socket')
+        if Socket is not None:
+            Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def Close(self):
+        self.Writer.close()
+
+    def Write(self, Text):
+        self.Writer.write(Text.encode('utf-8'))
+
+#
+# Asynchronous OpenOCD telnet session.
+#
+# The API is the same as of OpenOCD, but commands return asyncio futures of their (parsed) results:
+#   ocd = await AsyncOpenOCD.Connect()
+#   pc = await ocd.Reg('pc').Read()
+#
+# Commands are written at once when called, so any number of them may be submitted concurrently,
+# responses are matched to them in order by the session reader task. Response of cancelled command
+# (or timed out by asyncio.wait_for) is dropped. If Timeout is set, it limits every command of the session.
+# Output not preceeded by command echo (asynchronous messages) goes to Readout() waiters, which are
+# queued apart from commands, so pending Readout() never takes a command response.
+#
+class AsyncOpenOCD(OpenOCD):
+    def __init__(self, Transport, Timeout=None):
+        OpenOCD.__init__(self, Transport=Transport)
+        self.Timeout = Timeout
+        self.Loop = asyncio.get_event_loop()
+        self.Waiters = collections.deque()     # (Future, Command line, Parse, Derived)
+        self.Readers = collections.deque()     # Readout() futures
+        self.Unsolicited = collections.deque()
+        self.Error = None
+        self.Banner = self.Readout()
+        self.Task = self.Loop.create_task(self.Receive_())
+
+    @classmethod
+    async def Connect(cls, Host="localhost", Port=4444, Timeout=None):
+        Reader, Writer = await asyncio.open_connection(Host, Port)
+        ocd = cls(AsyncTransport(Reader, Writer), Timeout)
+        await ocd.Banner
+        return ocd
+
+    def Close(self):
+        self.tn.Close()
+        self.Task.cancel()
+
+    async def Receive_(self):
+        try:
+            while True:
+                Data = await self.tn.Reader.read(0x10000)
+                if not Data:
+                    raise EOFError('Connection closed by OpenOCD')
+                self.tn.Parser.Feed(Data)
+                while True:
+                    Lines = self.tn.Parser.Next()
+                    if Lines is None:
+                        break
+                    self.Resolve_(Lines)
+        except asyncio.CancelledError:
+            self.Error = EOFError('Session closed')
+        except Exception as e:
+            self.Error = e
+
+        Futures = [Waiter[0] for Waiter in self.Waiters] + list(self.Readers)
+        self.Waiters.clear()
+        self.Readers.clear()
+        for Future in Futures:
+            if not Future.done():
+                Future.set_exception(self.Error)
+
+    def Resolve_(self, Lines):
+        if not self.Waiters or not Lines or Lines[0].strip() != self.Waiters[0][1]:
+            self.Unsolicited_(Lines)
+            return
+
+        Future, Text, Parse, Derived = self.Waiters.popleft()
+        if not Future.done():
+            try:
+                Future.set_result(Parse(Lines) if Parse else Lines)
+            except ValueError as e:
+                Future.set_exception(e)
+        self.Derived_()
+
+    #
+    # Resolve derived values, which are waiting for nothing but previous commands.
+    #
+    def Derived_(self):
+        while self.Waiters and self.Waiters[0][3]:
+            Future, Text, Parse, Derived = self.Waiters.popleft()
+            if Future.done():
+                continue
+            try:
+                Future.set_result(Parse(None))
+            except asyncio.CancelledError:
+                Future.cancel()
+            except Exception as e:
+                Future.set_exception(e)
+
+    #
+    # Asynchronous message: to the first Readout() still waiting, or queued for the next one.
+    #
+    def Unsolicited_(self, Lines):
+        while self.Readers:
+            Future = self.Readers.popleft()
+            if not Future.done():
+                Future.set_result(Lines)
+                return
+        self.Unsolicited.append(Lines)
+
+    def Expire_(self, Future):
+        if not Future.done():
+            Future.set_exception(asyncio.TimeoutError())
+
+    def Expiring_(self, Future):
+        if self.Timeout is not None:
+            Timer = self.Loop.call_later(self.Timeout, self.Expire_, Future)
+            Future.add_done_callback(lambda f: Timer.cancel())
+        return Future
+
+    def Wait_(self, Text, Parse, Derived):
+        Future = self.Loop.create_future()
+        if self.Error:
+            Future.set_exception(self.Error)
+            return Future
+
+        self.Waiters.append((Future, Text, Parse, Derived))
+        return Future if Derived else self.Expiring_(Future)
+
+    def Query(self, Parse, Cmd, *args):
+        Text = OpenOCD.CmdLine(Cmd, args)
+        Future = self.Wait_(Text.strip(), Parse, False)
+        if not Future.done():
+            self.tn.Write(Text)
+        return Future
+
+    def QueryTcl(self, Parse, Script):
+        raise ValueError('Tcl scripts are not supported by asynchronous session')
+
+    def Deferred_(self):
+        return True
+
+    def Derive_(self, Func):
+        Future = self.Wait_(None, lambda r: Func(), True)
+        self.Derived_()
+        return Future
+
+    def Readout(self):
+        self.Invalidate_()
+        Future = self.Loop.create_future()
+        if self.Unsolicited:
+            Future.set_result(self.Unsolicited.popleft())
+        elif self.Error:
+            Future.set_exception(self.Error)
+        else:
+            self.Readers.append(Future)
+            self.Expiring_(Future)
+        return Future
+
+    def Batch(self):
+        raise ValueError('Commands batches are not needed by asynchronous session')
+
+    async def RemoveBPs(self):
+        await asyncio.gather(*[bp.Disable() for bp in await self.BPs()])
+
+    async def RemoveWPs(self):
+        await asyncio.gather(*[wp.Disable() for wp in await self.WPs()])
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Sessions to many OpenOCD instances (one per board), jobs run on all of them by a thread pool.
+#
+# Targets are (Host, Port), 'host:port' strings or already connected sessions, as list or dictionary by board name.
+# Factory creates session for (Host, Port), e.g. OpenOCD, GdbOCD or lambda with transport choice.
+# Job is called as Job(Session, *Args) on up to Workers boards at once; failed job is retried up to Retries
+# times on reconnected session. Timeout (seconds) applies to connecting, banner and each socket operation:
+# it's passed as Factory(Host, Port, Timeout=Timeout), a silent board fails (socket.timeout) instead of hanging.
+#
+class SessionPool:
+    class Board:
+        def __init__(self, Name, Target):
+            self.Name = Name
+            self.Target = Target
+            self.Session = None if isinstance(Target, tuple) else Target
+            self.Error = None
+
+    #
+    # Outcome of a job on one board.
+    #
+    class Result:
+        __slots__ = ('Board', 'Value', 'Error', 'Attempts', 'Elapsed')
+
+        def __init__(self, Board):
+            self.Board = Board
+            self.Value = None
+            self.Error = None
+            self.Attempts = 0
+            self.Elapsed = 0.0
+
+        def __repr__(self):
+            State = 'ok' if self.Error is None else 'FAILED: %s' % self.Error
+            return '%-24s %8.3fs %d %s' % (self.Board, self.Elapsed, self.Attempts, State)
+
+    #
+    # Results of a job by board, in pool order. Elapsed is wall time, Busy is sum of per-board times.
+    #
+    class Report:
+        def __init__(self, Results, Elapsed):
+            self.Results = Results
+            self.Elapsed = Elapsed
+            self.Busy = sum([Result.Elapsed for Result in Results.values()])
+
+        def __getitem__(self, Name):
+            return self.Results[Name]
+
+        def Values(self):
+            return dict([(Name, Result.Value) for Name, Result in self.Results.items() if Result.Error is None])
+
+        def Failed(self):
+            return [Name for Name, Result in self.Results.items() if Result.Error is not None]
+
+        def __str__(self):
+            Lines = [repr(Result) for Result in self.Results.values()]
+            Lines.append('%d boards, %d failed, %.3fs wall, %.3fs busy' % (len(self.Results), len(self.Failed()), self.Elapsed, self.Busy))
+            return '\n'.join(Lines)
+
+    def __init__(self, Targets, Factory=OpenOCD, Workers=8, Retries=1, Timeout=None):
+        self.Factory = Factory
+        self.Workers = Workers
+        self.Retries = Retries
+        self.Timeout = Timeout
+        Items = Targets.items() if isinstance(Targets, dict) else [(None, Target) for Target in Targets]
+        self.Boards = collections.OrderedDict()
+        for n, (Name, Target) in enumerate(Items):
+            if isinstance(Target, str):
+                Host, Port = Target.rsplit(':', 1)
+                Target = (Host, int(Port))
+            if Name is None:
+                Name = '%s:%d' % Target if isinstance(Target, tuple) else str(n)
+            self.Boards[Name] = SessionPool.Board(Name, Target)
+
+    def __enter__(self):
+        self.Open()
+        return self
+
+    def __exit__(self, Type, Value, Traceback):
+        self.Close()
+
+    def __getitem__(self, Name):
+        return self.Boards[Name].Session
+
+    #
+    # Connect all boards in parallel and health check them. Returns names of healthy boards.
+    #
+    def Open(self):
+        self.Run(lambda Session: Session.Query(None, 'version'))
+        return self.Healthy()
+
+    def Healthy(self):
+        return [Name for Name, Board in self.Boards.items() if Board.Session is not None and Board.Error is None]
+
+    def Close(self):
+        for Board in self.Boards.values():
+            if Board.Session is not None and isinstance(Board.Target, tuple):
+                self.Disconnect_(Board)
+
+    def Disconnect_(self, Board):
+        try:
+            Board.Session.tn.Close()
+        except (IOError, OSError):
+            pass
+        Board.Session = None
+
+    #
+    # Session of board, (re)connected if needed.
+    #
+    def Session_(self, Board):
+        if Board.Session is None:
+            if self.Timeout is None:
+                Board.Session = self.Factory(*Board.Target)
+            else:
+                Board.Session = self.Factory(*Board.Target, Timeout=self.Timeout)
+        return Board.Session
+
+    def Attempt_(self, Board, Job, Args):
+        Result = SessionPool.Result(Board.Name)
+        Start = time.time()
+        while True:
+            Result.Attempts += 1
+            try:
+                Result.Value = Job(self.Session_(Board), *Args)
+                Result.Error = None
+                break
+            except Exception as e:
+                Result.Error = e
+                if Board.Session is not None and isinstance(Board.Target, tuple):
+                    self.Disconnect_(Board)
+                if Result.Attempts > self.Retries:
+                    break
+        Board.Error = Result.Error
+        Result.Elapsed = time.time() - Start
+        return Result
+
+    #
+    # Run Job(Session, *Args) on all boards (or those named in Boards) in parallel, returns Report.
+    #
+    def Run(self, Job, Args=(), Boards=None):
+        Selected = [self.Boards[Name] for Name in (Boards if Boards is not None else self.Boards)]
+        Start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.Workers, len(Selected)))) as Executor:
+            Futures = [Executor.submit(self.Attempt_, Board, Job, Args) for Board in Selected]
+            Results = collections.OrderedDict([(Future.result().Board, Future.result()) for Future in Futures])
+        return SessionPool.Report(Results, time.time() - Start)
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Waits for halts of many running targets in a single thread, by one selector over their sockets.
+#
+#   Mux = HaltMultiplexer([ocd1, ocd2, ocd3])
+#   for ocd, Lines in Mux.Wait(Timeout = 10):
+#       ...
+#
+# Wait() yields (Session, Lines) as each target halts, session is removed from the multiplexer then.
+# Lines is None if the session connection was closed. Sessions still running at the deadline stay registered.
+#
+class HaltMultiplexer:
+    def __init__(self, Sessions=()):
+        self.Selector = selectors.DefaultSelector()
+        self.Sessions = []
+        for Session in Sessions:
+            self.Add(Session)
+
+    def Add(self, Session):
+        if Session.Deferred_():
+            raise ValueError('HaltMultiplexer requires synchronous sessions')
+        self.Selector.register(Session.tn.Socket, selectors.EVENT_READ, Session)
+        self.Sessions.append(Session)
+
+    def Remove(self, Session):
+        self.Selector.unregister(Session.tn.Socket)
+        self.Sessions.remove(Session)
+
+    def __len__(self):
+        return len(self.Sessions)
+
+    def Close(self):
+        self.Selector.close()
+        self.Sessions = []
+
+    def Wait(self, Timeout=None):
+        Deadline = None if Timeout is None else time.time() + Timeout
+        Ready = [(Session, False) for Session in self.Sessions]
+        while self.Sessions:
+            for Session, Closed in Ready:
+                Lines = Session.PollHalt_()
+                if Lines is None and not Closed:
+                    continue
+                self.Remove(Session)
+                yield Session, Lines
+
+            Left = None if Deadline is None else Deadline - time.time()
+            if Left is not None and Left <= 0:
+                return
+            Ready = []
+            for Key, _ in self.Selector.select(Left):
+                try:
+                    Key.data.tn.Recv_()
+                    Ready.append((Key.data, False))
+                except (EOFError, IOError, OSError):
+                    Ready.append((Key.data, True))
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Telnet compatible proxy sharing one upstream OpenOCD connection among many local clients.
+#
+# Clients connect to the listen port as to OpenOCD telnet port (OpenOCD(Port = proxy.Port) works as is).
+# Commands are queued per client and forwarded one at a time, clients take turns (round robin).
+# Asynchronous messages (target halted etc.) are broadcast to all clients.
+# Target state queries are answered from cache until any other command or asynchronous message,
+# flash geometry queries until any command but read-only ones, 'reg' and 'halt' (flash commands, driver
+# lock/unlock, memory writes to flash controller, running firmware may all change it).
+# When upstream connection is closed, the proxy stops and disconnects its clients.
+#
+class OpenOCDProxy:
+    StateQueries = ('reg', 'targets')
+    GeometryQueries = ('flash banks', 'flash list', 'flash info')
+    ReadOnly = ('mdw', 'mdh', 'mdb', 'mdd', 'read_memory', 'version', 'flash banks', 'flash list', 'flash info', 'targets')
+    GeometryKept = ReadOnly + ('reg', 'halt')
+    reTelnet = re.compile(b'\xff[\xfb-\xfe].|\xff[\xf0-\xfa]', re.S)
+
+    class Client:
+        def __init__(self, Socket):
+            self.Socket = Socket
+            self.Buf = bytearray()
+            self.Queue = collections.deque()
+
+    def __init__(self, Host="localhost", Port=4444, ListenHost="localhost", ListenPort=0):
+        self.Upstream = TelnetTransport(Host, Port)
+        self.Listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.Listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Listener.bind((ListenHost, ListenPort))
+        self.Listener.listen(16)
+        self.Port = self.Listener.getsockname()[1]
+        self.Selector = selectors.DefaultSelector()
+        self.Selector.register(self.Listener, selectors.EVENT_READ, None)
+        self.Selector.register(self.Upstream.Socket, selectors.EVENT_READ, self.Upstream)
+        self.Turns = collections.deque()    # clients with queued commands, in order of their turn
+        self.InFlight = None                # (Client, Text) of command forwarded upstream
+        self.State = {}
+        self.Geometry = {}
+        self.Forwarded = 0
+        self.Hits = 0
+        self.Running = False
+
+    #
+    # Serve clients in background thread.
+    #
+    def Start(self):
+        Thread = threading.Thread(target=self.Serve)
+        Thread.daemon = True
+        Thread.start()
+        return self
+
+    def Connect(self):
+        return OpenOCD('localhost', self.Port)
+
+    def Close(self):
+        self.Running = False
+
+    def Serve(self):
+        self.Running = True
+        while self.Running:
+            for Key, _ in self.Selector.select(0.5):
+                if Key.data is None:
+                    Socket, _ = self.Listener.accept()
+                    Socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    Socket.sendall(b'Open On-Chip Debugger\r\n> ')
+                    self.Selector.register(Socket, selectors.EVENT_READ, OpenOCDProxy.Client(Socket))
+                elif Key.data is self.Upstream:
+                    try:
+                        self.Upstream.Recv_()
+                    except (EOFError, IOError, OSError):
+                        self.Running = False
+                        break
+                    self.Upstream_()
+                else:
+                    self.Receive_(Key.data)
+            if self.Running:
+                self.Dispatch_()
+        for Key in list(self.Selector.get_map().values()):
+            Key.fileobj.close()
+        self.Selector.close()
+
+    def Receive_(self, Client):
+        try:
+            Data = Client.Socket.recv(0x10000)
+        except (IOError, OSError):
+            Data = b''
+        if not Data:
+            self.Drop_(Client)
+            return
+        Client.Buf += Data
+        while b'\n' in Client.Buf:
+            i = Client.Buf.index(b'\n')
+            Line = self.reTelnet.sub(b'', bytes(Client.Buf[:i])).decode('utf-8', 'replace').strip()
+            del Client.Buf[:i + 1]
+            if 'exit' == Line:
+                self.Drop_(Client)
+                return
+            if not Client.Queue:
+                self.Turns.append(Client)
+            Client.Queue.append(Line)
+
+    def Drop_(self, Client):
+        self.Selector.unregister(Client.Socket)
+        Client.Socket.close()
+        Client.Queue.clear()
+        if Client in self.Turns:
+            self.Turns.remove(Client)
+
+    def Send_(self, Client, Text):
+        try:
+            Client.Socket.sendall(Text.encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+    def Reply_(self, Client, Text, Lines):
+        self.Send_(Client, ''.join([Line + '\r\n' for Line in [Text] + Lines]) + '> ')
+
+    #
+    # Cache holding response to the command, None if it isn't cacheable.
+    #
+    def Cache_(self, Text):
+        if Text in self.StateQueries:
+            return self.State
+        if Text.startswith(self.GeometryQueries):
+            return self.Geometry
+        return None
+
+    #
+    # Forward next command (or answer it from cache), clients take turns.
+    #
+    def Dispatch_(self):
+        while self.InFlight is None and self.Turns:
+            Client = self.Turns.popleft()
+            Text = Client.Queue.popleft()
+            if Client.Queue:
+                self.Turns.append(Client)
+
+            Cache = self.Cache_(Text)
+            if Cache is not None and Text in Cache:
+                self.Hits += 1
+                self.Reply_(Client, Text, Cache[Text])
+                continue
+            if not Text:
+                self.Send_(Client, '> ')
+                continue
+
+            if not Text.startswith(self.ReadOnly) or ';' in Text:
+                self.State.clear()
+            if not Text.startswith(self.GeometryKept) or ';' in Text:
+                self.Geometry.clear()
+            self.Forwarded += 1
+            self.InFlight = (Client, Text)
+            self.Upstream.Write(Text + '\n')
+
+    #
+    # Responses and asynchronous messages received from upstream.
+    #
+    def Upstream_(self):
+        while True:
+            Lines = self.Upstream.Parser.Next()
+            if Lines is None:
+                return
+            if self.InFlight is not None and Lines and Lines[0].strip() == self.InFlight[1]:
+                Client, Text = self.InFlight
+                self.InFlight = None
+                Cache = self.Cache_(Text)
+                if Cache is not None:
+                    Cache[Text] = Lines[1:]
+                if Client.Socket.fileno() >= 0:
+                    self.Reply_(Client, Text, Lines[1:])
+                continue
 
-    def Flash():
-        return FlashOCD(self)
+            self.State.clear()
+            Message = ''.join([Line + '\r\n' for Line in Lines]) + '> '
+            for Key in list(self.Selector.get_map().values()):
+                if isinstance(Key.data, OpenOCDProxy.Client):
+                    self.Send_(Key.data, Message)
 
 #-------------------------------------------------------------------------------------------------
 
+#
+# Proxy daemon: python OpenOCD.py [host:port [listen port]]
+#
+if __name__ == '__main__':
+    Upstream = sys.argv[1].rsplit(':', 1) if len(sys.argv) > 1 else ('localhost', '4444')
+    Proxy = OpenOCDProxy(Upstream[0], int(Upstream[1]), ListenPort=int(sys.argv[2]) if len(sys.argv) > 2 else 4445)
+    print('Proxy for %s:%s listening on port %d' % (Upstream[0], Upstream[1], Proxy.Port))
+    Proxy.Serve()
@@ -63,7 +63,7 @@ class DMA_InitTypeDef(Structure):
 
 def ReadStruct(OCD, Addr, Struct):
     Size = sizeof(Struct)
-    Raw = OCD.ReadMem(Addr, Size)
+    Raw = OCD.Mem[Addr:Addr + Size]
     memmove(addressof(Struct), Raw, Size)    
 
 #-------------------------------------------------------------------------------------------------
@@ -134,8 +134,7 @@ def DebugSession_DMA(ocd):
                     #
                     # No normal wait was performed, execute some code while DMA
                     #
-                    for x in range(0, MemSize):
-                        ocd.Step()
+                    ocd.StepN(MemSize)
 
                 Data = ocd.ReadMem(dma.MemoryBaseAddr, MemSize)
                 OpenOCD.HexView(Data, dma.MemoryBaseAddr, '  ')
@@ -0,0 +1,79 @@
+'''
+Memory transfer benchmark: bulk ReadMem/WriteMem against one command per word.
+
+    python membench.py [host[:port]] [--size N] [--addr A] [--latency MS]
+
+Without host the simulated telnet server from tests/ocdsim.py is started; --latency adds
+a delay to each simulated command, as a slow adapter or remote server would.
+Against a real target Addr must point to scratch RAM, it is overwritten.
+'''
+#-------------------------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+sys.path.insert(0, os.path.join(Root, 'tests'))
+
+from OpenOCD import OpenOCD
+
+#-------------------------------------------------------------------------------------------------
+
+def Measure(Name, Size, Func, Target=None):
+    if Target is not None:
+        Target.Count.clear()
+    t0 = time.time()
+    Func()
+    Elapsed = time.time() - t0
+    Cmds = ' %5d commands' % sum(Target.Count.values()) if Target is not None else ''
+    print('%-16s%s %9.1f ms %9.0f KB/s' % (Name, Cmds, Elapsed * 1e3, Size / 1024.0 / Elapsed))
+
+#
+# Baseline: one mdw/mdb, mww/mwb command per item
+#
+def ReadWords(ocd, Addr, Size):
+    Head = min((-Addr) & 3, Size)
+    Body = (Size - Head) & ~3
+    for a in range(Addr, Addr + Head):
+        ocd.ReadMem8(a)
+    for a in range(Addr + Head, Addr + Head + Body, 4):
+        ocd.ReadMem32(a)
+    for a in range(Addr + Head + Body, Addr + Size):
+        ocd.ReadMem8(a)
+
+def WriteWords(ocd, Addr, Data):
+    ocd.WriteMemSplit_(Addr, Data, 0, len(Data))
+
+def main():
+    Parser = argparse.ArgumentParser(description='OpenOCD memory transfer benchmark')
+    Parser.add_argument('host', nargs='?', help='OpenOCD telnet host[:port], simulated server if omitted')
+    Parser.add_argument('--size', type=lambda s: int(s, 0), default=4099)
+    Parser.add_argument('--addr', type=lambda s: int(s, 0), default=0x20000001)
+    Parser.add_argument('--latency', type=float, default=0.0, help='simulated per-command latency, ms')
+    Args = Parser.parse_args()
+
+    Target = None
+    if Args.host:
+        Host, _, Port = Args.host.partition(':')
+        ocd = OpenOCD(Host, int(Port or 4444))
+    else:
+        import ocdsim
+        Server = ocdsim.TelnetServer()
+        Target = Server.Target
+        Target.Latency = Args.latency / 1e3
+        ocd = OpenOCD('127.0.0.1', Server.Port)
+
+    Data = os.urandom(Args.size)
+    print('%d bytes at 0x%08x' % (Args.size, Args.addr))
+    Measure('write per word', Args.size, lambda: WriteWords(ocd, Args.addr, Data), Target)
+    Measure('write bulk', Args.size, lambda: ocd.WriteMem(Args.addr, Data), Target)
+    Measure('read per word', Args.size, lambda: ReadWords(ocd, Args.addr, Args.size), Target)
+    Measure('read bulk', Args.size, lambda: ocd.ReadMem(Args.addr, Args.size), Target)
+    if ocd.ReadMem(Args.addr, Args.size) != Data:
+        sys.exit('Read back data mismatch')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Builds small ELF files for tests: loadable segments and a symbol table, 32 or 64 bit, either byte order.
+'''
+#-------------------------------------------------------------------------------------------------
+
+import struct
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Segments: [(PAddr, Data)], Symbols: [(Name, Value, Size, Type)] (Type 1 object, 2 function).
+#
+def Build(Segments=(), Symbols=(), Bits=32, Order='<', Machine=40):
+    Is64 = 64 == Bits
+    EhSize, PhSize, ShSize, SymSize = (64, 56, 64, 24) if Is64 else (52, 32, 40, 16)
+
+    Data = bytearray(EhSize + PhSize * len(Segments))
+    Ph = []
+    for Addr, Payload in Segments:
+        Ph.append((len(Data), Addr, len(Payload)))
+        Data += Payload
+
+    StrTab = bytearray(b'\0')
+    SymTab = bytearray(SymSize)
+    for Name, Value, Size, Type in Symbols:
+        NameOff = len(StrTab)
+        StrTab += Name.encode() + b'\0'
+        Info = 0x10 | Type
+        if Is64:
+            SymTab += struct.pack(Order + 'IBBHQQ', NameOff, Info, 0, 1, Value, Size)
+        else:
+            SymTab += struct.pack(Order + 'IIIBBH', NameOff, Value, Size, Info, 0, 1)
+
+    SymOff = len(Data)
+    Data += SymTab
+    StrOff = len(Data)
+    Data += StrTab
+    ShOff = len(Data)
+
+    #
+    # Sections: null, .symtab (linked to .strtab), .strtab
+    #
+    Sections = [(0, 0, 0, 0, 0), (2, SymOff, len(SymTab), 2, SymSize), (3, StrOff, len(StrTab), 0, 0)]
+    for Type, Offset, Size, Link, EntSize in Sections:
+        if Is64:
+            Data += struct.pack(Order + 'IIQQQQIIQQ', 0, Type, 0, 0, Offset, Size, Link, 1, 1, EntSize)
+        else:
+            Data += struct.pack(Order + 'IIIIIIIIII', 0, Type, 0, 0, Offset, Size, Link, 1, 1, EntSize)
+
+    Ident = b'\x7fELF' + bytes(bytearray((2 if Is64 else 1, 2 if '>' == Order else 1, 1))) + b'\0' * 9
+    Header = (2, Machine, 1, 0, EhSize, ShOff, 0, EhSize, PhSize, len(Segments), ShSize, len(Sections), 0)
+    Data[0:EhSize] = Ident + struct.pack(Order + ('HHIQQQIHHHHHH' if Is64 else 'HHIIIIIHHHHHH'), *Header)
+
+    for n, (Offset, Addr, Size) in enumerate(Ph):
+        if Is64:
+            Entry = struct.pack(Order + 'IIQQQQQQ', 1, 5, Offset, Addr, Addr, Size, Size, 4)
+        else:
+            Entry = struct.pack(Order + 'IIIIIIII', 1, Offset, Addr, Addr, Size, Size, 5, 4)
+        Data[EhSize + n * PhSize:EhSize + (n + 1) * PhSize] = Entry
+    return bytes(Data)
@@ -0,0 +1,203 @@
+'''
+Stand-in for OpenOCD GDB port (remote serial protocol), used by tests.
+
+Serves the simulated target of ocdsim.py: qSupported/QStartNoAckMode, target.xml by qXfer,
+m/M/X memory, g/p/P registers, Z/z break/watchpoints, vCont with stop replies carrying
+expedited pc and sp, and qRcmd monitor commands.
+'''
+#-------------------------------------------------------------------------------------------------
+
+import socket
+import struct
+import threading
+import time
+
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+RegNames = ['r%d' % i for i in range(13)] + ['sp', 'lr', 'pc']
+RegNums = dict(enumerate(RegNames))
+RegNums[25] = 'xPSR'
+
+TargetXml = '<?xml version="1.0"?><target><feature name="org.gnu.gdb.arm.m-profile">' + \
+    ''.join('<reg name="%s" bitsize="32" regnum="%d" type="int"/>' % (Name, Num) for Num, Name in enumerate(RegNames)) + \
+    '<reg name="xPSR" bitsize="32" regnum="25"/></feature></target>'
+
+def Unescape(Data):
+    Out = bytearray()
+    i = 0
+    while i < len(Data):
+        if 0x7d == Data[i]:
+            Out.append(Data[i + 1] ^ 0x20)
+            i += 2
+        else:
+            Out.append(Data[i])
+            i += 1
+    return bytes(Out)
+
+def LE32(Value):
+    return struct.pack('<L', Value).hex()
+
+#-------------------------------------------------------------------------------------------------
+
+class GdbServer:
+    #
+    # NoAck: server accepts QStartNoAckMode. PacketSize: advertised maximum packet size.
+    # Corrupt: number of first acknowledged packets to NAK, forcing retransmission.
+    #
+    def __init__(self, NoAck=True, PacketSize=0x400, Corrupt=0):
+        self.Target = ocdsim.Target()
+        self.NoAck = NoAck
+        self.PacketSize = PacketSize
+        self.Corrupt = Corrupt
+        self.Count = {}         # packet kind (first char, or 'qCRC') -> count
+        self.Packets = []       # packets received (raw, as sent)
+        self.HaltScript = []    # pc values the target stops at on each continue
+        self.HaltDelay = 0.02
+        self.Socket = socket.socket()
+        self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Socket.bind(('127.0.0.1', 0))
+        self.Socket.listen(5)
+        self.Port = self.Socket.getsockname()[1]
+        Thread = threading.Thread(target=self.Accept_)
+        Thread.daemon = True
+        Thread.start()
+
+    def Accept_(self):
+        while True:
+            try:
+                Client, _ = self.Socket.accept()
+            except OSError:
+                return
+            Thread = threading.Thread(target=self.Serve_, args=(Client,))
+            Thread.daemon = True
+            Thread.start()
+
+    def Send_(self, Client, Payload):
+        if not isinstance(Payload, bytes):
+            Payload = Payload.encode('latin-1')
+        Client.sendall(b'$' + Payload + b'#%02x' % (sum(bytearray(Payload)) & 0xff))
+
+    def Serve_(self, Client):
+        Client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        Buf = b''
+        self.Ack = True
+        while True:
+            try:
+                Data = Client.recv(0x10000)
+            except OSError:
+                return
+            if not Data:
+                return
+            Buf += Data
+            while True:
+                if Buf[:1] in (b'+', b'-'):
+                    Buf = Buf[1:]
+                    continue
+                if b'\x03' == Buf[:1]:
+                    Buf = Buf[1:]
+                    self.Send_(Client, self.StopReply_(2))
+                    continue
+                Start = Buf.find(b'$')
+                End = Buf.find(b'#', Start)
+                if Start < 0 or End < 0 or len(Buf) < End + 3:
+                    break
+                Packet = Buf[Start + 1:End]
+                Checksum = int(Buf[End + 1:End + 3], 16)
+                Buf = Buf[End + 3:]
+                if self.Ack:
+                    if Checksum != (sum(bytearray(Packet)) & 0xff) or self.Corrupt:
+                        self.Corrupt = max(0, self.Corrupt - 1)
+                        Client.sendall(b'-')
+                        continue
+                    Client.sendall(b'+')
+                self.Packets.append(Packet)
+                Reply = self.Handle_(Client, Packet)
+                if Reply is not None:
+                    self.Send_(Client, Reply)
+                if b'QStartNoAckMode' == Packet and self.NoAck:
+                    self.Ack = False
+
+    def StopReply_(self, Signal):
+        t = self.Target
+        return 'T%02x0f:%s;0d:%s;thread:1;' % (Signal, LE32(t.Regs['pc']), LE32(t.Regs['sp']))
+
+    def Handle_(self, Client, p):
+        t = self.Target
+        Kind = 'qCRC' if p.startswith(b'qCRC:') else chr(p[0])
+        self.Count[Kind] = self.Count.get(Kind, 0) + 1
+
+        if p.startswith(b'qSupported'):
+            return 'PacketSize=%x;qXfer:features:read+;QStartNoAckMode%s' % (self.PacketSize, '+' if self.NoAck else '-')
+        if b'QStartNoAckMode' == p:
+            return 'OK' if self.NoAck else ''
+        if b'vCont?' == p:
+            return 'vCont;c;C;s;S'
+        if b'?' == p:
+            return 'S05'
+        if p.startswith(b'qXfer:features:read:target.xml:'):
+            Offset, Length = [int(x, 16) for x in p.split(b':')[-1].split(b',')]
+            return ('l' if Offset + Length >= len(TargetXml) else 'm') + TargetXml[Offset:Offset + Length]
+        if p.startswith(b'qCRC:'):
+            Addr, Size = [int(x, 16) for x in p[5:].split(b',')]
+            Crc = 0xffffffff
+            for Byte in bytearray(t.Read(Addr, Size)):
+                Crc ^= Byte << 24
+                for _ in range(8):
+                    Crc = ((Crc << 1) ^ 0x04c11db7 if Crc & 0x80000000 else Crc << 1) & 0xffffffff
+            return 'C%08x' % Crc
+        if p.startswith(b'qRcmd,'):
+            for Line in t.Run(bytes.fromhex(p[6:].decode()).decode()):
+                self.Send_(Client, 'O' + (Line + '\n').encode().hex())
+            return 'OK'
+        if 'm' == Kind:
+            Addr, Size = [int(x, 16) for x in p[1:].split(b',')]
+            if 2 * Size > self.PacketSize:
+                return 'E01'
+            return t.Read(Addr, Size).hex()
+        if 'M' == Kind:
+            Head, Data = p[1:].split(b':')
+            Addr, Size = [int(x, 16) for x in Head.split(b',')]
+            t.Write(Addr, bytes.fromhex(Data.decode()))
+            return 'OK'
+        if 'X' == Kind:
+            if len(p) > self.PacketSize:
+                return 'E02'
+            i = p.index(b':')
+            Addr, Size = [int(x, 16) for x in p[1:i].split(b',')]
+            Data = Unescape(p[i + 1:])
+            if len(Data) != Size:
+                return 'E03'
+            t.Write(Addr, Data)
+            return 'OK'
+        if 'g' == Kind:
+            return ''.join(LE32(t.Regs[Name]) for Name in RegNames)
+        if 'p' == Kind:
+            return LE32(t.Regs[RegNums[int(p[1:], 16)]])
+        if 'P' == Kind:
+            Num, Value = p[1:].split(b'=')
+            t.Regs[RegNums[int(Num, 16)]], = struct.unpack('<L', bytes.fromhex(Value.decode()))
+            return 'OK'
+        if Kind in 'Zz':
+            Type, Addr, Length = [int(x, 16) for x in p[1:].split(b',')]
+            if 'Z' == Kind:
+                t.BPs[Addr] = (Type, Length)
+            else:
+                t.BPs.pop(Addr, None)
+            return 'OK'
+        if p in (b'vCont;c', b'c'):
+            def Stop():
+                time.sleep(self.HaltDelay)
+                if self.HaltScript:
+                    t.Regs['pc'] = self.HaltScript.pop(0)
+                self.Send_(Client, 'O' + b'target halted due to breakpoint\n'.hex())
+                self.Send_(Client, self.StopReply_(5))
+            Thread = threading.Thread(target=Stop)
+            Thread.daemon = True
+            Thread.start()
+            return None
+        if p in (b'vCont;s', b's'):
+            t.Regs['pc'] += 2
+            return self.StopReply_(5)
+        return ''
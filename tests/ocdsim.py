@@ -0,0 +1,200 @@
+'''
+Stand-in for OpenOCD telnet port, used by tests and examples.
+
+Simulates a halted Cortex-M target with sparse memory, a register file and breakpoints,
+and answers the subset of telnet commands OpenOCD.py uses, echo and '> ' prompt included.
+'''
+#-------------------------------------------------------------------------------------------------
+
+import re
+import socket
+import struct
+import threading
+import time
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Simulated target. Unwritten memory reads back as low byte of its address.
+#
+class Target:
+    RegNames = ['r%d' % i for i in range(13)] + ['sp', 'lr', 'pc', 'xPSR', 'msp', 'psp']
+
+    def __init__(self):
+        self.Mem = {}
+        self.Regs = dict((Name, 0) for Name in Target.RegNames)
+        self.Regs['pc'] = 0x08000100
+        self.BPs = {}
+        self.State = 'halted'
+        self.Count = {}         # command name -> number of times executed
+        self.Log = []           # command lines executed
+        self.Latency = 0.0      # added delay per command, seconds
+        self.HaltScript = []    # pc values (or register dictionaries with pc) the target halts at on each resume
+        self.HaltDelay = 0.01
+        self.LineMax = 10 * 1024
+        self.Handlers = {}      # command name -> function(Words, Text) returning output lines
+
+    def Read(self, Addr, Size):
+        return bytes(bytearray(self.Mem.get(Addr + i, (Addr + i) & 0xff) for i in range(Size)))
+
+    def Write(self, Addr, Data):
+        for i, b in enumerate(bytearray(Data)):
+            self.Mem[Addr + i] = b
+
+    def Dump_(self, Width, Addr, Count):
+        Fmt = {4: '<L', 2: '<H', 1: '<B'}[Width]
+        Lines = []
+        Line = None
+        for i in range(Count):
+            if 0 == i % (32 // Width):
+                if Line:
+                    Lines.append(Line)
+                Line = '0x%08x: ' % (Addr + i * Width)
+            Value, = struct.unpack(Fmt, self.Read(Addr + i * Width, Width))
+            Line += ('%0' + str(Width * 2) + 'x ') % Value
+        if Line:
+            Lines.append(Line)
+        return Lines
+
+    #
+    # Execute command line, returns output lines.
+    #
+    def Run(self, Text):
+        time.sleep(self.Latency)
+        if len(Text) > self.LineMax:
+            return ['line too long']
+        w = Text.split()
+        if not w:
+            return []
+        Cmd = w[0]
+        self.Count[Cmd] = self.Count.get(Cmd, 0) + 1
+        self.Log.append(Text)
+
+        if Cmd in self.Handlers:
+            return self.Handlers[Cmd](w, Text)
+        if Cmd in ('mdw', 'mdh', 'mdb'):
+            Width = {'mdw': 4, 'mdh': 2, 'mdb': 1}[Cmd]
+            return self.Dump_(Width, int(w[1], 0), int(w[2], 0) if len(w) > 2 else 1)
+        if Cmd in ('mww', 'mwh', 'mwb'):
+            Fmt = {'mww': '<L', 'mwh': '<H', 'mwb': '<B'}[Cmd]
+            Addr = int(w[1], 0)
+            Value = int(w[2], 0)
+            for i in range(int(w[3], 0) if len(w) > 3 else 1):
+                self.Write(Addr + i * struct.calcsize(Fmt), struct.pack(Fmt, Value))
+            return []
+        if 'write_memory' == Cmd:
+            m = re.match(r'write_memory\s+(\S+)\s+(\d+)\s+\{(.*)\}\s*$', Text)
+            Addr = int(m.group(1), 0)
+            Fmt = {32: '<L', 16: '<H', 8: '<B'}[int(m.group(2))]
+            for i, Value in enumerate(m.group(3).split()):
+                self.Write(Addr + i * struct.calcsize(Fmt), struct.pack(Fmt, int(Value, 0)))
+            return []
+        if 'read_memory' == Cmd:
+            Addr = int(w[1], 0)
+            Fmt = {32: '<L', 16: '<H', 8: '<B'}[int(w[2])]
+            Size = struct.calcsize(Fmt)
+            return [' '.join('0x%x' % struct.unpack(Fmt, self.Read(Addr + i * Size, Size))[0] for i in range(int(w[3], 0)))]
+        if 'reg' == Cmd:
+            if 1 == len(w):
+                Lines = ['===== arm v7m registers']
+                for i, Name in enumerate(self.Regs):
+                    Lines.append('(%d) %s (/32): 0x%08x' % (i, Name, self.Regs[Name]))
+                return Lines
+            if len(w) > 2:
+                self.Regs[w[1]] = int(w[2], 0)
+            return ['%s (/32): 0x%08x' % (w[1], self.Regs[w[1]])]
+        if 'resume' == Cmd:
+            self.State = 'running'
+            return []
+        if 'halt' == Cmd:
+            self.State = 'halted'
+            return ['target halted due to debug-request, current mode: Thread ',
+                    'xPSR: 0x01000000 pc: 0x%08x msp: 0x20001000' % self.Regs['pc']]
+        if 'step' == Cmd:
+            self.Regs['pc'] += 2
+            return ['target halted due to single-step, current mode: Thread ',
+                    'xPSR: 0x01000000 pc: 0x%08x msp: 0x20001000' % self.Regs['pc']]
+        if 'bp' == Cmd:
+            if 1 == len(w):
+                return ['Breakpoint(IVA): 0x%08x, 0x%x, 1' % (Addr, Len) for Addr, Len in self.BPs.items()]
+            self.BPs[int(w[1], 0)] = int(w[2], 0)
+            return ['breakpoint set at 0x%08x' % int(w[1], 0)]
+        if 'rbp' == Cmd:
+            self.BPs.pop(int(w[1], 0), None)
+            return []
+        if 'version' == Cmd:
+            return ['Open On-Chip Debugger 0.12.0']
+        return ['invalid command name "%s"' % Cmd]
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Telnet port server on a free local port, one thread per client.
+# Resume with a non-empty Target.HaltScript prints the prompt, then 'target halted' after HaltDelay.
+# Script item is pc, or dictionary of registers the target has at the halt.
+#
+class TelnetServer:
+    def __init__(self, Target_=None, Port=0):
+        self.Target = Target_ or Target()
+        self.Socket = socket.socket()
+        self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Socket.bind(('127.0.0.1', Port))
+        self.Socket.listen(50)
+        self.Port = self.Socket.getsockname()[1]
+        self.Clients = []
+        Thread = threading.Thread(target=self.Accept_)
+        Thread.daemon = True
+        Thread.start()
+
+    def Close(self):
+        self.Socket.close()
+
+    #
+    # Close connections of all clients, as OpenOCD exiting.
+    #
+    def Drop(self):
+        for Client in self.Clients:
+            try:
+                Client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            Client.close()
+        self.Clients = []
+
+    def Accept_(self):
+        while True:
+            try:
+                Client, _ = self.Socket.accept()
+            except OSError:
+                return
+            self.Clients.append(Client)
+            Thread = threading.Thread(target=self.Serve_, args=(Client,))
+            Thread.daemon = True
+            Thread.start()
+
+    def Serve_(self, Client):
+        t = self.Target
+        Client.sendall(b'\xff\xfb\x01\xff\xfb\x03\xff\xfd\x03Open On-Chip Debugger\r\n> ')
+        Buf = b''
+        while True:
+            try:
+                Data = Client.recv(0x10000)
+            except OSError:
+                return
+            if not Data:
+                return
+            Buf += Data
+            while b'\n' in Buf:
+                Line, Buf = Buf.split(b'\n', 1)
+                Text = Line.decode().strip()
+                Out = Text + '\r\n' + ''.join(s + '\r\n' for s in t.Run(Text))
+                if Text.startswith('resume') and t.HaltScript:
+                    Item = t.HaltScript.pop(0)
+                    t.Regs.update(Item if isinstance(Item, dict) else {'pc': Item})
+                    Pc = t.Regs['pc']
+                    Client.sendall((Out + '> ').encode())
+                    time.sleep(t.HaltDelay)
+                    t.State = 'halted'
+                    Out = '\r      \rtarget halted due to breakpoint, current mode: Thread \r\n' \
+                          'xPSR: 0x61000000 pc: 0x%08x msp: 0x20001fe0\r\n' % Pc
+                Client.sendall((Out + '> ').encode())
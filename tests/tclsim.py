@@ -0,0 +1,220 @@
+'''
+Stand-in for OpenOCD Tcl RPC and telnet ports with a real Tcl interpreter (tkinter), used by tests.
+
+Serves the simulated target of ocdsim.py. Commands Tcl doesn't know (memory, registers, breakpoints,
+target Handlers) are forwarded to the target, and the subset of OpenOCD Tcl built-ins OpenOCD.py relies on is provided:
+capture, read_memory/write_memory, '[target current] get_reg/set_reg/configure -event', sleep,
+tcl_notifications. The interpreter is shared by all connections, as in OpenOCD.
+'''
+#-------------------------------------------------------------------------------------------------
+
+import selectors
+import socket
+import threading
+import time
+import tkinter
+
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Server on a free local port. Rpc: messages terminated by 0x1a, no echo and no prompt;
+# otherwise telnet lines with echo and '> ' prompt.
+#
+# Resume with a non-empty Target.HaltScript halts the target at its next pc after HaltDelay:
+# 'halted' event handler runs and the halt is reported (notification or message); if the handler resumed
+# the target, it goes on to the next HaltScript pc.
+#
+class TclServer:
+    CpuName = 'stm32.cpu'
+
+    def __init__(self, Rpc=True, Target_=None):
+        self.Target = Target_ or ocdsim.Target()
+        self.Rpc = Rpc
+        self.Evals = 0          # scripts evaluated
+        self.Sleeps = 0         # 'sleep' commands executed
+        self.OnSleep = None     # function called on each 'sleep', to change the target meanwhile
+        self.OnHalt = None      # function called with pc on each halt by HaltScript, before the event handler
+        self.Events = {}        # target event name -> handler script
+        self.Notify = set()     # clients with notifications on
+        self.Out = []
+        self.InEvent = False
+        self.Resumed = False
+        self.Socket = socket.socket()
+        self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.Socket.bind(('127.0.0.1', 0))
+        self.Socket.listen(5)
+        self.Port = self.Socket.getsockname()[1]
+        Ready = threading.Event()
+        Thread = threading.Thread(target=self.Serve_, args=(Ready,))
+        Thread.daemon = True
+        Thread.start()
+        Ready.wait()
+
+    #
+    # Interpreter lives in the server thread, tkinter doesn't allow calls from others.
+    #
+    def Setup_(self):
+        t = self.Target
+        I = self.Interp = tkinter.Tcl()
+
+        #
+        # Commands unknown to Tcl go to the target (its Handlers included), output is printed.
+        #
+        def Run(*Args):
+            Lines = t.Run(' '.join(Args))
+            if Lines and Lines[0].startswith('invalid command name'):
+                return Lines[0]
+            self.Out += Lines
+            return ''
+
+        def WriteMemory(Addr, Width, Values):
+            t.Run('write_memory %s %s {%s}' % (Addr, Width, Values))
+            return ''
+        def ReadMemory(Addr, Width, Count):
+            return t.Run('read_memory %s %s %s' % (Addr, Width, Count))[0]
+        def Echo(*Args):
+            self.Out.append(Args[-1])
+            return ''
+        def Sleep(MS, *Args):
+            self.Sleeps += 1
+            time.sleep(int(MS) / 1000.0)
+            if self.OnSleep:
+                self.OnSleep()
+            return ''
+        def Step(*Args):
+            self.Out += t.Run('step')
+            self.Halted_(None)
+            return ''
+        def Halt(*Args):
+            self.Out += t.Run('halt')
+            self.Halted_(None)
+            return ''
+        def Resume(*Args):
+            t.Run('resume')
+            if self.InEvent:
+                self.Resumed = True
+            return ''
+        def Cpu(*Args):
+            if 'configure' == Args[0] and '-event' == Args[1]:
+                self.Events[Args[2]] = Args[3]
+                return ''
+            if 'get_reg' == Args[0]:
+                t.Count['get_reg'] = t.Count.get('get_reg', 0) + 1
+                return ' '.join('%s 0x%08x' % (Name, t.Regs[Name]) for Name in I.splitlist(Args[1]))
+            if 'set_reg' == Args[0]:
+                Items = I.splitlist(Args[1])
+                for i in range(0, len(Items), 2):
+                    t.Regs[Items[i]] = int(Items[i + 1], 0)
+                return ''
+            if 'curstate' == Args[0]:
+                return t.State
+            raise tkinter.TclError('%s: unknown subcommand %s' % (TclServer.CpuName, Args[0]))
+        def Capture(Script):
+            Saved = self.Out
+            self.Out = []
+            try:
+                Result = I.eval(Script)
+                return ''.join(s + '\n' for s in self.Out) + Result
+            finally:
+                self.Out = Saved
+
+        I.createcommand('ocdsim_run', Run)
+        I.eval('proc unknown {args} { set Error [ocdsim_run {*}$args]; if {$Error ne {}} { error $Error } }')
+        I.createcommand('write_memory', WriteMemory)
+        I.createcommand('read_memory', ReadMemory)
+        I.createcommand('echo', Echo)
+        I.createcommand('sleep', Sleep)
+        I.createcommand('step', Step)
+        I.createcommand('halt', Halt)
+        I.createcommand('resume', Resume)
+        I.createcommand('target', lambda *Args: TclServer.CpuName)
+        I.createcommand(TclServer.CpuName, Cpu)
+        I.createcommand('capture', Capture)
+
+    #
+    # Target stopped: run 'halted' event handler, then report the halt to Client (if any), as OpenOCD does
+    # even when the handler resumed the target. Returns True if it did.
+    #
+    def Halted_(self, Client):
+        t = self.Target
+        t.State = 'halted'
+        self.InEvent = True
+        self.Resumed = False
+        try:
+            if 'halted' in self.Events:
+                self.Interp.eval(self.Events['halted'])
+        finally:
+            self.InEvent = False
+        if Client is None:
+            return self.Resumed
+        if self.Rpc:
+            for Other in self.Notify:
+                Other.sendall(b'type target_event event halted\r\n\x1a')
+        else:
+            Client.sendall(('\r      \rtarget halted due to breakpoint, current mode: Thread \r\n'
+                            'xPSR: 0x61000000 pc: 0x%08x msp: 0x20001fe0\r\n> ' % t.Regs['pc']).encode())
+        return self.Resumed
+
+    def Run_(self, Client):
+        t = self.Target
+        while 'running' == t.State and t.HaltScript:
+            time.sleep(t.HaltDelay)
+            t.Regs['pc'] = t.HaltScript.pop(0)
+            if self.OnHalt:
+                self.OnHalt(t.Regs['pc'])
+            if not self.Halted_(Client):
+                return
+
+    def Eval_(self, Client, Text):
+        self.Evals += 1
+        self.Out = []
+        time.sleep(self.Target.Latency)
+        if 'tcl_notifications on' == Text.strip():
+            self.Notify.add(Client)
+            return 'Tcl Notifications: on'
+        try:
+            return self.Interp.eval(Text)
+        except tkinter.TclError as e:
+            return str(e)
+
+    def Serve_(self, Ready):
+        self.Setup_()
+        Selector = selectors.DefaultSelector()
+        Selector.register(self.Socket, selectors.EVENT_READ)
+        Ready.set()
+        Bufs = {}
+        Sep = b'\x1a' if self.Rpc else b'\n'
+        while True:
+            for Key, _ in Selector.select():
+                if Key.fileobj is self.Socket:
+                    Client, _ = self.Socket.accept()
+                    Client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    Selector.register(Client, selectors.EVENT_READ)
+                    Bufs[Client] = b''
+                    if not self.Rpc:
+                        Client.sendall(b'Open On-Chip Debugger\r\n> ')
+                    continue
+                Client = Key.fileobj
+                try:
+                    Data = Client.recv(0x10000)
+                except OSError:
+                    Data = b''
+                if not Data:
+                    Selector.unregister(Client)
+                    self.Notify.discard(Client)
+                    del Bufs[Client]
+                    Client.close()
+                    continue
+                Bufs[Client] += Data
+                while Sep in Bufs[Client]:
+                    Line, Bufs[Client] = Bufs[Client].split(Sep, 1)
+                    Text = Line.decode().strip('\r')
+                    Result = self.Eval_(Client, Text)
+                    if self.Rpc:
+                        Client.sendall(Result.encode() + b'\x1a')
+                    else:
+                        Lines = self.Out + ([Result] if Result else [])
+                        Client.sendall((Text + '\r\n' + ''.join(s + '\r\n' for s in Lines) + '> ').encode())
+                    self.Run_(Client)
@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+from OpenOCD import AsyncOpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Run(Test):
+    Server = ocdsim.TelnetServer()
+    async def Main():
+        ocd = await AsyncOpenOCD.Connect('127.0.0.1', Server.Port, Timeout=2)
+        try:
+            await Test(ocd, Server.Target)
+        finally:
+            ocd.Close()
+    asyncio.run(Main())
+
+def test_concurrent_commands():
+    async def Test(ocd, t):
+        t.Regs.update(r0=1, r1=2)
+        Data = os.urandom(3001)
+        Write = ocd.WriteMem(0x20000001, Data)
+        Regs = [ocd.Reg(Name).Read() for Name in ('pc', 'r0', 'r1')]
+        Read = ocd.ReadMem(0x20000001, len(Data))
+        await Write
+        assert [0x08000100, 1, 2] == await asyncio.gather(*Regs)
+        assert Data == await Read
+    Run(Test)
+
+def test_readout_does_not_take_command_response():
+    async def Test(ocd, t):
+        t.HaltScript = [0x08000200]
+        t.HaltDelay = 0.05
+        await ocd.Resume()
+        Halt = ocd.Readout()
+        Version = ocd.Exec('version')
+        assert ['version', 'Open On-Chip Debugger 0.12.0'] == await Version
+        Lines = await Halt
+        assert Lines[0].startswith('target halted') and '0x08000200' in Lines[1]
+    Run(Test)
+
+def test_readout_queued_message():
+    async def Test(ocd, t):
+        t.HaltScript = [0x08000300]
+        await ocd.Resume()
+        await asyncio.sleep(0.05)
+        await ocd.Exec('version')
+        assert '0x08000300' in (await ocd.Readout())[1]
+    Run(Test)
+
+def test_timeout():
+    async def Test(ocd, t):
+        t.Latency = 0.05
+        ocd.Timeout = 0.01
+        with pytest.raises(asyncio.TimeoutError):
+            await ocd.Reg('r1').Read()
+        with pytest.raises(asyncio.TimeoutError):
+            await ocd.Readout()
+        ocd.Timeout = None
+        t.Latency = 0
+        assert 0x08000100 == await ocd.Reg('pc').Read()
+    Run(Test)
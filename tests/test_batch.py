@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Session():
+    Server = ocdsim.TelnetServer()
+    return Server.Target, OpenOCD('127.0.0.1', Server.Port)
+
+def test_reads_resolve_in_batch():
+    t, ocd = Session()
+    t.Regs.update(r0=0x11, r1=0x22)
+    Data = os.urandom(0x123)
+    t.Write(0x20000001, Data)
+    t.Count.clear()
+    with ocd.Batch():
+        Regs = [ocd.Reg(Name).Read() for Name in ('r0', 'r1', 'pc')]
+        Mem = ocd.ReadMem(0x20000001, len(Data))
+        Word = ocd.ReadMem32(0x20001000)
+        assert {} == t.Count
+    assert [0x11, 0x22, 0x08000100] == [r.Value for r in Regs]
+    assert Data == Mem.Value
+    assert 0x03020100 == Word.Value
+    assert 3 == t.Count['reg']
+
+def test_value_flushes_batch():
+    t, ocd = Session()
+    with ocd.Batch():
+        r = ocd.Reg('pc').Read()
+        assert 0x08000100 == r.Value
+        assert 1 == t.Count['reg']
+
+def test_parse_errors_kept_per_slot():
+    t, ocd = Session()
+    def Bad(Lines):
+        return int(Lines[1])
+    def Missing(Lines):
+        return Lines[5]
+    with ocd.Batch():
+        a = ocd.Query(Bad, 'version')
+        b = ocd.Query(Missing, 'version')
+        c = ocd.Query(None, 'version')
+    with pytest.raises(ValueError):
+        a.Value
+    with pytest.raises(IndexError):
+        b.Value
+    assert ['version', 'Open On-Chip Debugger 0.12.0'] == c.Value
+
+def test_body_raises():
+    t, ocd = Session()
+    with pytest.raises(RuntimeError):
+        with ocd.Batch():
+            r = ocd.Reg('pc').Read()
+            ocd.WriteMem32(0x20000000, 0x12345678)
+            raise RuntimeError('body')
+    assert ocd.Pipeline is None
+    assert 0 == t.Count.get('reg', 0) + t.Count.get('mww', 0)
+    with pytest.raises(ValueError):
+        r.Value
+    assert 0 == t.Count.get('reg', 0)
+    assert 0x08000100 == ocd.Reg('pc').Read()
+
+def test_nested_batch():
+    t, ocd = Session()
+    with ocd.Batch():
+        a = ocd.ReadMem32(0x20000000)
+        with ocd.Batch():
+            b = ocd.ReadMem32(0x20000004)
+        assert b.Done and not a.Done
+    assert 0x03020100 == a.Value and 0x07060504 == b.Value
@@ -0,0 +1,78 @@
+import random
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+#
+# Write combining state only, no connection
+#
+def Combiner():
+    ocd = OpenOCD.__new__(OpenOCD)
+    ocd.Pending = None
+    ocd.PendingData = None
+    ocd.WriteCombine()
+    return ocd
+
+def test_disabled():
+    ocd = OpenOCD.__new__(OpenOCD)
+    ocd.Pending = None
+    assert not ocd.Combine_(0x100, b'x')
+    assert [] == ocd.Pending_(0x100, 1)
+
+def test_merge_overlapping_and_adjacent():
+    ocd = Combiner()
+    ocd.Combine_(0x100, b'aaaa')
+    ocd.Combine_(0x108, b'bbbb')
+    assert [0x100, 0x108] == ocd.Pending
+    ocd.Combine_(0x104, b'cccc')
+    assert [0x100] == ocd.Pending
+    assert [b'aaaaccccbbbb'] == [bytes(Run) for Run in ocd.PendingData]
+    ocd.Combine_(0x0fe, b'dddd')
+    assert [0x0fe] == ocd.Pending
+    assert b'ddddaaccccbbbb' == bytes(ocd.PendingData[0])
+
+def test_pending_patch():
+    ocd = Combiner()
+    ocd.Combine_(0x100, b'aaaa')
+    ocd.Combine_(0x110, b'bb')
+    assert [(0, b'aa'), (0x0e, b'bb')] == ocd.Pending_(0x102, 0x20)
+    assert [(0, b'a')] == ocd.Pending_(0x103, 4)
+    assert [] == ocd.Pending_(0x104, 0xc)
+
+def test_random_against_flat_memory():
+    Random = random.Random(2)
+    ocd = Combiner()
+    Memory = bytearray(0x400)
+    Written = [False] * len(Memory)
+    for _ in range(300):
+        Addr = Random.randrange(0, 0x3c0)
+        Data = bytes(bytearray(Random.randrange(256) for _ in range(Random.randint(1, 0x40))))
+        ocd.Combine_(Addr, Data)
+        Memory[Addr:Addr + len(Data)] = Data
+        for i in range(Addr, Addr + len(Data)):
+            Written[i] = True
+
+        assert ocd.Pending == sorted(ocd.Pending)
+        for Pos, Run, Next in zip(ocd.Pending, ocd.PendingData, ocd.Pending[1:]):
+            assert Pos + len(Run) < Next
+
+        Lo = Random.randrange(0, 0x3c0)
+        Size = Random.randint(1, 0x40)
+        Data = bytearray(Size)
+        OpenOCD.Overlay_(Data, ocd.Pending_(Lo, Size))
+        for i in range(Size):
+            assert Data[i] == (Memory[Lo + i] if Written[Lo + i] else 0)
+
+def test_flush_on_resume():
+    Server = ocdsim.TelnetServer()
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    ocd.WriteCombine()
+    for Addr in range(0x20000000, 0x20000100, 4):
+        ocd.WriteMem32(Addr, Addr)
+    assert 0 == Server.Target.Count.get('mww', 0)
+    assert 0x20000010 == ocd.ReadMem32(0x20000010)
+    ocd.Resume()
+    assert Server.Target.Count.get('write_memory') and 0 == Server.Target.Count.get('mww', 0)
+    assert 0x200000fc == ocd.ReadMem32(0x200000fc)
@@ -0,0 +1,125 @@
+import pytest
+
+pytest.importorskip('tkinter')
+
+from OpenOCD import OpenOCD, TelnetTransport, TclTransport
+import tclsim
+
+#-------------------------------------------------------------------------------------------------
+
+BP = 0x08000200
+Stop = 0x08000300
+
+def Session(Rpc):
+    Server = tclsim.TclServer(Rpc=Rpc)
+    Server.Target.HaltDelay = 0.001
+    return Server, OpenOCD('127.0.0.1', Server.Port, TclTransport if Rpc else TelnetTransport)
+
+#
+# Target r0 counts halts.
+#
+def Counting(Server):
+    t = Server.Target
+    def OnHalt(pc):
+        t.Regs['r0'] += 1
+    Server.OnHalt = OnHalt
+    return t
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_condition(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Counting(Server)
+    ocd.BP(BP, Condition='$r0 == 3', Enable=True)
+    assert 'set r0 [ocdpy_reg r0]; if {!($r0 == 3)} { return 0 }; return 1' == ocd.Procs['ocdpy_bp_0x%08x' % BP].Body
+    assert 2 == t.BPs[BP]
+
+    t.HaltScript = [BP] * 4
+    ocd.Resume()
+    ocd.Readout()
+    assert BP == ocd.Reg('pc').Read()
+    assert 3 == ocd.Reg('r0').Read()
+    assert 2 == ocd.Silent
+    assert 3 == t.Count['resume']
+
+    ocd.Reg('r0').Write(2)
+    ocd.Resume()
+    ocd.Readout()
+    assert 3 == ocd.Reg('r0').Read()
+    assert [] == t.HaltScript
+    assert 2 == ocd.Silent
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_memory_condition(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Server.Target
+    def OnHalt(pc):
+        if 3 == len(t.HaltScript):
+            t.Write(0x20000000, b'\x01\x00\x00\x00')
+    Server.OnHalt = OnHalt
+    ocd.BP(BP, Condition='[mem32 0x20000000] & 1', Enable=True)
+    t.HaltScript = [BP] * 6
+    ocd.Resume()
+    ocd.Readout()
+    assert 3 == len(t.HaltScript)
+    assert 2 == ocd.Silent
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_log(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Counting(Server)
+    t.Regs['lr'] = 0x08000101
+    ocd.BP(BP, Log='hit r0=[expr {$r0}] lr=$lr', Enable=True)
+    ocd.BP(BP + 0x10, Condition='$r0 & 1', Log='odd $r0', Enable=True)
+    t.HaltScript = [BP, BP + 0x10, BP, BP + 0x10, Stop]
+    ocd.Resume()
+    ocd.Readout()
+    assert Stop == ocd.Reg('pc').Read()
+    assert 4 == ocd.Silent
+    assert ['hit r0=1 lr=0x08000101', 'hit r0=3 lr=0x08000101'] == ocd.Logs()
+    assert [] == ocd.Logs()
+
+    t.HaltScript = [BP + 0x10, BP + 0x10, Stop]
+    ocd.Resume()
+    ocd.Readout()
+    assert ['odd 0x00000007'] == ocd.Logs()
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_unhook(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Counting(Server)
+    bp = ocd.BP(BP, Condition='0', Enable=True)
+    bp.Disable()
+    assert BP not in t.BPs
+    assert '' == ocd.Eval_(None, 'array names ::ocdpy_bps').strip()
+    t.HaltScript = [BP, Stop]
+    ocd.Resume()
+    ocd.Readout()
+    assert BP == ocd.Reg('pc').Read()
+    assert 0 == ocd.Silent
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_halt_and_step_not_resumed(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Server.Target
+    ocd.BP(0x08000100, Condition='0', Enable=True)
+    ocd.BP(0x08000102, Condition='0', Enable=True)
+    ocd.Resume()
+    ocd.Halt()
+    assert 'halted' == t.State
+    ocd.Step()
+    assert 'halted' == t.State
+    assert 1 == t.Count['resume']
+    assert '0' == ocd.Eval_(None, 'set ::ocdpy_silent').strip()
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_disarmed_while_sampling(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Server.Target
+    ocd.BP(0x08000100, Condition='0', Enable=True)
+    ocd.Resume()
+    Profiler = ocd.Profiler()
+    assert 3 == Profiler.Sample(3, Interval=0)
+    assert {0x08000100 // 2: 3} == Profiler.Bins
+    assert 4 == t.Count['resume']
+    assert '0' == ocd.Eval_(None, 'set ::ocdpy_silent').strip()
+    assert '1' == ocd.Eval_(None, 'set ::ocdpy_armed').strip()
@@ -0,0 +1,103 @@
+import socket
+
+import pytest
+
+from OpenOCD import OpenOCD, GdbOCD, HaltMultiplexer
+import gdbsim
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Telnet():
+    Server = ocdsim.TelnetServer()
+    Server.Target.HaltDelay = 0.001
+    return Server.Target, OpenOCD('127.0.0.1', Server.Port)
+
+def Gdb():
+    Server = gdbsim.GdbServer()
+    Server.HaltDelay = 0.001
+    return Server, GdbOCD('127.0.0.1', Server.Port)
+
+def test_handlers():
+    t, ocd = Telnet()
+    t.HaltScript = [0x100, 0x200, 0x100, 0x300, 0x400]
+    Hits = []
+    def Count(Addr):
+        Hits.append(Addr)
+        return True
+    ocd.OnHalt(0x100, Count)
+    ocd.OnHalt(0x200, Count)
+    assert 0x300 == ocd.Dispatch()
+    assert [0x100, 0x200, 0x100] == Hits
+    assert 4 == t.Count['resume']
+    assert 0 == t.Count.get('reg', 0)
+    assert 'breakpoint' == ocd.HaltReason
+
+def test_default_handler_and_rearm():
+    t, ocd = Telnet()
+    t.HaltScript = [0x100, 0x200, 0x300]
+    Hits = []
+    ocd.OnHalt(None, lambda Addr: Hits.append(Addr) or Addr != 0x200)
+    ocd.OnHalt(0x300, lambda Addr: False)
+    assert 0x200 == ocd.Dispatch()
+    assert [0x100, 0x200] == Hits
+    assert 0x300 == ocd.Dispatch()
+    assert [0x100, 0x200] == Hits
+    assert 3 == t.Count['resume']
+
+def test_remove_handler():
+    t, ocd = Telnet()
+    t.HaltScript = [0x100, 0x100]
+    ocd.OnHalt(0x100, lambda Addr: True)
+    ocd.OnHalt(0x100, None)
+    assert 0x100 == ocd.Dispatch()
+    assert 1 == t.Count['resume']
+
+def test_batch_refused():
+    t, ocd = Telnet()
+    with ocd.Batch():
+        with pytest.raises(ValueError):
+            ocd.Dispatch()
+
+def test_gdb_expedited_pc():
+    Server, ocd = Gdb()
+    Server.HaltScript = [0x08000200, 0x08000300, 0x08000400]
+    Hits = []
+    ocd.OnHalt(0x08000200, lambda Addr: Hits.append(Addr) or True)
+    ocd.OnHalt(0x08000300, lambda Addr: Hits.append(Addr) or True)
+    Server.Count.clear()
+    assert 0x08000400 == ocd.Dispatch()
+    assert [0x08000200, 0x08000300] == Hits
+    assert 3 == Server.Count['v']
+    assert 0 == Server.Count.get('g', 0) + Server.Count.get('p', 0)
+
+def Halting(Pc, Delay):
+    t, ocd = Telnet()
+    t.HaltDelay = Delay
+    t.HaltScript = [Pc] if Pc is not None else []
+    ocd.Resume()
+    return ocd
+
+def test_multiplexer_pairs():
+    a = Halting(0x08000200, 0.2)
+    b = Halting(0x08000300, 0.02)
+    c = Halting(None, 0)
+    Mux = HaltMultiplexer([a, b, c])
+    Halts = list(Mux.Wait(Timeout=1))
+    assert [b, a] == [ocd for ocd, Lines in Halts]
+    assert 'pc: 0x08000300' in Halts[0][1][-1]
+    assert 'pc: 0x08000200' in Halts[1][1][-1]
+    assert 0x08000300 == b.Reg('pc').Read()
+    assert 0x08000200 == a.Reg('pc').Read()
+    assert [c] == Mux.Sessions
+    Mux.Close()
+
+def test_multiplexer_eof():
+    a = Halting(0x08000200, 0.2)
+    b = Halting(None, 0)
+    b.tn.Socket.shutdown(socket.SHUT_RD)
+    Mux = HaltMultiplexer([a, b])
+    Halts = list(Mux.Wait(Timeout=2))
+    assert [(b, None), a] == [Halts[0], Halts[1][0]]
+    assert 'pc: 0x08000200' in Halts[1][1][-1]
+    assert 0 == len(Mux)
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+@pytest.fixture
+def Session():
+    Server = ocdsim.TelnetServer()
+    return OpenOCD('127.0.0.1', Server.Port), Server.Target
+
+def test_dump(Session, tmp_path):
+    ocd, t = Session
+    Size = 0x4000 + 6
+    FileName = str(tmp_path / 'sram.bin')
+    Progress = []
+    ocd.Image().DumpTo(FileName, 0x20000001, Size, Chunk=0x1000, Progress=lambda *Args: Progress.append(Args))
+    with open(FileName, 'rb') as f:
+        assert t.Read(0x20000001, Size) == f.read()
+    assert 5 == len(Progress) and (Size, Size) == Progress[-1][:2]
+
+def test_resume(Session, tmp_path):
+    ocd, t = Session
+    FileName = str(tmp_path / 'sram.bin')
+    ocd.Image().DumpTo(FileName, 0x20000000, 0x2000)
+    with open(FileName, 'r+b') as f:
+        f.seek(0x1000)
+        f.write(b'\0' * 0x1000)
+    t.Count.clear()
+    ocd.Image().DumpTo(FileName, 0x20000000, 0x2000, Offset=0x1000)
+    with open(FileName, 'rb') as f:
+        assert t.Read(0x20000000, 0x2000) == f.read()
+    assert 1 == t.Count['mdw']
+
+def test_resume_missing_or_short(Session, tmp_path):
+    ocd, t = Session
+    FileName = str(tmp_path / 'sram.bin')
+    with pytest.raises(ValueError):
+        ocd.Image().DumpTo(FileName, 0x20000000, 0x2000, Offset=0x1000)
+    assert not (tmp_path / 'sram.bin').exists()
+    with open(FileName, 'wb') as f:
+        f.write(b'\0' * 0x800)
+    with pytest.raises(ValueError):
+        ocd.Image().DumpTo(FileName, 0x20000000, 0x2000, Offset=0x1000)
+
+def test_file_object(Session):
+    ocd, t = Session
+    f = io.BytesIO()
+    ocd.Image().DumpTo(f, 0x20000001, 100)
+    assert t.Read(0x20000001, 100) == f.getvalue()
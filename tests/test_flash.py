@@ -0,0 +1,256 @@
+import os
+
+import pytest
+
+from OpenOCD import OpenOCD, GdbOCD, TclTransport
+import gdbsim
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+@pytest.fixture
+def Session():
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    t.FlashError = None
+    t.Handlers['flash'] = lambda w, Text: [t.FlashError] if t.FlashError else []
+    return OpenOCD('127.0.0.1', Server.Port).Flash(), t
+
+@pytest.mark.parametrize('Call, Line', [
+    (lambda f: f.WriteImage('fw.elf'), 'flash write_image "fw.elf"'),
+    (lambda f: f.WriteImage('fw.bin', Bin=True), 'flash write_image "fw.bin" 0x0 bin'),
+    (lambda f: f.WriteImage('fw.bin', Erase=True, Offset=0x08000000, Bin=True), 'flash write_image erase "fw.bin" 0x8000000 bin'),
+    (lambda f: f.WriteBank(0, 'x.bin'), 'flash write_bank 0 "x.bin"'),
+    (lambda f: f.WriteBank(0, 'x.bin', 0x400), 'flash write_bank 0 "x.bin" 0x400'),
+    (lambda f: f.ReadBank(0, 'x.bin'), 'flash read_bank 0 "x.bin"'),
+    (lambda f: f.ReadBank(0, 'x.bin', 0x400), 'flash read_bank 0 "x.bin" 0x400'),
+    (lambda f: f.ReadBank(0, 'x.bin', Length=0x100), 'flash read_bank 0 "x.bin" 0x0 0x100'),
+    (lambda f: f.VerifyBank(0, 'x.bin'), 'flash verify_bank 0 "x.bin"'),
+    (lambda f: f.VerifyBank(0, 'x.bin', 0, 0x100), 'flash verify_bank 0 "x.bin" 0x0 0x100'),
+    (lambda f: f.EraseAddress(0x08000000, 0x800, Pad=True), 'flash erase_address pad 0x8000000 0x800'),
+    (lambda f: f.Fill8(0x08000000, 0xaa, 4), 'flash fillb 0x8000000 0xaa 4'),
+    (lambda f: f.Fill16(0x08000000, 0xaa55, 4), 'flash fillh 0x8000000 0xaa55 4'),
+    (lambda f: f.Fill32(0x08000000, 0xdeadbeef, 4), 'flash fillw 0x8000000 0xdeadbeef 4'),
+])
+def test_command_line(Session, Call, Line):
+    Flash, t = Session
+    Call(Flash)
+    assert Line == t.Log[-1]
+
+@pytest.mark.parametrize('Call', [
+    lambda f: f.EraseAddress(0x08000000, 0x800),
+    lambda f: f.Fill8(0x08000000, 0xaa, 4),
+    lambda f: f.Fill16(0x08000000, 0xaa55, 4),
+    lambda f: f.Fill32(0x08000000, 0xdeadbeef, 4),
+    lambda f: f.WriteImage('fw.elf'),
+    lambda f: f.WriteBank(0, 'x.bin'),
+])
+def test_failure_raises(Session, Call):
+    Flash, t = Session
+    t.FlashError = 'Error: flash write algorithm aborted by target'
+    with pytest.raises(ValueError):
+        Call(Flash)
+
+#-------------------------------------------------------------------------------------------------
+
+Base = 0x08000000
+SectorSize = 0x400
+
+#
+# Single bank of Sectors sectors: geometry, erase_sector and write_bank by file, scan_chain ID code.
+# Sectors in t.Protected are shown protected.
+#
+def FlashTarget(t, Sectors=16, IdCode=0x1ba01477):
+    t.Write(Base, b'\xff' * (Sectors * SectorSize))
+    t.IdCode = IdCode
+    t.Protected = set()
+    Bank = '#0 : stm32f1x at 0x%08x, size 0x%08x, buswidth 0, chipwidth 0' % (Base, Sectors * SectorSize)
+    def Flash(w, Text):
+        if 'banks' == w[1]:
+            return [Bank]
+        if 'info' == w[1]:
+            return [Bank] + ['\t#  %d: 0x%08x (0x%x 1kB) %s' % (i, i * SectorSize, SectorSize, 'protected' if i in t.Protected else 'not protected')
+                             for i in range(Sectors)]
+        if 'erase_sector' == w[1]:
+            First, Last = int(w[3]), int(w[4])
+            t.Write(Base + First * SectorSize, b'\xff' * ((Last - First + 1) * SectorSize))
+        if 'write_bank' == w[1]:
+            with open(w[3].strip('"'), 'rb') as f:
+                t.Write(Base + int(w[4], 0), f.read())
+        return []
+    t.Handlers['flash'] = Flash
+    t.Handlers['scan_chain'] = lambda w, Text: [
+        '   TapName             Enabled  IdCode     Expected   IrLen IrCap IrMask',
+        '-- ------------------- -------- ---------- ---------- ----- ----- ------',
+        ' 0 stm32f1x.cpu           Y     0x%08x 0x%08x     4 0x01  0x0f' % (t.IdCode, t.IdCode)]
+    return t
+
+def Erased(t):
+    return [s for s in t.Log if s.startswith('flash erase_sector')]
+
+def Image(Size=5 * SectorSize + 0x10):
+    return os.urandom(Size)
+
+def Flip(Data, i):
+    return Data[:i] + bytes(bytearray([Data[i] ^ 1])) + Data[i + 1:]
+
+@pytest.fixture(autouse=True)
+def NoGeometryCache(monkeypatch):
+    monkeypatch.setattr(OpenOCD.FlashOCD, 'CacheDir', None)
+
+def test_diff_read_back():
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target)
+    Flash = OpenOCD('127.0.0.1', Server.Port).Flash()
+    Data = Image()
+    r = Flash.WriteDiff(Data, Base + SectorSize)
+    assert (6, 6) == (r.Sectors, r.Changed)
+    assert Data == t.Read(Base + SectorSize, len(Data))
+    assert b'\xff' * (SectorSize - 0x10) == t.Read(Base + SectorSize + len(Data), SectorSize - 0x10)
+
+    Data = Flip(Data, 0x900)
+    t.Log[:] = []
+    r = Flash.WriteDiff(Data, Base + SectorSize)
+    assert (6, 1) == (r.Sectors, r.Changed)
+    assert ['flash erase_sector 0 3 3'] == Erased(t)
+    assert Data == t.Read(Base + SectorSize, len(Data))
+    assert t.Count['mdw']
+
+def test_diff_target_sums():
+    tclsim = pytest.importorskip('tclsim')
+    Server = tclsim.TclServer()
+    t = FlashTarget(Server.Target)
+    Flash = OpenOCD('127.0.0.1', Server.Port, TclTransport).Flash()
+    Data = Image()
+    Flash.WriteDiff(Data, Base)
+    Data = Flip(Data, 0x10)
+    t.Log[:] = []
+    t.Count.clear()
+    r = Flash.WriteDiff(Data, Base)
+    assert (6, 1) == (r.Sectors, r.Changed)
+    assert ['flash erase_sector 0 0 0'] == Erased(t)
+    assert 0 == t.Count.get('mdw', 0) + t.Count.get('mdb', 0)
+    assert Data == t.Read(Base, len(Data))
+
+def test_diff_gdb():
+    Server = gdbsim.GdbServer()
+    t = FlashTarget(Server.Target)
+    Flash = GdbOCD('127.0.0.1', Server.Port).Flash()
+    Data = Image()
+    Flash.WriteDiff(Data, Base)
+    Data = Flip(Data, len(Data) - 1)
+    t.Log[:] = []
+    Server.Count.clear()
+    r = Flash.WriteDiff(Data, Base)
+    assert (6, 1) == (r.Sectors, r.Changed)
+    assert ['flash erase_sector 0 5 5'] == Erased(t)
+    assert 6 == Server.Count['qCRC']
+    assert 0 == Server.Count.get('m', 0)
+
+def test_manifest(tmp_path):
+    Manifest = str(tmp_path / 'fw.manifest')
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target)
+    Flash = OpenOCD('127.0.0.1', Server.Port).Flash()
+    Data = Image()
+    Flash.WriteDiff(Data, Base, Manifest)
+    with open(Manifest) as f:
+        assert 'target idcode 0x1ba01477 flash 0x08000000+0x4000\n' == f.readline()
+
+    t.Count.clear()
+    r = Flash.WriteDiff(Data, Base, Manifest)
+    assert 0 == r.Changed
+    assert 0 == t.Count.get('mdw', 0)
+
+    Data = Flip(Data, 0x500)
+    r = Flash.WriteDiff(Data, Base, Manifest)
+    assert 1 == r.Changed
+    assert 0 == t.Count.get('mdw', 0)
+
+@pytest.mark.parametrize('IdCode, Identity', [(0x2ba01477, None), (0x1ba01477, 'board-2')])
+def test_manifest_of_other_target(tmp_path, IdCode, Identity):
+    Manifest = str(tmp_path / 'fw.manifest')
+    Data = Image()
+    Server = ocdsim.TelnetServer()
+    FlashTarget(Server.Target)
+    OpenOCD('127.0.0.1', Server.Port).Flash().WriteDiff(Data, Base, Manifest)
+
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target, IdCode=IdCode)
+    r = OpenOCD('127.0.0.1', Server.Port).Flash().WriteDiff(Data, Base, Manifest, Identity=Identity)
+    assert 6 == r.Changed
+    assert Data == t.Read(Base, len(Data))
+    with open(Manifest) as f:
+        assert f.readline().startswith('target idcode 0x%08x' % IdCode)
+
+def Infos(t):
+    return len([s for s in t.Log if s.startswith('flash info')])
+
+def test_geometry_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(OpenOCD.FlashOCD, 'CacheDir', str(tmp_path))
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target)
+    t.Protected = {0, 1}
+    Flash = OpenOCD('127.0.0.1', Server.Port).Flash()
+    Bank, = Flash.Geometry()
+    assert 1 == Infos(t)
+    assert [1, 1] + [0] * 14 == list(Bank.Protected)
+    assert Flash.Geometry()[0] is Bank
+    assert [os.path.join(str(tmp_path), 'flash-1ba01477-4000.txt')] == [str(p) for p in tmp_path.iterdir()]
+
+    t.Protected = set()
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    Cached, = ocd.Flash().Geometry()
+    assert 1 == Infos(t)
+    assert (0, 'stm32f1x', Base, 16 * SectorSize) == (Cached.Id, Cached.Driver, Cached.Base, Cached.Size)
+    assert list(Bank.Offsets) == list(Cached.Offsets) and list(Bank.Sizes) == list(Cached.Sizes)
+    assert Cached.Protected is None
+    assert (Cached, 3) == ocd.Flash().Sector(Base + 3 * SectorSize + 5)
+    assert [0] * 16 == list(ocd.Flash().Info(0).Protected)
+
+    Fresh, = ocd.Flash().Geometry(Refresh=True)
+    assert 3 == Infos(t)
+    assert [0] * 16 == list(Fresh.Protected)
+
+def test_geometry_cache_invalidation(tmp_path, monkeypatch):
+    monkeypatch.setattr(OpenOCD.FlashOCD, 'CacheDir', str(tmp_path))
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target)
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    ocd.Flash().Geometry()
+    for Drop in (lambda: ocd.Flash().Probe(0), lambda: ocd.Reset(Halt=True), lambda: ocd.SoftResetHalt()):
+        Drop()
+        assert ocd.FlashBanks is None
+        ocd.Flash().Geometry()
+    assert 1 == Infos(t)
+
+    t.IdCode = 0x2ba01477
+    ocd.Flash().Probe(0)
+    ocd.Flash().Geometry()
+    assert 2 == Infos(t)
+
+    with open(os.path.join(str(tmp_path), 'flash-2ba01477-4000.txt'), 'w') as f:
+        f.write('bank 0 - stm32f1x 0x08000000\n0x0\n')
+    ocd.Flash().Probe(0)
+    assert 16 == len(ocd.Flash().Geometry()[0])
+    assert 3 == Infos(t)
+
+    with open(os.path.join(str(tmp_path), 'flash-2ba01477-4000.txt'), 'w') as f:
+        f.write('bank 0 - stm32f1x 0x08010000 0x4000\n0x0 0x4000\n')
+    ocd.Flash().Probe(0)
+    assert 16 == len(ocd.Flash().Geometry()[0])
+    assert 4 == Infos(t)
+
+def test_protect_updates_known_flags(tmp_path, monkeypatch):
+    monkeypatch.setattr(OpenOCD.FlashOCD, 'CacheDir', str(tmp_path))
+    Server = ocdsim.TelnetServer()
+    t = FlashTarget(Server.Target)
+    Flash = OpenOCD('127.0.0.1', Server.Port).Flash()
+    Bank, = Flash.Geometry()
+    Flash.Protect(0, 2, 3, On=True)
+    assert [0, 0, 1, 1] == list(Bank.Protected[:4])
+
+    Flash = OpenOCD('127.0.0.1', Server.Port).Flash()
+    Cached, = Flash.Geometry()
+    Flash.Protect(0, 0, On=True)
+    assert Cached.Protected is None
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from OpenOCD import GdbOCD, GdbTransport
+import gdbsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Session(**Args):
+    Server = gdbsim.GdbServer(**Args)
+    return Server, GdbOCD('127.0.0.1', Server.Port)
+
+def test_escape():
+    Data = bytes(bytearray(range(256))) * 2
+    Escaped = GdbTransport.Escape(Data)
+    for c in b'#$*':
+        assert c not in bytearray(Escaped)
+    assert GdbTransport.Unescape(Escaped) == Data
+    assert gdbsim.Unescape(Escaped) == Data
+
+def test_unescape_run_length():
+    assert GdbTransport.Unescape(b'0* ') == b'0000'
+    assert GdbTransport.Unescape(b'a}]b') == b'a}b'
+
+@pytest.mark.parametrize('NoAck', [True, False])
+def test_ack_mode(NoAck):
+    Server, ocd = Session(NoAck=NoAck)
+    assert ocd.tn.Ack == (not NoAck)
+    assert 0x400 == ocd.tn.PacketSize
+    assert ocd.ReadMem32(0x20000000) == 0x03020100
+
+def test_nak_retransmit():
+    Server, ocd = Session(NoAck=False, Corrupt=2)
+    ocd.WriteMem32(0x20000000, 0x12345678)
+    assert Server.Target.Read(0x20000000, 4) == b'\x78\x56\x34\x12'
+
+@pytest.mark.parametrize('NoAck', [True, False])
+def test_memory_escaped(NoAck):
+    Server, ocd = Session(NoAck=NoAck, PacketSize=0x100)
+    Data = b'}#$*' * 200 + os.urandom(3000)
+    ocd.WriteMem(0x20000003, Data)
+    assert Server.Target.Read(0x20000003, len(Data)) == Data
+    assert ocd.ReadMem(0x20000003, len(Data)) == Data
+    Writes = [p for p in Server.Packets if p.startswith(b'X')]
+    assert all(len(p) <= 0x100 for p in Writes)
+    assert any(b'}]' in p for p in Writes)
+    assert 0 == Server.Count.get('M', 0)
+
+def test_register_discovery():
+    Server, ocd = Session()
+    assert 15 == ocd.Reg('pc').Num
+    assert 25 == ocd.Reg('xPSR').Num
+    assert 4 == ocd.RegSizes[25]
+    with pytest.raises(ValueError):
+        ocd.Reg('nosuch')
+
+def test_registers():
+    Server, ocd = Session()
+    t = Server.Target
+    t.Regs['r3'] = 0x1234
+    assert 0x1234 == ocd.Reg('r3').Read()
+    assert 1 == Server.Count['g']
+    assert 0x08000100 == ocd.Reg('pc').Read()
+    assert 1 == Server.Count['g'] and 0 == Server.Count.get('p', 0)
+
+    assert 0x1234 == ocd.Reg('r3', Force=True).Read()
+    assert 1 == Server.Count['p']
+
+    ocd.Reg('r4').Write(0xcafe)
+    assert 0xcafe == t.Regs['r4']
+    assert 0xcafe == ocd.Reg('r4').Read()
+    assert 1 == Server.Count['g']
+
+def test_breakpoints():
+    Server, ocd = Session()
+    bp = ocd.BP(0x08000200, Enable=True)
+    assert (1, 2) == Server.Target.BPs[0x08000200]
+    bp.Disable()
+    assert 0x08000200 not in Server.Target.BPs
+    ocd.WP(0x20000010, Write=True, Enable=True)
+    assert (2, 4) == Server.Target.BPs[0x20000010]
+
+def test_stop_reply_expedited():
+    Server, ocd = Session()
+    Server.HaltScript = [0x08000200]
+    ocd.Resume()
+    Lines = ocd.Readout()
+    assert 'target halted due to breakpoint' == Lines[0]
+    assert Lines[-1].startswith('T05')
+    assert 'breakpoint' == ocd.HaltReason
+    Server.Count.clear()
+    assert 0x08000200 == ocd.Reg('pc').Read()
+    assert 0 == Server.Count.get('g', 0) + Server.Count.get('p', 0)
+
+def test_step():
+    Server, ocd = Session()
+    ocd.Step()
+    assert 0x08000102 == ocd.Reg('pc').Read()
+
+def test_monitor():
+    Server, ocd = Session()
+    assert ['version', 'Open On-Chip Debugger 0.12.0'] == ocd.Exec('version')
@@ -0,0 +1,144 @@
+import os
+
+import pytest
+
+from OpenOCD import LocalImage, OpenOCD
+import elfgen
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Checksum(Record):
+    return (-sum(bytearray(Record))) & 0xff
+
+#
+# Intel HEX with extended linear address records, 16 bytes per line
+#
+def IntelHex(Segments):
+    Lines = []
+    for Addr, Data in Segments:
+        Upper = None
+        for Pos in range(0, len(Data), 16):
+            a = Addr + Pos
+            if a >> 16 != Upper:
+                Upper = a >> 16
+                Record = bytearray((2, 0, 0, 4, Upper >> 8, Upper & 0xff))
+                Lines.append(':' + (Record + bytearray((Checksum(Record),))).hex().upper())
+            Chunk = bytearray(Data[Pos:Pos + 16])
+            Record = bytearray((len(Chunk), (a >> 8) & 0xff, a & 0xff, 0)) + Chunk
+            Lines.append(':' + (Record + bytearray((Checksum(Record),))).hex().upper())
+    Lines.append(':00000001FF')
+    return '\n'.join(Lines) + '\n'
+
+def SRecords(Segments, Kind=3):
+    Lines = ['S00600004844521B']
+    AddrSize = Kind + 1
+    for Addr, Data in Segments:
+        for Pos in range(0, len(Data), 16):
+            Chunk = bytearray(Data[Pos:Pos + 16])
+            Record = bytearray((len(Chunk) + AddrSize + 1,)) + bytearray((Addr + Pos).to_bytes(AddrSize, 'big')) + Chunk
+            Lines.append('S%d' % Kind + (Record + bytearray(((~sum(Record)) & 0xff,))).hex().upper())
+    Lines.append('S70500000000FA')
+    return '\r\n'.join(Lines) + '\r\n'
+
+Segments = [(0x08000000, os.urandom(0x123)), (0x0800fff8, os.urandom(0x20)), (0x20000000, os.urandom(5))]
+
+def Flat(Image):
+    return [(Addr, bytes(Data)) for Addr, Data in Image]
+
+def test_runs():
+    Runs = LocalImage.Runs_([(0x10, b'cd'), (0x0, b'ab'), (0x2, b'xx'), (0x11, b'EF'), (0x20, b'z')])
+    assert [(0x0, b'abxx'), (0x10, b'cEF'), (0x20, b'z')] == [(Addr, bytes(Run)) for Addr, Run in Runs]
+
+def test_intel_hex():
+    Text = IntelHex(Segments)
+    assert Segments == [(Addr, bytes(Data)) for Addr, Data in LocalImage.Runs_(LocalImage.HexRecords_(Text.splitlines()))]
+    assert Segments == Flat(LocalImage.Parse(Text.encode()))
+
+def test_intel_hex_segment_address():
+    Lines = [':020000021000EC', ':0400000001020304F2', ':00000001FF', ':0400000005060708E2']
+    assert [(0x10000, b'\x01\x02\x03\x04')] == [(Addr, bytes(Data)) for Addr, Data in LocalImage.HexRecords_(Lines)]
+
+def test_intel_hex_bad_checksum():
+    with pytest.raises(ValueError):
+        list(LocalImage.HexRecords_([':0400000001020304F3']))
+
+@pytest.mark.parametrize('Kind', [1, 2, 3])
+def test_s_records(Kind):
+    Small = [(Addr & ((1 << (8 * (Kind + 1))) - 1), Data) for Addr, Data in Segments[:1]]
+    Text = SRecords(Small, Kind)
+    assert Small == [(Addr, bytes(Data)) for Addr, Data in LocalImage.Runs_(LocalImage.SRecords_(Text.splitlines()))]
+    assert Small == Flat(LocalImage.Parse(Text.encode()))
+
+def test_s_records_bad_checksum():
+    with pytest.raises(ValueError):
+        list(LocalImage.SRecords_(['S1070000010203040F']))
+
+def test_elf_and_offset():
+    Data = elfgen.Build(Segments[:2])
+    assert Segments[:2] == Flat(LocalImage.Parse(Data))
+    assert [(Addr + 0x100, Run) for Addr, Run in Segments[:2]] == Flat(LocalImage.Parse(Data, 0x100))
+
+def test_open_cached(tmp_path):
+    FileName = str(tmp_path / 'fw.bin')
+    with open(FileName, 'wb') as f:
+        f.write(b'\x01' * 0x40)
+    Image = LocalImage.Open(FileName, 0x08000000)
+    assert [(0x08000000, b'\x01' * 0x40)] == Flat(Image)
+    assert 0x40 == Image.Size()
+    assert Image is LocalImage.Open(FileName, 0x08000000)
+    with open(FileName, 'wb') as f:
+        f.write(b'\x02' * 0x20)
+    assert [(0x08000000, b'\x02' * 0x20)] == Flat(LocalImage.Open(FileName, 0x08000000))
+
+#-------------------------------------------------------------------------------------------------
+
+Base = 0x20000000
+
+def Session():
+    Server = ocdsim.TelnetServer()
+    return Server.Target, OpenOCD('127.0.0.1', Server.Port)
+
+def Writes(t):
+    return [s for s in t.Log if s.split()[0] in ('mww', 'mwh', 'mwb', 'write_memory')]
+
+def test_reload_unchanged():
+    t, ocd = Session()
+    Data = os.urandom(0x1003)
+    assert len(Data) == ocd.Image().Reload(Data, Base)
+    assert Data == t.Read(Base, len(Data))
+    t.Log[:] = []
+    assert 0 == ocd.Image().Reload(Data, Base)
+    assert [] == Writes(t)
+
+def test_reload_one_byte():
+    t, ocd = Session()
+    Data = os.urandom(0x1003)
+    ocd.Image().LoadBytes(Data, Base)
+    Data = Data[:0x234] + bytes(bytearray([Data[0x234] ^ 1])) + Data[0x235:]
+    t.Log[:] = []
+    assert 0x100 == ocd.Image().Reload(Data, Base)
+    assert 1 == len(Writes(t))
+    assert Data == t.Read(Base, len(Data))
+
+    Data = Data[:-1] + bytes(bytearray([Data[-1] ^ 1]))
+    assert 3 == ocd.Image().Reload(Data, Base)
+
+def test_reload_after_target_write():
+    t, ocd = Session()
+    Data = os.urandom(0x800)
+    ocd.Image().Reload(Data, Base)
+    ocd.WriteMem32(Base + 0x404, 0)
+    assert 0x100 == ocd.Image().Reload(Data, Base)
+    assert Data == t.Read(Base, len(Data))
+    ocd.Reset(Halt=True)
+    assert len(Data) == ocd.Image().Reload(Data, Base)
+
+def test_reload_sampled():
+    t, ocd = Session()
+    Data = os.urandom(0x800)
+    ocd.Image().Reload(Data, Base)
+    assert 0 == ocd.Image().Reload(Data, Base, Sample=8)
+    t.Write(Base + 0x10, bytes(bytearray([Data[0x10] ^ 1])))
+    assert len(Data) == ocd.Image().Reload(Data, Base, Sample=8)
+    assert Data == t.Read(Base, len(Data))
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+Base = 0x20000000
+
+def Session():
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    t.Write(Base, os.urandom(0x2000))
+    return t, OpenOCD('127.0.0.1', Server.Port)
+
+def Reads(t):
+    return sum(t.Count.get(Cmd, 0) for Cmd in ('mdw', 'mdh', 'mdb'))
+
+def test_page_cache():
+    t, ocd = Session()
+    assert t.Read(Base + 0x10, 0x20) == ocd.Mem[Base + 0x10:Base + 0x30]
+    Count = Reads(t)
+    assert t.Read(Base, 0x400) == ocd.Mem[Base:Base + 0x400]
+    assert t.Read(Base + 0x3ff, 1)[0] == ocd.Mem[Base + 0x3ff]
+    assert Count == Reads(t)
+    assert [Base] == list(ocd.Mem.Pages)
+
+def test_missing_pages_read_as_one_run():
+    t, ocd = Session()
+    ocd.Mem[Base + 0x400]
+    t.Count.clear()
+    assert t.Read(Base, 0x1000) == ocd.Mem[Base:Base + 0x1000]
+    assert [Base, Base + 0x800] == [int(s.split()[1], 0) for s in t.Log[-2:] if s.startswith('mdw')]
+    assert 2 == Reads(t)
+
+def test_lru_eviction():
+    t, ocd = Session()
+    ocd.Mem.Budget = 3 * ocd.Mem.PageSize
+    for Page in (0, 1, 2):
+        ocd.Mem[Base + Page * 0x400]
+    ocd.Mem[Base]
+    ocd.Mem[Base + 3 * 0x400]
+    assert [Base + 2 * 0x400, Base, Base + 3 * 0x400] == list(ocd.Mem.Pages)
+    Count = Reads(t)
+    ocd.Mem[Base]
+    assert Count == Reads(t)
+    ocd.Mem[Base + 0x400]
+    assert Count + 1 == Reads(t)
+
+def test_slices():
+    t, ocd = Session()
+    assert b'' == ocd.Mem[Base + 0x10:Base + 0x8]
+    with pytest.raises(ValueError):
+        ocd.Mem[Base:]
+    with pytest.raises(ValueError):
+        ocd.Mem[:Base]
+    with pytest.raises(ValueError):
+        ocd.Mem[Base:Base + 8:2]
+    with pytest.raises(ValueError):
+        ocd.Mem[-1]
+    with pytest.raises(ValueError):
+        ocd.Mem[-0x10:Base]
+    with pytest.raises(ValueError):
+        ocd.Mem[Base:Base + 4] = b'abc'
+    assert 0 == Reads(t)
+
+def test_write_straddling_pages():
+    t, ocd = Session()
+    ocd.Mem[Base:Base + 0x800]
+    Count = Reads(t)
+    Data = os.urandom(0x10)
+    ocd.Mem[Base + 0x3f8:Base + 0x408] = Data
+    ocd.Mem[Base + 0x7ff] = 0x5a
+    assert t.Read(Base + 0x3f8, 0x10) == Data
+    assert Data == ocd.Mem[Base + 0x3f8:Base + 0x408]
+    assert 0x5a == ocd.Mem[Base + 0x7ff]
+    assert Count == Reads(t)
+
+def test_invalidated_on_halt():
+    t, ocd = Session()
+    t.HaltScript = [0x08000200]
+    ocd.Mem[Base]
+    t.Write(Base, b'\x77')
+    assert 0x77 != ocd.Mem[Base]
+    ocd.Resume()
+    ocd.Readout()
+    assert 0x77 == ocd.Mem[Base]
+
+def test_volatile_not_cached():
+    t, ocd = Session()
+    ocd.Mem[0x40000000:0x40000004]
+    ocd.Mem[0x40000000:0x40000004]
+    assert 2 == Reads(t)
+    assert {} == ocd.Mem.Pages
@@ -0,0 +1,86 @@
+import random
+
+from OpenOCD import OpenOCD, ResponseParser, TelnetTransport
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+Stream = b'\xff\xfb\x01\xff\xfa\x18\x01\xff\xf0banner\r\n> ' \
+         b'mdw 0x20000000\r\n0x20000000: 00 01\r\n\r   \rtarget halted\r\nxPSR: 1 pc: 0x2\r\n> ' \
+         b'\xff\xff> '
+
+Expected = [['banner'], ['mdw 0x20000000', '0x20000000: 00 01', 'target halted', 'xPSR: 1 pc: 0x2']]
+
+def Responses(Parser, Chunks):
+    Out = []
+    for Chunk in Chunks:
+        Parser.Feed(Chunk)
+        while True:
+            Lines = Parser.Next()
+            if Lines is None:
+                break
+            Out.append(Lines)
+    return Out
+
+def test_whole_stream():
+    assert Responses(ResponseParser(), [Stream]) == Expected
+
+def test_bytewise():
+    assert Responses(ResponseParser(), [Stream[i:i + 1] for i in range(len(Stream))]) == Expected
+
+def test_random_splits():
+    Random = random.Random(1)
+    for _ in range(500):
+        Cuts = sorted(Random.sample(range(1, len(Stream)), Random.randint(1, 12)))
+        Chunks = [Stream[a:b] for a, b in zip([0] + Cuts, Cuts + [len(Stream)])]
+        assert Responses(ResponseParser(), Chunks) == Expected
+
+def test_iac_split():
+    #
+    # IAC, command and option each in own packet; escaped 0xff is data
+    #
+    p = ResponseParser()
+    assert Responses(p, [b'\xff', b'\xfb', b'\x01ab\xff', b'\xff', b'c\r\n>', b' ']) == [['ab\ufffdc']]
+
+def test_subnegotiation_split():
+    p = ResponseParser()
+    assert Responses(p, [b'x\xff\xfa\x18', b'\x01\xff', b'\xf0y\r\n> ']) == [['xy']]
+
+def test_prompt_split():
+    p = ResponseParser()
+    assert Responses(p, [b'cmd\r\n>']) == []
+    assert Responses(p, [b' ']) == [['cmd']]
+
+def test_prompt_inside_line():
+    assert Responses(ResponseParser(), [b'a > b\r\n> ']) == [['a > b']]
+
+def test_carriage_return_erase():
+    assert Responses(ResponseParser(), [b'partial\r       \rtarget halted\r\n> ']) == [['target halted']]
+
+def test_empty_lines_dropped():
+    assert Responses(ResponseParser(), [b'\r\n\r\nx\r\n\r\n> ']) == [['x']]
+
+def test_large_response():
+    Lines = [b'0x%08x: 00000000 00000000' % (i * 8) for i in range(10000)]
+    Data = b'\r\n'.join(Lines) + b'\r\n> '
+    Out = Responses(ResponseParser(), [Data[i:i + 1460] for i in range(0, len(Data), 1460)])
+    assert 1 == len(Out) and len(Out[0]) == len(Lines) and Out[0][-1] == Lines[-1].decode()
+
+#-------------------------------------------------------------------------------------------------
+
+def test_transport():
+    Server = ocdsim.TelnetServer()
+    tn = TelnetTransport('127.0.0.1', Server.Port)
+    assert tn.Banner == ['Open On-Chip Debugger']
+    tn.Write('version\n')
+    assert tn.Response('version') == ['version', 'Open On-Chip Debugger 0.12.0']
+    tn.Close()
+
+def test_halt_message_queued():
+    Server = ocdsim.TelnetServer()
+    Server.Target.HaltScript = [0x08000200]
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    ocd.Resume()
+    assert ocd.Exec('version') == ['version', 'Open On-Chip Debugger 0.12.0']
+    Lines = ocd.Readout()
+    assert Lines[0].startswith('target halted') and '0x08000200' in Lines[1]
@@ -0,0 +1,102 @@
+import socket
+import threading
+import time
+
+from OpenOCD import OpenOCD, SessionPool
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Servers(Count):
+    return [ocdsim.TelnetServer() for n in range(Count)]
+
+#
+# Accepts connections (by listen backlog) but never sends anything, as a hung OpenOCD.
+#
+def Silent():
+    Socket = socket.socket()
+    Socket.bind(('127.0.0.1', 0))
+    Socket.listen(5)
+    return Socket
+
+def test_results_in_pool_order():
+    Boards = Servers(3)
+    for n, Server in enumerate(Boards):
+        Server.Target.Latency = 0.1 * (len(Boards) - n)
+    Names = ['b%d' % n for n in range(len(Boards))]
+    with SessionPool(dict(zip(Names, [('127.0.0.1', Server.Port) for Server in Boards]))) as Pool:
+        Done = []
+        def Job(ocd, Name):
+            ocd.Query(None, 'mdw 0x20000000')
+            Done.append(Name)
+            return Name.upper()
+        Report = Pool.Run(lambda ocd: Job(ocd, [Name for Name in Names if Pool[Name] is ocd][0]))
+    assert list(reversed(Names)) == Done
+    assert Names == list(Report.Results)
+    assert {'b0': 'B0', 'b1': 'B1', 'b2': 'B2'} == Report.Values()
+    assert Report.Elapsed < Report.Busy
+
+def test_retry_on_reconnected_session():
+    Boards = Servers(2)
+    Sessions = []
+    Ports = []
+    Lock = threading.Lock()
+    def Job(ocd):
+        Port = ocd.tn.Socket.getpeername()[1]
+        with Lock:
+            Sessions.append(ocd)
+            Ports.append(Port)
+            First = 1 == Ports.count(Port)
+        if First:
+            raise IOError('link lost')
+        return ocd.Query(None, 'mdw 0x20000000')[0]
+    Pool = SessionPool(['127.0.0.1:%d' % Server.Port for Server in Boards], Retries=1)
+    Report = Pool.Run(Job)
+    assert [] == Report.Failed()
+    assert [2, 2] == [Result.Attempts for Result in Report.Results.values()]
+    assert 4 == len(set(Sessions))
+    assert ['mdw 0x20000000', 'mdw 0x20000000'] == list(Report.Values().values())
+    Pool.Close()
+
+    Ports[:] = []
+    Pool = SessionPool(['127.0.0.1:%d' % Server.Port for Server in Boards], Retries=0)
+    Report = Pool.Run(Job)
+    assert 2 == len(Report.Failed())
+    assert isinstance(Report[Report.Failed()[0]].Error, IOError)
+    assert [] == Pool.Healthy()
+
+def test_silent_board_times_out():
+    Good = ocdsim.TelnetServer()
+    Hung = Silent()
+    Start = time.time()
+    with SessionPool({'good': ('127.0.0.1', Good.Port), 'hung': Hung.getsockname()}, Retries=1, Timeout=0.2) as Pool:
+        assert ['good'] == Pool.Healthy()
+        assert Pool['hung'] is None
+        Report = Pool.Run(lambda ocd: ocd.Query(None, 'mdw 0x20000000'))
+    assert time.time() - Start < 5
+    assert ['hung'] == Report.Failed()
+    assert isinstance(Report['hung'].Error, socket.timeout)
+    assert 2 == Report['hung'].Attempts
+    assert 1 == Report['good'].Attempts
+    Hung.close()
+
+def test_timeout_on_established_session():
+    Server = ocdsim.TelnetServer()
+    with SessionPool([('127.0.0.1', Server.Port)], Retries=0, Timeout=0.2) as Pool:
+        Server.Target.Latency = 1
+        Report = Pool.Run(lambda ocd: ocd.Query(None, 'mdw 0x20000000'))
+        assert isinstance(Report.Results.popitem()[1].Error, socket.timeout)
+        Server.Target.Latency = 0
+        assert [] == Pool.Run(lambda ocd: ocd.Query(None, 'mdw 0x20000000')).Failed()
+
+def test_factory_gets_timeout():
+    Server = ocdsim.TelnetServer()
+    Calls = []
+    def Factory(Host, Port, **Options):
+        Calls.append(Options)
+        return OpenOCD(Host, Port, **Options)
+    with SessionPool([('127.0.0.1', Server.Port)], Factory=Factory, Timeout=3) as Pool:
+        assert 3 == Pool[Pool.Healthy()[0]].tn.Socket.gettimeout()
+    with SessionPool([('127.0.0.1', Server.Port)], Factory=Factory) as Pool:
+        assert Pool[Pool.Healthy()[0]].tn.Socket.gettimeout() is None
+    assert [{'Timeout': 3}, {}] == Calls
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+pytest.importorskip('tkinter')
+
+from OpenOCD import OpenOCD, TelnetTransport, TclTransport
+import tclsim
+
+#-------------------------------------------------------------------------------------------------
+
+Addr = 0x20000000
+
+def Connect(Server):
+    return OpenOCD('127.0.0.1', Server.Port, TclTransport if Server.Rpc else TelnetTransport)
+
+def Session(Rpc):
+    Server = tclsim.TclServer(Rpc=Rpc)
+    return Server, Connect(Server)
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_upload_once(Rpc):
+    Server, ocd = Session(Rpc)
+    Twice = ocd.Proc('twice', 'x', 'return [expr {$x * 2}]')
+    assert '42' == Twice.Call(None, 21).strip()
+    Evals = Server.Evals
+    assert ocd.Proc('twice', 'x', 'return [expr {$x * 2}]') is Twice
+    assert Evals == Server.Evals
+
+    Thrice = ocd.Proc('twice', 'x', 'return [expr {$x * 3}]')
+    assert Thrice is not Twice
+    assert '63' == Thrice.Call(None, 21).strip()
+    assert Evals + 3 == Server.Evals
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_defined_by_previous_session(Rpc):
+    Server, ocd = Session(Rpc)
+    ocd.Proc('twice', 'x', 'return [expr {$x * 2}]')
+
+    Other = Connect(Server)
+    Evals = Server.Evals
+    Twice = Other.Proc('twice', 'x', '\n  return [expr {$x * 2}]  \n')
+    assert Evals + 1 == Server.Evals
+    assert '4' == Twice.Call(None, 2).strip()
+
+    Evals = Server.Evals
+    Other.Proc('twice', 'x', 'return [expr {$x + $x + 1}]')
+    assert Evals + 2 == Server.Evals
+    assert '5' == ocd.Procs['twice'].Call(None, 2).strip()
+
+def test_upload_in_batch():
+    Server, ocd = Session(True)
+    with ocd.Batch():
+        Twice = ocd.Proc('twice', 'x', 'return [expr {$x * 2}]')
+        r = Twice.Call(None, 5)
+    assert '10' == r.Value
+
+def test_list_arguments():
+    Server, ocd = Session(True)
+    Sum = ocd.Proc('ocdpy_sum', 'List', 'return [tcl::mathop::+ {*}$List]')
+    assert '6' == Sum.Call(None, [1, 2, 3])
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_poll_mem_match(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Server.Target
+    t.Write(Addr, b'\0\0\0\0')
+    assert 0 == ocd.Mem[Addr]
+    def OnSleep():
+        if 3 == Server.Sleeps:
+            t.Write(Addr, b'\x5a\x01\0\0')
+    Server.OnSleep = OnSleep
+    assert 0x15a == ocd.PollMem(Addr, 0xff, 0x5a)
+    assert 3 == Server.Sleeps
+    assert 0x5a == ocd.Mem[Addr]
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_poll_mem_timeout(Rpc):
+    Server, ocd = Session(Rpc)
+    Start = time.time()
+    assert ocd.PollMem(Addr, 0xff, 0x5a, Timeout=30) is None
+    assert time.time() - Start >= 0.03
+    assert Server.Sleeps > 1
+
+def test_poll_mem_flushes_combined_writes():
+    Server, ocd = Session(True)
+    ocd.WriteCombine()
+    ocd.WriteMem32(Addr, 0x5a)
+    assert 0x5a == ocd.PollMem(Addr, 0xff, 0x5a, Timeout=0)
+    assert 0 == Server.Sleeps
+
+@pytest.mark.parametrize('Rpc', [True, False])
+def test_step(Rpc):
+    Server, ocd = Session(Rpc)
+    t = Server.Target
+    assert 0x08000100 + 10 == ocd.StepN(5)
+    Count = t.Count.get('get_reg', 0)
+    assert 0x08000100 + 10 == ocd.Reg('pc').Read()
+    assert Count == t.Count.get('get_reg', 0)
+    assert 0x08000120 == ocd.StepUntil(0x08000120, 0x08000130)
+    assert ocd.StepUntil(0x08001000, 0x08002000, Max=4) is None
+    assert 0x08000128 == t.Regs['pc']
+
+def test_modify_mem():
+    Server, ocd = Session(True)
+    t = Server.Target
+    t.Write(Addr, b'\xff\x00\x00\x00\x0f\x00\x00\x00')
+    ocd.ModifyMem([(Addr, 0x0f, 0x01), (Addr + 4, 0xf0, 0x30)])
+    assert b'\xf1\x00\x00\x00\x3f\x00\x00\x00' == t.Read(Addr, 8)
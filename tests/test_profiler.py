@@ -0,0 +1,47 @@
+import os
+import struct
+
+from OpenOCD import OpenOCD, SymbolTable
+
+#-------------------------------------------------------------------------------------------------
+
+Symbols = SymbolTable([('f1', 0x08000000, 0x20), ('f2', 0x08000020, 0x80), ('ramfunc', 0x20000100, 0x40)])
+
+def Profiler():
+    Profiler = OpenOCD.ProfilerOCD.__new__(OpenOCD.ProfilerOCD)
+    Profiler.Symbols = Symbols
+    Profiler.Granularity = 2
+    Profiler.Reset()
+    return Profiler
+
+def test_sparse_buckets():
+    pr = Profiler()
+    for Addr in [0x08000004] * 6 + [0x08000030] * 3 + [0x20000104, 0xfffffffe]:
+        pr.Add(Addr)
+    assert 4 == len(pr.Bins)
+    assert 11 == pr.Total
+    assert (0x08000004, 6) == pr.Flat()[0][:2]
+    assert [('f1', 6), ('f2', 3), ('?', 1), ('ramfunc', 1)] == sorted([f[:2] for f in pr.Functions()], key=lambda f: (-f[1], f[0]))
+
+def test_gmon(tmp_path, monkeypatch):
+    Bins = [0] * 64
+    Bins[3] = 50
+    Bins[10] = 25
+    Bins[63] = 25
+    Data = b'gmon' + struct.pack('<4L', 1, 0, 0, 0) + b'\0' + struct.pack('<4L', 0x08000000, 0x08000100, 64, 1000) + \
+           b'seconds' + b'\0' * 8 + b's' + struct.pack('<64H', *Bins)
+    FileName = str(tmp_path / 'gmon.out')
+    with open(FileName, 'wb') as f:
+        f.write(Data)
+    assert (0x08000000, 0x08000100, 1000) == OpenOCD.ProfilerOCD.ReadGmon(FileName)[:3]
+
+    pr = Profiler()
+    pr.OCD = pr
+    Cmds = []
+    pr.Exec = lambda *args: Cmds.append(args)
+    monkeypatch.chdir(tmp_path)
+    pr.Profile(1, 'gmon.out')
+    assert [('profile', '1', '{%s}' % os.path.abspath('gmon.out'))] == Cmds
+    assert 100 == pr.Total and 3 == len(pr.Bins)
+    assert ('f1', 50, 50.0) == pr.Functions()[0]
+    assert 0x0800000c == pr.Flat(1)[0][0]
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from OpenOCD import OpenOCDProxy, TelnetTransport
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+Info = ['#0 : stm32f1x at 0x08000000, size 0x00010000, buswidth 0, chipwidth 0',
+        '	#  0: 0x00000000 (0x400 1kB) not protected']
+
+def Proxy():
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    t.Handlers['flash'] = lambda Words, Text: Info if 'info' == Words[1] else []
+    t.Handlers['stm32f1x'] = lambda Words, Text: []
+    t.Handlers['version'] = lambda Words, Text: ['Open On-Chip Debugger 0.12.0']
+    t.Handlers['targets'] = lambda Words, Text: ['  0* stm32.cpu          cortex_m   little stm32.cpu          %s' % t.State]
+    return Server, OpenOCDProxy('127.0.0.1', Server.Port).Start()
+
+#
+# Commands forwarded upstream while running Cmds through the proxy.
+#
+def Forwarded(Proxy, ocd, *Cmds):
+    Count = Proxy.Forwarded
+    for Cmd in Cmds:
+        ocd.Query(None, Cmd)
+    return Proxy.Forwarded - Count
+
+def test_state_cache():
+    Server, Proxy_ = Proxy()
+    ocd = Proxy_.Connect()
+    assert 2 == Forwarded(Proxy_, ocd, 'reg', 'reg', 'targets', 'reg')
+    assert 2 == Proxy_.Hits
+    assert ocd.Query(None, 'reg') == ['reg'] + Server.Target.Run('reg')
+    assert 2 == Forwarded(Proxy_, ocd, 'mww 0x20000000 1', 'reg')
+    assert 2 == Forwarded(Proxy_, ocd, 'version; resume', 'reg')
+    assert 2 == Forwarded(Proxy_, ocd, 'mdw 0x20000000', 'version', 'reg')
+    Proxy_.Close()
+
+@pytest.mark.parametrize('Cmd', ['flash probe 0', 'flash protect 0 0 0 on', 'flash erase_sector 0 0 0',
+                                 'stm32f1x unlock 0', 'stm32f1x lock 0', 'mww 0x40022004 0x45670123',
+                                 'reset halt', 'resume', 'flash info 0; flash protect 0 0 0 off'])
+def test_geometry_cleared(Cmd):
+    Server, Proxy_ = Proxy()
+    ocd = Proxy_.Connect()
+    assert 1 == Forwarded(Proxy_, ocd, 'flash info 0', 'flash info 0')
+    assert Info == ocd.Query(None, 'flash info 0')[1:]
+    assert 2 == Forwarded(Proxy_, ocd, Cmd, 'flash info 0')
+    Proxy_.Close()
+
+def test_geometry_kept():
+    Server, Proxy_ = Proxy()
+    ocd = Proxy_.Connect()
+    assert 2 == Forwarded(Proxy_, ocd, 'flash info 0', 'flash banks')
+    assert 4 == Forwarded(Proxy_, ocd, 'mdw 0x08000000', 'reg pc', 'halt', 'flash info 0', 'flash banks', 'version')
+    assert 2 == Server.Target.Count['flash']
+    Proxy_.Close()
+
+def test_fair_interleaving():
+    Server, Proxy_ = Proxy()
+    Server.Target.Latency = 0.05
+    a = TelnetTransport('127.0.0.1', Proxy_.Port)
+    b = TelnetTransport('127.0.0.1', Proxy_.Port)
+    Server.Target.Log = []
+    a.Write('mdw 0xa1\nmdw 0xa2\nmdw 0xa3\n')
+    time.sleep(0.02)
+    b.Write('mdw 0xb1\nmdw 0xb2\nmdw 0xb3\n')
+    for Client, Name in ((a, 'a'), (b, 'b')):
+        for n in range(1, 4):
+            assert 'mdw 0x%s%d' % (Name, n) == Client.Response('mdw 0x%s%d' % (Name, n))[0]
+    assert ['mdw 0xa1', 'mdw 0xa2', 'mdw 0xb1', 'mdw 0xa3', 'mdw 0xb2', 'mdw 0xb3'] == Server.Target.Log
+    Proxy_.Close()
+
+def test_async_broadcast():
+    Server, Proxy_ = Proxy()
+    t = Server.Target
+    t.HaltDelay = 0.05
+    a = Proxy_.Connect()
+    b = Proxy_.Connect()
+    a.Query(None, 'reg')
+    t.HaltScript = [0x08000200]
+    a.Resume()
+    for ocd in (a, b):
+        Lines = ocd.WaitHalt(Timeout=2)
+        assert Lines is not None and 'pc: 0x08000200' in Lines[-1]
+    assert 1 == Forwarded(Proxy_, b, 'reg')
+    Proxy_.Close()
+
+def test_upstream_eof():
+    Server, Proxy_ = Proxy()
+    a = Proxy_.Connect()
+    b = TelnetTransport('127.0.0.1', Proxy_.Port)
+    a.Query(None, 'version')
+    Server.Drop()
+    Deadline = time.time() + 2
+    while Proxy_.Running and time.time() < Deadline:
+        time.sleep(0.01)
+    assert not Proxy_.Running
+    for Transport in (a.tn, b):
+        with pytest.raises((EOFError, IOError, OSError)):
+            Transport.Write('version\n')
+            Transport.Readout()
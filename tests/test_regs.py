@@ -0,0 +1,78 @@
+import pytest
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Session():
+    Server = ocdsim.TelnetServer()
+    return Server.Target, OpenOCD('127.0.0.1', Server.Port)
+
+def test_cached_between_changes():
+    t, ocd = Session()
+    t.Regs['r0'] = 1
+    assert 1 == ocd.Reg('r0').Read()
+    t.Regs['r0'] = 2
+    assert 1 == ocd.Reg('r0').Read()
+    assert 0x08000100 == ocd.Reg('pc').Read()
+    ocd.Query(None, 'version')
+    assert 1 == ocd.Reg('r0').Read()
+    assert 1 == t.Count['reg']
+    assert 2 == ocd.Reg('r0', Force=True).Read()
+
+def test_write_through():
+    t, ocd = Session()
+    ocd.Reg('r0').Read()
+    ocd.Reg('r1').Write(0x55)
+    assert 0x55 == t.Regs['r1']
+    assert 0x55 == ocd.Reg('r1').Read()
+    assert 2 == t.Count['reg']
+
+Changes = {
+    'Exec': lambda ocd: ocd.Exec('version'),
+    'Step': lambda ocd: ocd.Step(),
+    'Resume': lambda ocd: ocd.Resume(),
+    'Halt': lambda ocd: ocd.Halt(),
+    'Reset': lambda ocd: ocd.Reset(Halt=True),
+    'SoftResetHalt': lambda ocd: ocd.SoftResetHalt(),
+}
+
+@pytest.mark.parametrize('Name', sorted(Changes))
+def test_invalidated_by(Name):
+    t, ocd = Session()
+    t.Regs['r0'] = 1
+    assert 1 == ocd.Reg('r0').Read()
+    t.Regs['r0'] = 2
+    Changes[Name](ocd)
+    Count = t.Count['reg']
+    assert 2 == ocd.Reg('r0').Read()
+    assert Count + 1 == t.Count['reg']
+
+def test_invalidated_by_halt_event():
+    t, ocd = Session()
+    t.HaltScript = [0x08000200]
+    t.HaltDelay = 0.05
+    ocd.Resume()
+    t.Regs['r0'] = 1
+    assert 1 == ocd.Reg('r0').Read()
+    t.Regs['r0'] = 2
+    ocd.Readout()
+    Count = t.Count['reg']
+    assert 0x08000200 == ocd.Reg('pc').Read()
+    assert Count == t.Count['reg']
+    assert 2 == ocd.Reg('r0').Read()
+    assert Count + 1 == t.Count['reg']
+
+def test_invalidated_by_wait_halt():
+    t, ocd = Session()
+    t.HaltScript = [0x08000300]
+    t.HaltDelay = 0.05
+    ocd.Resume()
+    ocd.Reg('r5').Read()
+    assert ocd.WaitHalt(2) is not None
+    Count = t.Count['reg']
+    assert 0x08000300 == ocd.Reg('pc').Read()
+    assert Count == t.Count['reg']
+    ocd.Reg('r5').Read()
+    assert Count + 1 == t.Count['reg']
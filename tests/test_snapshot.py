@@ -0,0 +1,104 @@
+import pytest
+
+from OpenOCD import OpenOCD, GdbOCD, SnapshotStore
+import gdbsim
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+Regions = [(0x20000000, 0x2000), (0x20010000, 0x400)]
+
+def Change(t):
+    t.Write(0x20000105, b'\x99\x98')
+    t.Write(0x20001ff0, b'zz')
+
+def Check(Snap, t):
+    for Addr, Size in Regions:
+        assert t.Read(Addr, Size) == Snap.Data(Addr, Size)
+
+def test_target_block_sums():
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    ocd.BlockSums_ = lambda Addr, Size, BlockSize: [OpenOCD.BlockSum_(t.Read(a, BlockSize)) for a in range(Addr, Addr + Size, BlockSize)]
+
+    First = ocd.Snapshot(Regions)
+    assert 0x2400 == First.Transferred
+    Change(t)
+    Second = ocd.Snapshot(Regions)
+    assert 2 * 0x100 == Second.Transferred
+    Check(Second, t)
+    assert [(0x20000105, 2), (0x20001ff0, 2)] == First.Delta(Second)
+    assert 30 == sum([a is b for a, b in zip(First.Blocks[0], Second.Blocks[0])])
+    assert 0 == ocd.Snapshot(Regions).Transferred
+
+def test_full_read_fallback():
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    First = ocd.Snapshot(Regions)
+    Change(t)
+    Second = ocd.Snapshot(Regions)
+    assert 0x2400 == Second.Transferred
+    Check(Second, t)
+    assert [(0x20000105, 2), (0x20001ff0, 2)] == First.Delta(Second)
+
+def test_gdb_region_crc():
+    Server = gdbsim.GdbServer(PacketSize=0x3fff)
+    t = Server.Target
+    ocd = GdbOCD('127.0.0.1', Server.Port)
+    First = ocd.Snapshot(Regions)
+    Change(t)
+
+    Server.Count.clear()
+    Second = ocd.Snapshot(Regions)
+    Check(Second, t)
+    assert 2 == Server.Count['qCRC']
+    assert 0x2000 == Second.Transferred and 2 == Server.Count['m']
+    assert Second.Blocks[1] == First.Blocks[1] and all([a is b for a, b in zip(First.Blocks[1], Second.Blocks[1])])
+
+    Server.Count.clear()
+    assert 0 == ocd.Snapshot(Regions).Transferred
+    assert 2 == Server.Count['qCRC'] and 0 == Server.Count.get('m', 0)
+
+def test_gdb_crc():
+    assert 0xffffffff == GdbOCD.BlockSum_(b'')
+    Crc = 0xffffffff
+    for Byte in bytearray(b'123456789'):
+        Crc ^= Byte << 24
+        for _ in range(8):
+            Crc = ((Crc << 1) ^ 0x04c11db7 if Crc & 0x80000000 else Crc << 1) & 0xffffffff
+    assert Crc == GdbOCD.BlockSum_(b'123456789')
+
+#-------------------------------------------------------------------------------------------------
+
+def test_store(tmp_path):
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    FileName = str(tmp_path / 'session.snap')
+    Store = SnapshotStore(FileName)
+    Snaps = []
+    for k in range(SnapshotStore.KeyInterval + 5):
+        t.Write(0x20000000 + (k * 37) % 0x2000, bytes(bytearray((k,))) * 3)
+        Snaps.append(ocd.Snapshot(Regions))
+        Store.Append(Snaps[-1])
+    Store.Close()
+
+    Store = SnapshotStore(FileName)
+    assert len(Snaps) == len(Store)
+    for k in (0, 1, 5, SnapshotStore.KeyInterval - 1, SnapshotStore.KeyInterval, len(Snaps) - 1, 3):
+        assert Snaps[k].Regions == Store[k].Regions and Snaps[k].Time == Store[k].Time
+        assert Snaps[k].Blocks == Store[k].Blocks
+    assert Snaps[10].Delta(Snaps[11]) == Store[10].Delta(Store[11])
+
+    Store.Append(ocd.Snapshot([(0x20000000, 0x100)]))
+    assert [(0x20000000, 0x100)] == Store[len(Snaps)].Regions
+    Store.Close()
+    assert len(Snaps) + 1 == len(SnapshotStore(FileName))
+
+def test_store_not_snapshot_file(tmp_path):
+    FileName = tmp_path / 'other.bin'
+    FileName.write_bytes(b'garbage file contents')
+    with pytest.raises(ValueError):
+        SnapshotStore(str(FileName))
@@ -0,0 +1,93 @@
+import pytest
+
+from OpenOCD import OpenOCD, ElfFile, SymbolTable
+import elfgen
+
+#-------------------------------------------------------------------------------------------------
+
+Symbols = [('Reset_Handler', 0x08000101, 0x20, ElfFile.STT_FUNC),
+           ('main', 0x08000121, 0x40, ElfFile.STT_FUNC),
+           ('SystemCoreClock', 0x20000000, 4, ElfFile.STT_OBJECT),
+           ('buf', 0x20000010, 0x100, ElfFile.STT_OBJECT),
+           ('file.c', 0, 0, 4)]
+
+@pytest.mark.parametrize('Bits', [32, 64])
+@pytest.mark.parametrize('Order', ['<', '>'])
+def test_elf(Bits, Order):
+    Elf = ElfFile(elfgen.Build([(0x08000000, b'\x01\x02\x03'), (0x20000000, b'data')], Symbols, Bits, Order))
+    assert Bits == Elf.Bits and ElfFile.EM_ARM == Elf.Machine
+    assert [(0x08000000, b'\x01\x02\x03'), (0x20000000, b'data')] == [(Addr, bytes(Data)) for Addr, Data in Elf.Segments()]
+    assert [Sym[:3] for Sym in Symbols] == [Sym[:3] for Sym in Elf.Symbols()]
+
+def test_elf_64bit_addresses():
+    Elf = ElfFile(elfgen.Build([(0x100000000, b'x')], [('high', 0x100000010, 8, ElfFile.STT_OBJECT)], 64, Machine=183))
+    assert [(0x100000000, b'x')] == [(Addr, bytes(Data)) for Addr, Data in Elf.Segments()]
+    assert [('high', 0x100000010, 8, ElfFile.STT_OBJECT)] == list(Elf.Symbols())
+
+def test_not_elf():
+    with pytest.raises(ValueError):
+        ElfFile(b'MZ' + b'\0' * 64)
+
+@pytest.fixture
+def Firmware(tmp_path, monkeypatch):
+    monkeypatch.setattr(SymbolTable, 'CacheDir', str(tmp_path / 'cache'))
+    FileName = str(tmp_path / 'fw.elf')
+    with open(FileName, 'wb') as f:
+        f.write(elfgen.Build([(0x08000000, b'\0' * 0x200)], Symbols))
+    return FileName
+
+def test_table(Firmware):
+    Table = SymbolTable.FromElf(Firmware)
+    assert 4 == len(Table)
+    assert ['Reset_Handler', 'main', 'SystemCoreClock', 'buf'] == Table.Names
+    assert ('Reset_Handler', 0x08000100) == Table.Lookup(0x08000100)
+    assert ('main', 0x08000120) == Table.Lookup(0x0800015f)
+    assert Table.Lookup(0x08000160) is None
+    assert Table.Lookup(0x07ffffff) is None
+
+def test_names(Firmware):
+    Table = SymbolTable.FromElf(Firmware)
+    assert 0x08000100 == Table.Address('Reset_Handler')
+    assert 0x20000014 == Table.Address('buf+4')
+    assert 0x20000014 == Table.Address('buf + 0x4')
+    assert 0x100 == Table.Size('buf')
+    assert 'main+0x4' == Table.Symbolize(0x08000124)
+    assert 'main' == Table.Symbolize(0x08000120)
+    assert '0x07ffffff' == Table.Symbolize(0x07ffffff)
+    with pytest.raises(ValueError):
+        Table.Address('nosuch')
+
+def test_cache(Firmware, tmp_path):
+    Table = SymbolTable.Load(Firmware)
+    Cached = list((tmp_path / 'cache').iterdir())
+    assert 1 == len(Cached)
+    Again = SymbolTable.Load(Firmware)
+    assert list(Table.Starts) == list(Again.Starts) and Table.Names == Again.Names
+    assert list(Table.Sizes) == list(Again.Sizes)
+
+def test_cache_broken(Firmware, tmp_path):
+    SymbolTable.Load(Firmware)
+    Cached, = list((tmp_path / 'cache').iterdir())
+    Cached.write_bytes(b'garbage' * 4)
+    assert 0x20000010 == SymbolTable.Load(Firmware).Address('buf')
+
+def test_pack_empty():
+    assert 0 == len(SymbolTable.Unpack_(SymbolTable().Pack_()))
+
+def test_range(Firmware):
+    ocd = OpenOCD.__new__(OpenOCD)
+    ocd.Symbols = None
+    with pytest.raises(ValueError):
+        ocd.Range_('buf', None)
+    with pytest.raises(ValueError):
+        OpenOCD.HexView(b'1234', 'buf')
+
+    ocd.Symbols = SymbolTable.FromElf(Firmware)
+    assert (0x20000010, 0x100) == ocd.Range_('buf', None)
+    assert (0x20000020, 0xf0) == ocd.Range_('buf+0x10', None)
+    assert (0x20000020, 4) == ocd.Range_('buf+0x10', 4)
+    assert (0x2000010f, 1) == ocd.Range_('buf+0xff', None)
+    with pytest.raises(ValueError):
+        ocd.Range_('buf+0x100', None)
+    with pytest.raises(ValueError):
+        ocd.Range_(0x20000000, None)
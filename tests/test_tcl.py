@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('tkinter')
+
+from OpenOCD import OpenOCD, TclTransport
+import tclsim
+
+#-------------------------------------------------------------------------------------------------
+
+def Session(**Args):
+    Server = tclsim.TclServer(**Args)
+    return Server, OpenOCD('127.0.0.1', Server.Port, TclTransport)
+
+def test_framing():
+    Server, ocd = Session()
+    tn = ocd.tn
+    assert ['Tcl Notifications: on'] == tn.Banner
+    assert '3' == tn.Eval('expr {1 + 2}')
+    assert 'a\nb' == tn.Eval('return "a\\nb"')
+
+    tn.Buf += b'par'
+    assert tn.Split_() is None
+    tn.Buf += b'tial\x1a\x1anext\x1a'
+    assert ['partial', '', 'next'] == [tn.Split_(), tn.Split_(), tn.Split_()]
+    assert tn.Split_() is None
+
+def test_pipelined_results():
+    Server, ocd = Session()
+    ocd.tn.Write('version\nmdw 0x20000000 2\nexpr 6*7')
+    assert ['version', 'Open On-Chip Debugger 0.12.0'] == ocd.tn.Readout()
+    Lines = ocd.tn.Readout()
+    assert 'mdw 0x20000000 2' == Lines[0]
+    assert '0x20000000: 03020100 07060504' == Lines[1].strip()
+    assert ['expr 6*7', '42'] == ocd.tn.Readout()
+
+def test_capture_error():
+    Server, ocd = Session()
+    assert ['nosuch 1', 'invalid command name "nosuch"'] == ocd.Exec('nosuch', '1')
+    assert 'boom' == ocd.tn.Eval('error boom')
+    assert ['version', 'Open On-Chip Debugger 0.12.0'] == ocd.Exec('version')
+
+def test_memory_and_registers():
+    Server, ocd = Session()
+    t = Server.Target
+    Data = os.urandom(301)
+    ocd.WriteMem(0x20000001, Data)
+    assert t.Read(0x20000001, len(Data)) == Data
+    assert ocd.ReadMem(0x20000001, len(Data)) == Data
+    assert 0x03020100 == ocd.ReadMem32(0x30000000)
+
+    t.Regs['r2'] = 0x1234
+    assert 0x1234 == ocd.Reg('r2', Force=True).Read()
+    ocd.Reg('r3').Write(0xcafe)
+    assert 0xcafe == t.Regs['r3']
+
+def test_notification_delivery():
+    Server, ocd = Session()
+    t = Server.Target
+    t.HaltScript = [0x08000200]
+    ocd.Resume()
+    assert ['type target_event event halted'] == ocd.Readout()
+    assert 0x08000200 == ocd.Reg('pc').Read()
+
+def test_notification_before_result():
+    Server, ocd = Session()
+    t = Server.Target
+    t.HaltScript = [0x08000300]
+    ocd.Resume()
+    time.sleep(0.05)
+    assert ['version', 'Open On-Chip Debugger 0.12.0'] == ocd.Exec('version')
+    assert ['type target_event event halted'] == ocd.tn.Events
+    assert ['type target_event event halted'] == ocd.Readout()
+    assert [] == ocd.tn.Events
+
+def test_wait_halt():
+    Server, ocd = Session()
+    t = Server.Target
+    t.HaltDelay = 0.05
+    ocd.Resume()
+    assert ocd.WaitHalt(0.05) is None
+    t.HaltScript = [0x08000400]
+    ocd.tn.Eval('resume')
+    assert ['type target_event event halted'] == ocd.WaitHalt(2)
+    assert 0x08000400 == ocd.Reg('pc').Read()
@@ -0,0 +1,142 @@
+import io
+
+import pytest
+
+from OpenOCD import OpenOCD
+import ocdsim
+
+#-------------------------------------------------------------------------------------------------
+
+F = 0x08001000
+G = 0x08002000
+H = 0x08003000
+Main = 0x08000200
+SP = 0x20001000
+
+Tracer = OpenOCD.TracerOCD
+
+def Session(Functions, MaxHW):
+    Server = ocdsim.TelnetServer()
+    t = Server.Target
+    t.HaltDelay = 0.001
+    ocd = OpenOCD('127.0.0.1', Server.Port)
+    return t, ocd.Tracer(Functions, Log=io.BytesIO(), MaxHW=MaxHW)
+
+def Call(Func, Ret, Sp, *Args):
+    Regs = {'pc': Func, 'lr': Ret | 1, 'sp': Sp}
+    Regs.update(('r%d' % n, Arg) for n, Arg in enumerate(Args))
+    return Regs
+
+def Return(Ret, Sp, r0=0):
+    return {'pc': Ret, 'sp': Sp, 'r0': r0}
+
+#
+# Feed stops one by one: each must be at an enabled breakpoint, within MaxHW comparators.
+#
+def Trace(t, Trc, Script):
+    for Regs in Script:
+        assert Regs['pc'] in t.BPs
+        t.HaltScript = [Regs]
+        assert Trc.Run(1) is None
+        assert len(t.BPs) <= Trc.MaxHW
+
+def Events(Trc):
+    Trc.Log.seek(0)
+    return [(e.Kind, e.Depth, e.Func, e.Addr) for e in Tracer.ReadTrace(Trc.Log)]
+
+def test_nested_calls():
+    t, Trc = Session([(F, 'f'), (G, 'g')], 4)
+    assert {F: 2, G: 2} == t.BPs
+    Trace(t, Trc, [
+        Call(F, Main, SP, 1, 2, 3, 4),
+        Call(G, F + 0x10, SP - 0x10, 5),
+        Return(F + 0x10, SP - 0x10, 7),
+    ])
+    assert sorted([F, G, Main]) == sorted(t.BPs)
+    Trace(t, Trc, [Return(Main, SP, 9)])
+
+    assert {F: 2, G: 2} == t.BPs
+    assert {} == Trc.Returns and [] == Trc.Frames
+    assert 4 == Trc.Hits and 0 == Trc.Lost
+    assert 4 == t.Count['reg']
+    assert [(Tracer.ENTRY, 0, F, Main), (Tracer.ENTRY, 1, G, F + 0x10),
+            (Tracer.RETURN, 1, G, F + 0x10), (Tracer.RETURN, 0, F, Main)] == Events(Trc)
+    Trc.Log.seek(0)
+    Entry, _, _, Ret = Tracer.ReadTrace(Trc.Log)
+    assert [1, 2, 3, 4] == Entry.Args
+    assert 9 == Ret.Args[0]
+
+def test_recursion():
+    t, Trc = Session([F], 4)
+    Trace(t, Trc, [
+        Call(F, Main, SP),
+        Call(F, F + 0x20, SP - 0x10),
+        Call(F, F + 0x20, SP - 0x20),
+    ])
+    assert {Main: 1, F + 0x20: 2} == Trc.Returns
+    assert 3 == len(t.BPs)
+    Trace(t, Trc, [Return(F + 0x20, SP - 0x20, 3)])
+    assert F + 0x20 in t.BPs
+    Trace(t, Trc, [Return(F + 0x20, SP - 0x10, 2)])
+    assert F + 0x20 not in t.BPs
+    Trace(t, Trc, [Return(Main, SP, 1)])
+    assert [(Tracer.ENTRY, 0), (Tracer.ENTRY, 1), (Tracer.ENTRY, 2),
+            (Tracer.RETURN, 2), (Tracer.RETURN, 1), (Tracer.RETURN, 0)] == [e[:2] for e in Events(Trc)]
+    assert {F: 2} == t.BPs
+
+def test_parking():
+    t, Trc = Session([F, G, H], 3)
+    Trace(t, Trc, [Call(F, Main, SP)])
+    assert [G] == Trc.Parked
+    assert sorted([F, H, Main]) == sorted(t.BPs)
+
+    Trace(t, Trc, [Call(H, F + 0x10, SP - 0x10)])
+    assert [G, F] == Trc.Parked
+    assert sorted([H, Main, F + 0x10]) == sorted(t.BPs)
+
+    Trace(t, Trc, [Return(F + 0x10, SP - 0x10)])
+    assert [G] == Trc.Parked
+    assert sorted([F, H, Main]) == sorted(t.BPs)
+
+    Trace(t, Trc, [Return(Main, SP)])
+    assert [] == Trc.Parked
+    assert sorted([F, G, H]) == sorted(t.BPs)
+    assert 0 == Trc.Lost
+
+def test_too_many_functions():
+    with pytest.raises(ValueError):
+        Session([F, G, H], 2)
+
+def test_lost_frames():
+    t, Trc = Session([F, G], 4)
+    Trace(t, Trc, [
+        Call(F, Main, SP),
+        Call(G, F + 0x10, SP - 0x10),
+        Call(G, G + 0x10, SP - 0x20),
+        Return(Main, SP),
+    ])
+    assert 2 == Trc.Lost
+    assert [(Tracer.ENTRY, 0, F, Main), (Tracer.ENTRY, 1, G, F + 0x10), (Tracer.ENTRY, 2, G, G + 0x10),
+            (Tracer.LOST, 2, G, G + 0x10), (Tracer.LOST, 1, G, F + 0x10), (Tracer.RETURN, 0, F, Main)] == Events(Trc)
+    assert {F: 2, G: 2} == t.BPs
+    assert {} == Trc.Returns
+
+def test_lost_without_comparator():
+    t, Trc = Session([F, G], 2)
+    Trace(t, Trc, [
+        Call(F, G, SP),
+        Call(F, F, SP - 0x10),
+        Call(F, F + 0x10, SP - 0x20),
+    ])
+    assert 1 == Trc.Lost
+    assert (Tracer.LOST, 2, F, F + 0x10) == Events(Trc)[-1]
+    assert {G: 1, F: 1} == Trc.Returns
+    assert sorted([F, G]) == sorted(t.BPs)
+
+def test_stop_elsewhere():
+    t, Trc = Session([F], 4)
+    t.HaltScript = [Call(F, Main, SP), Return(Main, SP), 0x08000400]
+    assert 0x08000400 == Trc.Run()
+    assert 2 == Trc.Hits
+    Trc.Close()
+    assert {} == t.BPs